@@ -3,7 +3,7 @@ This module defines various agents for processing SQL queries and rewriting ques
 Each agent is configured with specific roles, constraints, and output formats.
 """
 
-from src.agent import Agent, AgentConfig
+from src.agent import Agent, AgentConfig, AgentTemplate
 from utils import extract_company_code
 import config
 
@@ -23,7 +23,7 @@ agent_rewrite_question = Agent(
         stream=False,
     )
 )
-agent_extract_company = Agent(
+agent_extract_company_template = AgentTemplate(
     AgentConfig(
         llm=config.llm_plus,
         name="extract_company",
@@ -37,13 +37,14 @@ agent_extract_company = Agent(
         post_process=extract_company_code,
         enable_history=False,
         stream=False,
+        system_prompt_kv={
+            "ENTITY EXAMPLE": (
+                "居然之家",
+                "ABCD",
+            ),
+        },
     )
 )
-agent_extract_company.add_system_prompt_kv(
-    {
-        "ENTITY EXAMPLE": (
-            "居然之家",
-            "ABCD",
-        ),
-    }
-)
+agent_extract_company = agent_extract_company_template.create_agent_instance()
+# 预取同组下一个问题的实体时使用，和agent_extract_company互不干扰
+agent_extract_company_prefetch = agent_extract_company_template.create_agent_instance()
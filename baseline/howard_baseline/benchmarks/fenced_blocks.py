@@ -0,0 +1,105 @@
+"""
+Microbenchmark: the single-pass fenced block parser in src/utils.py against the previous
+regex-per-call implementations of count_total_sql / extract_last_sql / extract_last_json.
+extract_last_json keeps a dedicated precompiled regex, which is faster than parsing every block.
+
+    python benchmarks/fenced_blocks.py
+"""
+
+import os
+import re
+import sys
+import timeit
+from typing import Optional
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import extract_last_json, parse_fenced_blocks, split_sql_statements  # noqa: E402
+
+
+def legacy_extract_last_sql(query_string: str, block_mark: str) -> Optional[str]:
+    sql_pattern = re.compile(rf"(?s)```{re.escape(block_mark)}\s+(.*?)\s+```")
+    matches = sql_pattern.findall(query_string)
+    if matches:
+        last_sql_block = matches[-1].strip()
+        last_sql_block = re.sub(r"--.*(?=\n)|--.*$", "", last_sql_block)
+        sql_statements = [stmt.strip() for stmt in last_sql_block.split(";") if stmt.strip()]
+        return sql_statements[-1] + ";" if sql_statements else None
+    return None
+
+
+def legacy_count_total_sql(query_string: str, block_mark: str) -> int:
+    sql_pattern = re.compile(rf"(?s)```{re.escape(block_mark)}\s+(.*?)\s+```")
+    matches = sql_pattern.findall(query_string)
+    total_sql_count = 0
+    for sql_block in matches:
+        sql_block = re.sub(r"--.*(?=\n)|--.*$", "", sql_block)
+        sql_statements = [stmt.strip() for stmt in sql_block.split(";") if stmt.strip()]
+        total_sql_count += len(sql_statements)
+    return total_sql_count
+
+
+def legacy_extract_last_json(text: str) -> Optional[str]:
+    matches = re.findall(r"```json(.*?)```", text, re.DOTALL)
+    return matches[-1].strip() if matches else None
+
+
+MASTER_ANSWER = (
+    "【已知信息】\n" + "公司A的InnerCode是1234，CompanyCode是5678。\n" * 20 + "【执行SQL语句】\n"
+    "```exec_sql\n"
+    "-- 查询2021年的数据\n"
+    "SELECT InnerCode, ChiNameAbbr, `Rank` FROM astockshareholderdb.lc_mainshlistnew\n"
+    "WHERE InnerCode = 1234 AND YEAR(EndDate) = '2021' AND SHName LIKE '%有限公司%'\n"
+    "ORDER BY EndDate DESC LIMIT 10;\n"
+    "```\n"
+    "【上述SQL语句的含义】\n" + "查询前十大股东。\n" * 10
+)
+SELECTOR_ANSWER = (
+    "分析过程。\n" * 30 + '```json\n["constantdb.secumain", "astockshareholderdb.lc_mainshlistnew"]\n```\n'
+)
+
+
+def legacy_master() -> Optional[str]:
+    if legacy_count_total_sql(MASTER_ANSWER, "exec_sql") > 1:
+        return None
+    return legacy_extract_last_sql(MASTER_ANSWER, "exec_sql")
+
+
+def single_pass_master() -> Optional[str]:
+    statements = [
+        split_sql_statements(block.content) for block in parse_fenced_blocks(MASTER_ANSWER) if block.kind == "exec_sql"
+    ]
+    if sum(len(stmts) for stmts in statements) > 1:
+        return None
+    return statements[-1][-1] + ";" if statements and statements[-1] else None
+
+
+def main():
+    # 字符串里的分号：旧实现会拆成两条语句而拒绝执行
+    tricky = "```exec_sql\nSELECT * FROM t WHERE name = 'a;b' -- note\n```"
+    print(f"literal semicolon: legacy count={legacy_count_total_sql(tricky, 'exec_sql')}, ", end="")
+    print(f"single-pass count={sum(len(split_sql_statements(b.content)) for b in parse_fenced_blocks(tricky))}")
+
+    number = 20000
+    cases = [
+        ("master answer (count + extract)", legacy_master, single_pass_master),
+        (
+            "selector answer (json)",
+            lambda: legacy_extract_last_json(SELECTOR_ANSWER),
+            lambda: extract_last_json(SELECTOR_ANSWER),
+        ),
+    ]
+    for name, legacy, current in cases:
+        assert legacy() == current(), (legacy(), current())
+        legacy_time = min(timeit.repeat(legacy, number=number, repeat=5))
+        current_time = min(timeit.repeat(current, number=number, repeat=5))
+        print(
+            f"{name}: legacy {legacy_time / number * 1e6:.2f}us, "
+            f"current {current_time / number * 1e6:.2f}us, "
+            f"speedup x{legacy_time / current_time:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,23 @@
-"""This module handles the configuration and data loading for the application."""
+"""
+This module handles the configuration and data loading for the application.
+Assets and LLMs are loaded lazily on first attribute access (e.g. config.table_column),
+so importing config is cheap for tools and worker processes that don't need them.
+"""
 
 import json
 import os
+import threading
 import llms
+from src.asset_cache import load_or_build
+from src.schema_catalog import SchemaCatalog
+from src.value_index import ValueIndex
+from src.entity_resolver import EntityResolver
 
 ROOT_DIR = os.getcwd()
-with open(ROOT_DIR + "/assets/db_info.json", encoding="utf-8") as file:
-    dbs_info = file.read()
-with open(ROOT_DIR + "/assets/db_table.json", encoding="utf-8") as file:
-    db_table = json.loads(file.read())
-with open(ROOT_DIR + "/assets/table_column.json", encoding="utf-8") as file:
-    table_column = json.loads(file.read())
-with open("../../assets/question.json", "r", encoding="utf-8") as file:
-    all_question = json.load(file)
-
-
-for cols in table_column.values():
-    for col in cols:
-        # col["desc"] = re.sub(r'(?<=；)[^；]*?与[^；]*?关联', '', col["desc"])
-        if col["column"] == "SHKind":
-            col["desc"] += (
-                "枚举值:资产管理公司,一般企业,投资、咨询公司,风险投资公司,自然人,其他金融产品,信托公司集合信托计划,金融机构—证券公司,保险投资组合,开放式投资基金,企业年金,信托公司单一证券信托,社保基金、社保机构,金融机构—银行,金融机构—期货公司,基金专户理财,国资局,券商集合资产管理计划,基本养老保险基金,金融机构—信托公司,院校—研究院,金融机构—保险公司,公益基金,保险资管产品,财务公司,基金管理公司,金融机构—金融租赁公司"
-            )
-
-column_mapping = {}
-for db_name, db in dict(db_table).items():
-    for table in db["表"]:
-        table_name = table["表英文"]
-        column_mapping[f"{db_name}.{table_name}"] = {}
-        for col in table_column[table_name]:
-            column_mapping[f"{db_name}.{table_name}"][col["column"]] = str(col["desc"]).split("；", maxsplit=1)[0]
+QUESTION_PATH = "../../assets/question.json"
+TABLES_SCHEMA_PATH = "../../assets/all_tables_schema.txt"
+SCHEMA_CACHE_PATH = ROOT_DIR + "/assets/schema_cache.pkl"  # 数据库结构派生数据的缓存，源文件变化时自动重建
+SCHEMA_ASSETS_VERSION = 1  # 修改_build_schema_assets的构建逻辑后需要加一
 
 import_column_names = {
     "InnerCode",
@@ -49,17 +37,169 @@ import_column_names = {
     "FirstPublDate",
 }
 
-enum_columns = {}
-for t_name, table in table_column.items():
-    filtered_columns = {col["column"]: col["desc"] for col in table if "具体描述" in col["desc"]}
-    if filtered_columns:
-        enum_columns[t_name] = filtered_columns
-
 MAX_ITERATE_NUM = 20
+SQL_STALL_TURNS = 3  # SQL Query工作流连续多少轮没有进展（重复SQL、重复结果、重复错误）就停止迭代
 MAX_SQL_RESULT_ROWS = 100
+SQL_COUNT_PROBE = True  # 查询结果恰好有MAX_SQL_RESULT_ROWS行时，用COUNT(*)探测真实总行数并告诉LLM
+HISTORY_FACTS_MAX_TOKENS = 1500  # 每个问题注入的同组历史事实的token上限
+HISTORY_FACTS_TOP_K = 8  # 每个问题最多注入多少条同组历史事实
+SQL_RESULT_WORKSPACE = True  # 每个问题的查询结果保存为内存表@result_N，引用它们或不查询数据表的SQL在本地执行
+SQL_CANDIDATES = 1  # 大于1时，上一次SQL出错或结果为空后生成多个候选SQL并发执行，按结果集投票
+SQL_MAX_HISTORY_TOKENS = 24000  # SQL Query工作流迭代消息的估计token上限，超过时压缩较早的迭代
+SQL_REWRITE = True  # SQL Query工作流执行SQL前用规则修正或拦截常见的错误写法，见src/sql_rewrite.py
+SQL_TIMEOUT = 30  # 单次SQL查询的超时时间(秒)
+SQL_MAX_RETRIES = 3  # SQL查询接口连接失败、5xx时的最大重试次数
+SQL_MAX_CONCURRENCY = 8  # 同时在途的SQL查询数上限
+SQL_BACKEND = "remote"  # SQL执行后端: remote(比赛查询接口) 或 local(本地镜像)
+SQL_ASYNC = False  # 为True时SQL Query工作流运行异步版本arun，SQL通过异步接口(httpx)执行
+LOCAL_MIRROR_PATH = ROOT_DIR + "/assets/mirror.sqlite"  # 本地镜像文件，由 python -m src.local_mirror 生成
+SCHEMA_CACHE_THRESHOLD = 0.85  # 选表缓存的问题相似度阈值
+QUESTION_MAX_SECONDS = 600  # 单个问题的时间预算(秒)，None表示不限制
+QUESTION_MAX_TOKENS = None  # 单个问题的LLM token预算，None表示不限制
+QUESTION_MAX_SQL_CALLS = 30  # 单个问题最多执行的SQL次数，None表示不限制
+
+VALUE_INDEX_PATH = ROOT_DIR + "/assets/value_index.json"
+COMPANY_SNAPSHOT_PATH = ROOT_DIR + "/assets/company_snapshot.json"
 
 START_INDEX = [0, 0]  # 起始下标 [team_index, question_idx]
-END_INDEX = [len(all_question) - 1, len(all_question[-1]["team"]) - 1]  # 结束下标 [team_index, question_idx] (包含)
+# END_INDEX 结束下标 [team_index, question_idx] (包含)，默认是最后一个问题，见_load_end_index
 SAVE_FILE_SUBFIX = ""
 
-llm_plus = llms.llm_glm_4_plus
+LLM_PLUS = "glm_4_plus"  # 使用的LLM，见llms.LLM_REGISTRY
+
+
+def _read_json(path: str):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _load_dbs_info() -> str:
+    with open(ROOT_DIR + "/assets/db_info.json", encoding="utf-8") as file:
+        return file.read()
+
+
+def _load_table_column() -> dict:
+    table_column = _read_json(ROOT_DIR + "/assets/table_column.json")
+    for cols in table_column.values():
+        for col in cols:
+            # col["desc"] = re.sub(r'(?<=；)[^；]*?与[^；]*?关联', '', col["desc"])
+            if col["column"] == "SHKind":
+                col["desc"] += (
+                    "枚举值:资产管理公司,一般企业,投资、咨询公司,风险投资公司,自然人,其他金融产品,信托公司集合信托计划,金融机构—证券公司,保险投资组合,开放式投资基金,企业年金,信托公司单一证券信托,社保基金、社保机构,金融机构—银行,金融机构—期货公司,基金专户理财,国资局,券商集合资产管理计划,基本养老保险基金,金融机构—信托公司,院校—研究院,金融机构—保险公司,公益基金,保险资管产品,财务公司,基金管理公司,金融机构—金融租赁公司"
+                )
+    return table_column
+
+
+def _load_column_mapping(db_table: dict, table_column: dict) -> dict:
+    column_mapping = {}
+    for db_name, db in dict(db_table).items():
+        for table in db["表"]:
+            table_name = table["表英文"]
+            column_mapping[f"{db_name}.{table_name}"] = {}
+            for col in table_column[table_name]:
+                column_mapping[f"{db_name}.{table_name}"][col["column"]] = str(col["desc"]).split("；", maxsplit=1)[0]
+    return column_mapping
+
+
+def _load_enum_columns(table_column: dict) -> dict:
+    enum_columns = {}
+    for t_name, table in table_column.items():
+        filtered_columns = {col["column"]: col["desc"] for col in table if "具体描述" in col["desc"]}
+        if filtered_columns:
+            enum_columns[t_name] = filtered_columns
+    return enum_columns
+
+
+def _build_schema_assets() -> dict:
+    from src.local_mirror import parse_tables_schema  # pylint: disable=import-outside-toplevel
+
+    db_table = _read_json(ROOT_DIR + "/assets/db_table.json")
+    table_column = _load_table_column()
+    tables_schema = None
+    if os.path.exists(TABLES_SCHEMA_PATH):
+        with open(TABLES_SCHEMA_PATH, encoding="utf-8") as file:
+            tables_schema = parse_tables_schema(file.read())
+    return {
+        "dbs_info": _load_dbs_info(),
+        "db_table": db_table,
+        "table_column": table_column,
+        "schema_catalog": SchemaCatalog(db_table, table_column),
+        "column_mapping": _load_column_mapping(db_table, table_column),
+        "enum_columns": _load_enum_columns(table_column),
+        "tables_schema": tables_schema,
+    }
+
+
+def _load_schema_assets() -> dict:
+    # 所有由数据库结构文件派生的数据放在同一个缓存文件里，任何源文件变化都会自动重建
+    assets = load_or_build(
+        SCHEMA_CACHE_PATH,
+        sources=[
+            ROOT_DIR + "/assets/db_info.json",
+            ROOT_DIR + "/assets/db_table.json",
+            ROOT_DIR + "/assets/table_column.json",
+            TABLES_SCHEMA_PATH,
+        ],
+        build=_build_schema_assets,
+        version=SCHEMA_ASSETS_VERSION,
+    )
+    # 登记为共享目录，SchemaCatalog.shared(config.db_table, config.table_column)直接复用，不再构建第二份
+    assets["schema_catalog"] = SchemaCatalog.register(assets["schema_catalog"])
+    return assets
+
+
+def _load_entity_resolver():
+    if not os.path.exists(COMPANY_SNAPSHOT_PATH):
+        return None
+    return EntityResolver.from_snapshot(
+        COMPANY_SNAPSHOT_PATH,
+        result_fields=(
+            "TableName",
+            "InnerCode",
+            "CompanyCode",
+            "ChiName",
+            "EngName",
+            "SecuCode",
+            "ChiNameAbbr",
+            "EngNameAbbr",
+            "SecuAbbr",
+            "ChiSpelling",
+        ),
+    )
+
+
+def _load_end_index() -> list:
+    all_question = _lazy("all_question")
+    return [len(all_question) - 1, len(all_question[-1]["team"]) - 1]
+
+
+_LAZY_LOADERS = {
+    "schema_assets": _load_schema_assets,
+    "dbs_info": lambda: _lazy("schema_assets")["dbs_info"],
+    "db_table": lambda: _lazy("schema_assets")["db_table"],
+    "table_column": lambda: _lazy("schema_assets")["table_column"],
+    "schema_catalog": lambda: _lazy("schema_assets")["schema_catalog"],
+    "column_mapping": lambda: _lazy("schema_assets")["column_mapping"],
+    "enum_columns": lambda: _lazy("schema_assets")["enum_columns"],
+    "tables_schema": lambda: _lazy("schema_assets")["tables_schema"],
+    "all_question": lambda: _read_json(QUESTION_PATH),
+    "value_index": lambda: ValueIndex.load(VALUE_INDEX_PATH) if os.path.exists(VALUE_INDEX_PATH) else None,
+    "entity_resolver": _load_entity_resolver,
+    "END_INDEX": _load_end_index,
+    "llm_plus": lambda: llms.get_llm(LLM_PLUS),
+}
+_lazy_lock = threading.RLock()
+
+
+def _lazy(name: str):
+    # 首次访问时加载，结果写回模块属性，之后的访问不再经过这里
+    with _lazy_lock:
+        if name not in globals():
+            globals()[name] = _LAZY_LOADERS[name]()
+    return globals()[name]
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_LOADERS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return _lazy(name)
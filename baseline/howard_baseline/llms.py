@@ -1,24 +1,48 @@
 """
-This module initializes various language models.
+This module registers the language models by name.
+Models are built on first use, so only the SDK of the backend in use gets imported.
 """
 
 import os
-from src.llm import OllamaLLM, ZhipuLLM, OpenAILLM, extract_answer_from_r1
+import threading
+from typing import Callable
+from src.llm import LLM, OllamaLLM, ZhipuLLM, OpenAILLM, extract_answer_from_r1
 
-## 用于验证提交的版本
-llm_glm_4_plus = ZhipuLLM(api_key=os.getenv("ZHIPU_API_KEY"), model="glm-4-plus")
+LLM_REGISTRY: dict[str, Callable[[], LLM]] = {
+    ## 用于验证提交的版本
+    "glm_4_plus": lambda: ZhipuLLM(api_key=os.getenv("ZHIPU_API_KEY"), model="glm-4-plus"),
+    ## 其他大模型用于
+    "deepseek_r1": lambda: OllamaLLM(
+        host=os.getenv("OLLAMA_HOST"), model="deepseek-r1:14b", post_process=extract_answer_from_r1
+    ),
+    "gpt_4o_mini": lambda: OpenAILLM(
+        api_key=os.getenv("OPENAI_API_KEY"), model="gpt-4o-mini", base_url=os.getenv("OPENAI_BASE_URL")
+    ),
+    "deepseek_v3": lambda: OpenAILLM(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model="deepseek/deepseek-chat",
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        default_stream=True,
+    ),
+}
 
+_llms: dict[str, LLM] = {}
+_llms_lock = threading.Lock()
 
-## 其他大模型用于
-llm_deepseek_r1 = OllamaLLM(
-    host=os.getenv("OLLAMA_HOST"), model="deepseek-r1:14b", post_process=extract_answer_from_r1
-)
-llm_gpt_4o_mini = OpenAILLM(
-    api_key=os.getenv("OPENAI_API_KEY"), model="gpt-4o-mini", base_url=os.getenv("OPENAI_BASE_URL")
-)
-llm_deepseek_v3 = OpenAILLM(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    model="deepseek/deepseek-chat",
-    base_url=os.getenv("OPENAI_BASE_URL"),
-    default_stream=True,
-)
+
+def get_llm(name: str) -> LLM:
+    """按名称获取LLM，首次使用时创建，之后复用同一个实例"""
+    if name not in _llms:
+        if name not in LLM_REGISTRY:
+            raise KeyError(f"未知的LLM: {name}，可选: {', '.join(LLM_REGISTRY)}")
+        with _llms_lock:
+            if name not in _llms:
+                _llms[name] = LLM_REGISTRY[name]()
+    return _llms[name]
+
+
+def __getattr__(name: str) -> LLM:
+    # 兼容 llms.llm_glm_4_plus 这样的写法
+    if name.startswith("llm_") and name[len("llm_") :] in LLM_REGISTRY:
+        return get_llm(name[len("llm_") :])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
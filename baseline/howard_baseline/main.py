@@ -1,20 +1,56 @@
+"""
+Command line entry point: answers the questions in question.json team by team.
+
+    python main.py --start 0,0 --end 9,4 --llm glm_4_plus
+"""
+
 import os
 import json
+import asyncio
 import copy
 import logging
 import time
+import argparse
+from concurrent.futures import Future
+from typing import Optional, Tuple
 from dotenv import load_dotenv
 
-os.environ["DEBUG"] = "0"
-os.environ["SHOW_LLM_INPUT_MSG"] = "1"
-
-load_dotenv()
-
 from src.log import setup_logger, get_logger
+from src.budget import Budget
+from src.dag import StageGraph, get_executor
+from src.retry import retry_stats
 import config
-from agents import agent_rewrite_question, agent_extract_company
-from workflows import sql_query, check_db_structure
-from utils import ajust_org_question
+import llms
+
+
+def extract_entities(agent, question: str, budget: Optional[Budget] = None) -> Tuple[str, int]:
+    """提取问题里的实体并查询实体内部代码，返回 (实体信息, 消耗的token数)"""
+    agent.clear_history()
+    return agent.answer(
+        (
+            """提取下面这段文字中的实体（如公司名、股票代码、拼音缩写等），如果识别结果是空，那么就回复No Entities."""
+            f'''"{question}"'''
+        ),
+        budget=budget,
+    )
+
+
+async def _arun_sql_query(sql_query, inputs: dict) -> dict:
+    from utils import get_sql_client  # pylint: disable=import-outside-toplevel
+
+    try:
+        return await sql_query.arun(inputs)
+    finally:
+        # 异步连接池属于本次的事件循环，循环结束前关闭
+        if config.SQL_BACKEND != "local":
+            await get_sql_client().aclose()
+
+
+def run_sql_query(sql_query, inputs: dict) -> dict:
+    """运行SQL Query工作流，config.SQL_ASYNC为True时用异步版本，SQL通过异步接口执行"""
+    if config.SQL_ASYNC:
+        return asyncio.run(_arun_sql_query(sql_query, inputs))
+    return sql_query.run(inputs)
 
 
 def process_question(question_team: dict, team_idx: int) -> dict:
@@ -28,178 +64,308 @@ def process_question(question_team: dict, team_idx: int) -> dict:
     Returns:
         dict: The processed question team with answers and usage tokens.
     """
+    # 创建agent和workflow时会初始化LLM，所以在用到时才导入
+    from agents import (  # pylint: disable=import-outside-toplevel
+        agent_extract_company,
+        agent_extract_company_prefetch,
+        agent_rewrite_question,
+    )
+    from utils import ajust_org_question  # pylint: disable=import-outside-toplevel
+    from workflows import check_db_structure, sql_query  # pylint: disable=import-outside-toplevel
+
     debug_mode = os.getenv("DEBUG", "0") == "1"
     facts = []
     qas = []
     sql_query.clear_history_facts()
-    for q_idx, question_item in enumerate(question_team["team"]):
-        qid: str = question_item["id"].strip()  # 声明qid的类型为str
-        question = ajust_org_question(question_item["question"])
-        if team_idx == config.START_INDEX[0] and q_idx < config.START_INDEX[1]:
+    # 实体提取不依赖前一个问题的回答，在当前问题执行SQL查询期间预取下一个问题的实体: (问题, Future)
+    prefetch: Optional[Tuple[str, Future]] = None
+    try:
+        for q_idx, question_item in enumerate(question_team["team"]):
+            qid: str = question_item["id"].strip()  # 声明qid的类型为str
+            question = ajust_org_question(question_item["question"])
+            if team_idx == config.START_INDEX[0] and q_idx < config.START_INDEX[1]:
+                qas.extend(
+                    [
+                        {"role": "user", "content": question},
+                        {"role": "assistant", "content": question_item["answer"]},
+                    ]
+                )
+                if "facts" in question_item:
+                    facts = question_item["facts"]
+                if "sql_results" in question_item:
+                    sql_query.fact_store.load(question_item["sql_results"])
+                print(f">>>>> 【SKIP】id: {qid}")
+                continue
+            if team_idx == config.END_INDEX[0] and q_idx > config.END_INDEX[1]:
+                print("----- EXIT -----\n")
+                return question_team
+            start_time = time.time()
+            log_file_path = config.ROOT_DIR + f"/output/{qid}.log"
+            open(log_file_path, "w", encoding="utf-8").close()
+            setup_logger(
+                log_file=log_file_path,
+                log_level=logging.DEBUG,
+            )
+            logger = get_logger()
+
+            print(f">>>>> id: {qid}")
+            print(f">>>>> Original Question: {question_item['question']}")
+            logger.debug("\n>>>>> Original Question: %s\n", question_item["question"])
+            budget = Budget(
+                max_seconds=config.QUESTION_MAX_SECONDS,
+                max_tokens=config.QUESTION_MAX_TOKENS,
+                max_sql_calls=config.QUESTION_MAX_SQL_CALLS,
+            )
+
+            # 实体提取和问题重写互不依赖，并发执行；字段取值提示依赖重写后的问题
+            qas_content = [
+                f"Question: {qa['content']}" if qa["role"] == "user" else f"Answer: {qa['content']}" for qa in qas
+            ]
+
+            def entities_stage(_stage_results):
+                if prefetch is not None and prefetch[0] == question:
+                    try:
+                        answer, tokens = prefetch[1].result()
+                        budget.add_tokens(tokens)
+                        logger.debug("\n>>>>> 使用预取的实体信息\n")
+                        return answer, tokens
+                    except Exception as exc:
+                        logger.debug("\n>>>>> 预取实体失败，重新提取：%s\n", str(exc))
+                return extract_entities(agent_extract_company, question, budget)
+
+            def rewrite_question(_stage_results):
+                agent_rewrite_question.clear_history()
+                new_question, _ = agent_rewrite_question.answer(
+                    (
+                        "历史问答:无。\n"
+                        if len(qas_content) == 0
+                        else "下面是顺序的历史问答:\n'''\n" + "\n".join(qas_content) + "\n'''\n"
+                    )
+                    + f"现在用户继续提问，请根据已知信息，理解当前这个问题的完整含义，并重写这个问题使得单独拿出来看仍然能够正确理解：{question}",
+                    budget=budget,
+                )
+                return new_question
+
+            def build_value_hints(stage_results):
+                if config.value_index is None:
+                    return ""
+                return config.value_index.format_hints(stage_results["rewrite_question"])
+
+            stage_results = (
+                StageGraph()
+                .add("extract_entities", entities_stage)
+                .add("rewrite_question", rewrite_question)
+                .add("value_hints", build_value_hints, deps=("rewrite_question",))
+                .run()
+            )
+            answer, entity_tokens = stage_results["extract_entities"]
+            if answer != "" and answer not in facts:
+                facts.append(answer)
+            new_question = stage_results["rewrite_question"]
+            print(f">>>>> Rewrited Question: {new_question}")
+
+            # 预取下一个问题的实体，和本问题的后续步骤并发执行
+            prefetch = None
+            if q_idx + 1 < len(question_team["team"]) and (
+                team_idx != config.END_INDEX[0] or q_idx + 1 <= config.END_INDEX[1]
+            ):
+                next_question = ajust_org_question(question_team["team"][q_idx + 1]["question"])
+                prefetch = (
+                    next_question,
+                    get_executor().submit(extract_entities, agent_extract_company_prefetch, next_question),
+                )
+
+            # 注入已知事实
+            key_facts = "已知事实"
+            if len(facts) > 0:
+                kv = {key_facts: "\n---\n".join(facts)}
+                sql_query.agent_master.add_system_prompt_kv(kv)
+                check_db_structure.agent_table_selector.add_system_prompt_kv(kv)
+                check_db_structure.agent_column_selector.add_system_prompt_kv(kv)
+            else:
+                sql_query.agent_master.del_system_prompt_kv(key_facts)
+                check_db_structure.agent_table_selector.del_system_prompt_kv(key_facts)
+                check_db_structure.agent_column_selector.del_system_prompt_kv(key_facts)
+            if debug_mode:
+                print(f"\n>>>>> {key_facts}:\n" + "\n---\n".join(facts))
+            logger.debug("\n>>>>> %s:\n%s", key_facts, "\n---\n".join(facts))
+
+            # 注入历史对话
+            key_qas = "历史对话"
+            if len(qas_content) > 0:
+                kv = {key_qas: "\n".join(qas_content)}
+                sql_query.agent_master.add_system_prompt_kv(kv)
+                check_db_structure.agent_table_selector.add_system_prompt_kv(kv)
+                check_db_structure.agent_column_selector.add_system_prompt_kv(kv)
+            else:
+                sql_query.agent_master.del_system_prompt_kv(key_qas)
+                check_db_structure.agent_table_selector.del_system_prompt_kv(key_qas)
+                check_db_structure.agent_column_selector.del_system_prompt_kv(key_qas)
+
+            # 注入字段取值提示
+            key_value_hints = "字段取值提示"
+            value_hints = stage_results["value_hints"]
+            if value_hints != "":
+                kv = {key_value_hints: value_hints}
+                sql_query.agent_master.add_system_prompt_kv(kv)
+                check_db_structure.agent_column_selector.add_system_prompt_kv(kv)
+            else:
+                sql_query.agent_master.del_system_prompt_kv(key_value_hints)
+                check_db_structure.agent_column_selector.del_system_prompt_kv(key_value_hints)
+            if debug_mode:
+                print(f"\n>>>>> {key_value_hints}:\n{value_hints}")
+            logger.debug("\n>>>>> %s:\n%s", key_value_hints, value_hints)
+
+            check_db_structure.clear_history()
+            res = check_db_structure.run(
+                inputs={"messages": [{"role": "user", "content": new_question}], "budget": budget}
+            )
+            db_info = res["content"]
+
+            sql_query.clear_history()
+
+            res = run_sql_query(
+                sql_query,
+                inputs={
+                    "messages": [
+                        {"role": "assistant", "content": db_info},
+                        {"role": "user", "content": new_question},
+                    ],
+                    "budget": budget,
+                    "fact_hints": "\n".join(facts),
+                },
+            )
+            question_item["answer"] = res["content"]
+            question_item["stop_reason"] = res["stop_reason"]
+            question_item["iterate_num"] = res["iterate_num"]
+            # Caching
             qas.extend(
                 [
                     {"role": "user", "content": question},
                     {"role": "assistant", "content": question_item["answer"]},
                 ]
             )
-            if "facts" in question_item:
-                facts = question_item["facts"]
-            if "sql_results" in question_item:
-                sql_query.history_facts = copy.deepcopy(question_item["sql_results"])
-            print(f">>>>> 【SKIP】id: {qid}")
-            continue
-        if team_idx == config.END_INDEX[0] and q_idx > config.END_INDEX[1]:
-            print("----- EXIT -----\n")
-            return question_team
-        start_time = time.time()
-        log_file_path = config.ROOT_DIR + f"/output/{qid}.log"
-        open(log_file_path, "w", encoding="utf-8").close()
-        setup_logger(
-            log_file=log_file_path,
-            log_level=logging.DEBUG,
-        )
-        logger = get_logger()
-
-        print(f">>>>> id: {qid}")
-        print(f">>>>> Original Question: {question_item['question']}")
-        logger.debug("\n>>>>> Original Question: %s\n", question_item["question"])
-
-        # 获取实体内部代码
-        agent_extract_company.clear_history()
-        answer, _ = agent_extract_company.answer(
-            (
-                """提取下面这段文字中的实体（如公司名、股票代码、拼音缩写等），如果识别结果是空，那么就回复No Entities."""
-                f'''"{question}"'''
-            )
-        )
-        if answer != "" and answer not in facts:
-            facts.append(answer)
-
-        # rewrite question
-        agent_rewrite_question.clear_history()
-        qas_content = [
-            f"Question: {qa['content']}" if qa["role"] == "user" else f"Answer: {qa['content']}" for qa in qas
-        ]
-        new_question, _ = agent_rewrite_question.answer(
-            (
-                "历史问答:无。\n"
-                if len(qas_content) == 0
-                else "下面是顺序的历史问答:\n'''\n" + "\n".join(qas_content) + "\n'''\n"
-            )
-            + f"现在用户继续提问，请根据已知信息，理解当前这个问题的完整含义，并重写这个问题使得单独拿出来看仍然能够正确理解：{question}"
-        )
-        print(f">>>>> Rewrited Question: {new_question}")
-
-        # 注入已知事实
-        key_facts = "已知事实"
-        if len(facts) > 0:
-            kv = {key_facts: "\n---\n".join(facts)}
-            sql_query.agent_master.add_system_prompt_kv(kv)
-            check_db_structure.agent_table_selector.add_system_prompt_kv(kv)
-            check_db_structure.agent_column_selector.add_system_prompt_kv(kv)
-        else:
-            sql_query.agent_master.del_system_prompt_kv(key_facts)
-            check_db_structure.agent_table_selector.del_system_prompt_kv(key_facts)
-            check_db_structure.agent_column_selector.del_system_prompt_kv(key_facts)
-        if debug_mode:
-            print(f"\n>>>>> {key_facts}:\n" + "\n---\n".join(facts))
-        logger.debug("\n>>>>> %s:\n%s", key_facts, "\n---\n".join(facts))
-
-        # 注入历史对话
-        key_qas = "历史对话"
-        if len(qas_content) > 0:
-            kv = {key_qas: "\n".join(qas_content)}
-            sql_query.agent_master.add_system_prompt_kv(kv)
-            check_db_structure.agent_table_selector.add_system_prompt_kv(kv)
-            check_db_structure.agent_column_selector.add_system_prompt_kv(kv)
-        else:
-            sql_query.agent_master.del_system_prompt_kv(key_qas)
-            check_db_structure.agent_table_selector.del_system_prompt_kv(key_qas)
-            check_db_structure.agent_column_selector.del_system_prompt_kv(key_qas)
-
-        check_db_structure.clear_history()
-        res = check_db_structure.run(inputs={"messages": [{"role": "user", "content": new_question}]})
-        db_info = res["content"]
-
-        sql_query.clear_history()
-
-        res = sql_query.run(
-            inputs={
-                "messages": [
-                    {"role": "assistant", "content": db_info},
-                    {"role": "user", "content": new_question},
-                ]
+            elapsed_time = time.time() - start_time
+            question_item["usage_tokens"] = {
+                agent_extract_company.name: entity_tokens,
+                agent_rewrite_question.name: agent_rewrite_question.usage_tokens,
+                check_db_structure.name: check_db_structure.usage_tokens,
+                sql_query.name: sql_query.usage_tokens,
             }
-        )
-        question_item["answer"] = res["content"]
-        # Caching
-        qas.extend(
-            [
-                {"role": "user", "content": question},
-                {"role": "assistant", "content": question_item["answer"]},
-            ]
-        )
-        elapsed_time = time.time() - start_time
-        question_item["usage_tokens"] = {
-            agent_extract_company.name: agent_extract_company.usage_tokens,
-            agent_rewrite_question.name: agent_rewrite_question.usage_tokens,
-            check_db_structure.name: check_db_structure.usage_tokens,
-            sql_query.name: sql_query.usage_tokens,
-        }
-        minutes, seconds = divmod(elapsed_time, 60)
-        question_item["use_time"] = f"{int(minutes)}m {int(seconds)}s"
-        question_item["facts"] = copy.deepcopy(facts)
-        question_item["rewrited_question"] = new_question
-        question_item["sql_results"] = copy.deepcopy(sql_query.history_facts)
-
-        print(f">>>>> Answer: {question_item['answer']}")
-        print(f">>>>> Used Time: {int(minutes)}m {int(seconds)}s\n")
-        with open(config.ROOT_DIR + f"/assets/question.json", "w", encoding="utf-8") as file:
-            json.dump(config.all_question, file, ensure_ascii=False, indent=4)
-    print(f"----- Completed Team Index {i} -----\n")
+            minutes, seconds = divmod(elapsed_time, 60)
+            question_item["use_time"] = f"{int(minutes)}m {int(seconds)}s"
+            question_item["budget"] = budget.summary()
+            question_item["facts"] = copy.deepcopy(facts)
+            question_item["rewrited_question"] = new_question
+            question_item["sql_results"] = sql_query.fact_store.texts()
+
+            print(f">>>>> Answer: {question_item['answer']}")
+            print(f">>>>> Stop Reason: {res['stop_reason']} (iterations: {res['iterate_num']})")
+            print(f">>>>> Used Time: {int(minutes)}m {int(seconds)}s\n")
+            with open(config.ROOT_DIR + f"/assets/question.json", "w", encoding="utf-8") as file:
+                json.dump(config.all_question, file, ensure_ascii=False, indent=4)
+    finally:
+        # 提前退出或出现异常时，丢弃没有用到的预取结果
+        if prefetch is not None:
+            prefetch[1].cancel()
+    print(f"----- Completed Team Index {team_idx} -----\n")
     return question_team
 
 
-for i in range(config.START_INDEX[0], config.END_INDEX[0] + 1):
-    print(f"----- Processing Team Index {i} ... -----\n")
+def save_results():
+    """汇总token用量，去掉中间信息后保存结果文件"""
+    from agents import agent_extract_company, agent_rewrite_question  # pylint: disable=import-outside-toplevel
+    from utils import get_result_pager, get_sql_client, get_sql_rewriter  # pylint: disable=import-outside-toplevel
+    from workflows import check_db_structure, sql_query  # pylint: disable=import-outside-toplevel
+
+    total_usage_tokens = {
+        agent_extract_company.name: 0,
+        agent_rewrite_question.name: 0,
+        check_db_structure.name: 0,
+        sql_query.name: 0,
+    }
+
+    for q_team in config.all_question:
+        for q_item in q_team["team"]:
+            if "usage_tokens" in q_item:
+                for key in q_item["usage_tokens"]:
+                    if key in total_usage_tokens:
+                        total_usage_tokens[key] += q_item["usage_tokens"][key]
+
+    print(json.dumps(total_usage_tokens, ensure_ascii=False, indent=4))
+
+    total_tokens = sum(total_usage_tokens.values())
+    print(f"所有tokens数: {total_tokens}")
+    print("LLM重试统计: " + json.dumps(retry_stats.snapshot(), ensure_ascii=False, indent=4))
+    print("SQL规则统计: " + json.dumps(get_sql_rewriter().stats(), ensure_ascii=False, indent=4))
+    print("SQL截断探测统计: " + json.dumps(get_result_pager().stats(), ensure_ascii=False, indent=4))
+    if check_db_structure.selection_cache is not None:
+        print("选表缓存统计: " + json.dumps(check_db_structure.selection_cache.stats(), ensure_ascii=False, indent=4))
+    if config.SQL_BACKEND != "local":
+        print("SQL查询统计: " + json.dumps(get_sql_client().stats(), ensure_ascii=False, indent=4))
+
+    for q_team in config.all_question:
+        for q_item in q_team["team"]:
+            for key in (
+                "usage_tokens",
+                "use_time",
+                "budget",
+                "iterate_num",
+                "stop_reason",
+                "facts",
+                "rewrited_question",
+                "sql_results",
+            ):
+                if key in q_item:
+                    del q_item[key]
+
+    with open(config.ROOT_DIR + f"/output/Eva_Now_result{config.SAVE_FILE_SUBFIX}.json", "w", encoding="utf-8") as f:
+        json.dump(config.all_question, f, ensure_ascii=False, indent=4)
+
+
+def parse_index(value: str) -> list[int]:
+    """解析形如 "team_index,question_idx" 的下标"""
     try:
-        process_question(config.all_question[i], i)
-    except Exception as exc:
-        print(f"\n***** Team Index {i} generated an exception: {exc} *****\n")
-
-total_usage_tokens = {
-    agent_extract_company.name: 0,
-    agent_rewrite_question.name: 0,
-    check_db_structure.name: 0,
-    sql_query.name: 0,
-}
-
-for q_team in config.all_question:
-    for q_item in q_team["team"]:
-        if "usage_tokens" in q_item:
-            for key in q_item["usage_tokens"]:
-                if key in total_usage_tokens:
-                    total_usage_tokens[key] += q_item["usage_tokens"][key]
-
-print(json.dumps(total_usage_tokens, ensure_ascii=False, indent=4))
-
-total_tokens = sum(total_usage_tokens.values())
-print(f"所有tokens数: {total_tokens}")
-
-for q_team in config.all_question:
-    for q_item in q_team["team"]:
-        if "usage_tokens" in q_item:
-            del q_item["usage_tokens"]
-        if "use_time" in q_item:
-            del q_item["use_time"]
-        if "iterate_num" in q_item:
-            del q_item["iterate_num"]
-        if "facts" in q_item:
-            del q_item["facts"]
-        if "rewrited_question" in q_item:
-            del q_item["rewrited_question"]
-        if "sql_results" in q_item:
-            del q_item["sql_results"]
-
-with open(config.ROOT_DIR + f"/output/Eva_Now_result{config.SAVE_FILE_SUBFIX}.json", "w", encoding="utf-8") as f:
-    json.dump(config.all_question, f, ensure_ascii=False, indent=4)
+        team_idx, q_idx = (int(part) for part in value.split(","))
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"下标格式应为 team_index,question_idx: {value}") from exc
+    return [team_idx, q_idx]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="逐组回答question.json里的问题，结果保存到output目录")
+    parser.add_argument("--start", type=parse_index, help="起始下标 team_index,question_idx，默认取config.START_INDEX")
+    parser.add_argument("--end", type=parse_index, help="结束下标 team_index,question_idx (包含)，默认到最后一题")
+    parser.add_argument("--llm", choices=sorted(llms.LLM_REGISTRY), help="使用的LLM，默认取config.LLM_PLUS")
+    parser.add_argument("--sql-backend", choices=["remote", "local"], help="SQL执行后端，默认取config.SQL_BACKEND")
+    parser.add_argument("--subfix", help="结果文件名后缀，默认取config.SAVE_FILE_SUBFIX")
+    parser.add_argument("--debug", action="store_true", help="打印调试信息")
+    args = parser.parse_args(argv)
+
+    os.environ["DEBUG"] = "1" if args.debug else "0"
+    os.environ["SHOW_LLM_INPUT_MSG"] = "1"
+    load_dotenv()
+
+    if args.start is not None:
+        config.START_INDEX = args.start
+    if args.end is not None:
+        config.END_INDEX = args.end
+    if args.llm is not None:
+        config.LLM_PLUS = args.llm
+    if args.sql_backend is not None:
+        config.SQL_BACKEND = args.sql_backend
+    if args.subfix is not None:
+        config.SAVE_FILE_SUBFIX = args.subfix
+
+    for i in range(config.START_INDEX[0], config.END_INDEX[0] + 1):
+        print(f"----- Processing Team Index {i} ... -----\n")
+        try:
+            process_question(config.all_question[i], i)
+        except Exception as exc:
+            print(f"\n***** Team Index {i} generated an exception: {exc} *****\n")
+
+    save_results()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,25 @@ and their interactions with various APIs.
 """
 
 import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import as_completed
 from dataclasses import dataclass, field
 from typing import Optional, Callable, Tuple, List, Dict
 from src.llm import LLM, DEBUG_OPTION_PRINT_TOOL_CALL_RESULT
 from src.log import get_logger
+from src.budget import Budget
+from src.dag import get_executor
+from src.voting import Vote, answer_fingerprint
+from src.retry import FAILURE_SEMANTIC, RetryPolicy, classify_exception, retry_stats
+from src.history import (
+    HISTORY_COMPRESSOR_EXTRACTIVE,
+    HISTORY_COMPRESSOR_LLM,
+    extractive_summary,
+    messages_tokens,
+    split_for_compression,
+)
 
 
 @dataclass
@@ -23,6 +38,7 @@ class AgentConfig:
     tools: Optional[List[Dict]] = None
     funcs: Optional[List[Callable]] = None
     retry_limit: int = 3
+    retry_policy: Optional[RetryPolicy] = None  # None时使用默认的RetryPolicy
     enable_history: bool = True
     temperature: Optional[float] = None
     top_p: Optional[float] = None
@@ -32,6 +48,11 @@ class AgentConfig:
     pre_process: Optional[Callable[["Agent", dict], None]] = None
     post_process: Optional[Callable[[str], str]] = None
     max_history_num: int = 30
+    samples: int = 1  # 大于1时并行采样多个回答，投票选出一个（self-consistency），需要设置temperature
+    vote_key: Optional[Callable[[str], str]] = None  # 回答的投票指纹，None时使用answer_fingerprint
+    vote_agree: Optional[int] = None  # 多少个采样一致就提前停止，None表示过半数
+    max_history_tokens: Optional[int] = None  # 设置后按估计的token数管理历史，不再按消息条数
+    history_compressor: str = HISTORY_COMPRESSOR_LLM  # llm: 后台调用LLM浓缩; extractive: 抽取式压缩，不调用LLM
 
 
 class Agent:
@@ -47,8 +68,15 @@ class Agent:
         self.tools = config.tools
         self.history = []
         self.max_history_num = config.max_history_num
+        self.samples = config.samples
+        self.vote_key = config.vote_key if config.vote_key is not None else answer_fingerprint
+        self.vote_agree = config.vote_agree
+        self.max_history_tokens = config.max_history_tokens
+        self.history_compressor = config.history_compressor
+        self._pending_compression = None  # 后台进行中的历史浓缩: (被浓缩的消息, Future, budget)
         self.usage_tokens = 0  # 总共使用的token数量
         self.retry_limit = config.retry_limit
+        self.retry_policy = config.retry_policy if config.retry_policy is not None else RetryPolicy()
         self.enable_history = config.enable_history
         self.options = {}
         if config.temperature is not None:
@@ -62,7 +90,8 @@ class Agent:
         else:
             self.funcs = None
         if config.system_prompt_kv is not None:
-            self.system_prompt_kv = config.system_prompt_kv
+            # 复制一份：同一个AgentConfig（比如AgentTemplate）创建的多个agent不能共用、互相修改同一个dict
+            self.system_prompt_kv = dict(config.system_prompt_kv)
         else:
             self.system_prompt_kv = {}
         self.pre_process = config.pre_process
@@ -72,6 +101,9 @@ class Agent:
         """Clears the agent's conversation history and resets token counts."""
         self.history = []
         self.usage_tokens = 0
+        if self._pending_compression is not None:
+            self._pending_compression[1].cancel()
+            self._pending_compression = None
 
     def add_system_prompt_kv(self, kv: dict):
         """Sets the system prompt key-value pairs for the agent."""
@@ -102,32 +134,74 @@ class Agent:
             system_prompt += f"\n\n## {key}\n{value}"
         return system_prompt
 
-    def chat(self, messages: list[dict]) -> Tuple[str, int]:
+    def chat(self, messages: list[dict], budget: Optional[Budget] = None) -> Tuple[str, int]:
         """Attempts to generate a response from the language model, retrying if necessary.
+        budget: 问题的资源预算，消耗的token会计入预算；预算用尽时不再重试，也不浓缩历史
+        失败时按retry_policy重试：传输错误和限流退避后原样重试，语义错误追加带有失败输出的纠正轮
+        samples大于1时并行采样并投票选出回答
         return:
             - str: assistant's answer
             - int: usage_tokens
         """
+        if self.pre_process is not None:
+            self.pre_process(self, messages)
+        if self.samples > 1:
+            response, usage_tokens, ok = self._sample(messages, budget)
+        else:
+            response, usage_tokens, ok = self._generate(messages, budget)
+        if not ok:
+            return response, 0  # 如果所有尝试都失败，返回默认值
+
+        if self.enable_history:
+            self.history = messages + [{"role": "assistant", "content": response}]
+            if budget is None or budget.exhausted() is None:
+                self._schedule_compression(budget)
+        return response, usage_tokens
+
+    def _generate(
+        self, messages: list[dict], budget: Optional[Budget] = None, cancelled: Optional[threading.Event] = None
+    ) -> Tuple[str, int, bool]:
+        """
+        生成一个回答，失败时按retry_policy重试，返回 (回答, 消耗的token数, 是否成功)
+        cancelled被设置后不再发起新的LLM调用（投票已经有结果时，停止其余采样）
+        """
         debug_mode = os.getenv("DEBUG", "0") == "1"
         show_llm_input_msg = os.getenv("SHOW_LLM_INPUT_MSG", "0") == "1"
         logger = get_logger()
 
-        if self.pre_process is not None:
-            self.pre_process(self, messages)
         usage_tokens = 0
+        ok = False
+        response, error, failure = "", "", FAILURE_SEMANTIC
+        msgs = messages
+        retries = Counter()  # 本次调用各类失败已经重试的次数
         for attempt in range(self.retry_limit):
             if attempt > 0:
+                reason = budget.exhausted() if budget is not None else None
+                if reason is not None:
+                    if debug_mode:
+                        print(f"\n预算已用尽({reason})，不再重试\n")
+                    logger.info("\n预算已用尽(%s)，不再重试\n", reason)
+                    break
                 if debug_mode:
-                    print(f"\n重试第 {attempt} 次...\n")
-                logger.info("\n重试第 %d 次...\n", attempt)
-            response = ""
+                    print(f"\n重试第 {attempt} 次({failure})...\n")
+                logger.info("\n重试第 %d 次(%s)...\n", attempt, failure)
+                retry_stats.record(self.name, failure)
+                if failure == FAILURE_SEMANTIC:
+                    # 纠正轮带上失败的输出，让模型知道要修正什么
+                    msgs = messages + self.retry_policy.correction_messages(response, error)
+                else:
+                    delay = self.retry_policy.delay(failure, retries[failure])
+                    if budget is not None and budget.remaining_seconds() is not None:
+                        delay = min(delay, budget.remaining_seconds())
+                    if cancelled is not None:
+                        cancelled.wait(delay)
+                    else:
+                        time.sleep(delay)
+                retries[failure] += 1
+            if cancelled is not None and cancelled.is_set():
+                break
+            response, error = "", ""
             try:
-                msgs = (
-                    messages
-                    if attempt == 0
-                    else messages
-                    + [{"role": "assistant", "content": response}, {"role": "user", "content": "请修正后重试"}]
-                )
                 if show_llm_input_msg:
                     if debug_mode:
                         print(f"\n\n>>>>> 【{msgs[-1]['role']}】 Said:\n{msgs[-1]['content']}")
@@ -146,6 +220,10 @@ class Agent:
                 )
                 usage_tokens += token_count
                 self.usage_tokens += token_count
+                if budget is not None:
+                    budget.add_tokens(token_count)
+                # 生成失败（工具调用出错等）属于语义错误
+                failure = FAILURE_SEMANTIC
                 if ok and self.post_process is not None:
                     response = self.post_process(response)
             except Exception as e:
@@ -153,45 +231,135 @@ class Agent:
                     print(f"\n发生异常：{str(e)}")
                 logger.debug("\n发生异常：%s", str(e))
                 ok = False
-                response += f"\n发生异常：{str(e)}"
+                error = str(e)
+                failure = classify_exception(e)
             if ok:  # 如果生成成功，退出重试
                 break
-        else:
-            response, token_count = f"发生异常：{response}", 0  # 如果所有尝试都失败，返回默认值
-            return response, token_count
+        if not ok:
+            if error != "":
+                response += f"\n发生异常：{error}"
+            return f"发生异常：{response}", usage_tokens, False
+        return response, usage_tokens, True
 
-        if self.enable_history:
-            self.history = messages + [{"role": "assistant", "content": response}]
-            if len(self.history) > self.max_history_num:
-                half = len(self.history) // 2 + 1
-                # 浓缩一半的history
-                if debug_mode:
-                    print(f"\n\n>>>>> Agent【{self.name}】 Compress History:")
-                logger.debug("\n\n>>>>> Agent【%s】 Compress History:\n", self.name)
-                try:
-                    compressed_msg, token_count, ok = self.llm.generate_response(
-                        system="请你把所有历史对话浓缩成一段话，必须保留重要的信息，不要换行，不要有任何markdown格式",
-                        messages=self.history[:half],
-                        stream=self.stream,
-                    )
-                    usage_tokens += token_count
-                    self.usage_tokens += token_count
-                    if ok:
-                        self.history = [{"role": "assistant", "content": compressed_msg}] + self.history[half:]
-                except Exception as e:
-                    if debug_mode:
-                        print(f"\n发生异常：{str(e)}")
-                    logger.debug("\n发生异常：%s", str(e))
-        return response, usage_tokens
+    def _sample(self, messages: list[dict], budget: Optional[Budget] = None) -> Tuple[str, int, bool]:
+        """
+        并行采样samples个回答，按vote_key投票选出回答，某个回答达到vote_agree票时停止其余采样：
+        还没开始的直接取消，正在进行的LLM调用无法中断，等它结束（不再重试），消耗的token照样计入。
+        返回 (回答, 所有采样消耗的token数, 是否成功)
+        """
+        logger = get_logger()
+        executor = get_executor("samples", max_workers=16)
+        cancelled = threading.Event()
+        futures = [executor.submit(self._generate, messages, budget, cancelled) for _ in range(self.samples)]
+        vote = Vote(agree=self.vote_agree if self.vote_agree is not None else self.samples // 2 + 1)
+        usage_tokens = 0
+        failed = ""
+        counted = set()
+        for future in as_completed(futures):
+            counted.add(future)
+            try:
+                response, token_count, ok = future.result()
+            except Exception as e:
+                response, token_count, ok = f"发生异常：{str(e)}", 0, False
+            usage_tokens += token_count
+            if not ok:
+                failed = response
+                continue
+            if vote.add(self.vote_key(response), response):
+                break
+        cancelled.set()
+        for future in futures:
+            if future in counted or future.cancel():
+                continue
+            try:
+                usage_tokens += future.result()[1]
+            except Exception:  # pylint: disable=broad-except
+                pass
+        winner = vote.winner()
+        if winner is None:
+            return failed, usage_tokens, False
+        key, response, confidence = winner
+        logger.debug(
+            "\n>>>>> Agent【%s】 投票: %d/%d个有效采样, 胜出票数%d, 置信度%.2f\n",
+            self.name,
+            len(vote),
+            self.samples,
+            vote.counts[key],
+            confidence,
+        )
+        return response, usage_tokens, True
 
-    def answer(self, message: str) -> Tuple[str, int]:
+    def answer(self, message: str, budget: Optional[Budget] = None) -> Tuple[str, int]:
         """Generates a response to a user's message using the agent's history.
         return:
             - str: assistant's answer
             - int: usage_tokens
         """
+        self._apply_compression()
         messages = self.history + [{"role": "user", "content": message}]
-        return self.chat(messages=messages)
+        return self.chat(messages=messages, budget=budget)
+
+    def _history_over_limit(self, messages: list[dict]) -> bool:
+        if self.max_history_tokens is not None:
+            return messages_tokens(messages) > self.max_history_tokens
+        return len(messages) > self.max_history_num
+
+    def _compression_split(self, messages: list[dict]) -> int:
+        if self.max_history_tokens is not None:
+            return split_for_compression(messages, self.max_history_tokens // 2)
+        return len(messages) // 2 + 1
+
+    def _llm_compress(self, messages: list[dict]) -> Tuple[str, int, bool]:
+        debug_mode = os.getenv("DEBUG", "0") == "1"
+        if debug_mode:
+            print(f"\n\n>>>>> Agent【{self.name}】 Compress History:")
+        get_logger().debug("\n\n>>>>> Agent【%s】 Compress History:\n", self.name)
+        return self.llm.generate_response(
+            system="请你把所有历史对话浓缩成一段话，必须保留重要的信息，不要换行，不要有任何markdown格式",
+            messages=messages,
+            stream=self.stream,
+        )
+
+    def _schedule_compression(self, budget: Optional[Budget] = None):
+        """
+        历史超出限制时压缩较早的一部分。
+        抽取式压缩直接完成；LLM浓缩提交到后台执行，下一次answer()时如果已经完成就替换掉被浓缩的消息，
+        没完成就先用完整的历史，不为浓缩等待。
+        """
+        if self._pending_compression is not None or not self._history_over_limit(self.history):
+            return
+        split = self._compression_split(self.history)
+        if split <= 0:
+            return
+        prefix = self.history[:split]
+        if self.history_compressor == HISTORY_COMPRESSOR_EXTRACTIVE:
+            limit = self.max_history_tokens // 4 if self.max_history_tokens is not None else 1024
+            self.history = [{"role": "assistant", "content": extractive_summary(prefix, limit)}] + self.history[split:]
+            return
+        self._pending_compression = (prefix, get_executor().submit(self._llm_compress, prefix), budget)
+
+    def _apply_compression(self):
+        """应用已经完成的后台浓缩"""
+        if self._pending_compression is None:
+            return
+        prefix, future, budget = self._pending_compression
+        if not future.done():
+            return
+        self._pending_compression = None
+        try:
+            compressed_msg, token_count, ok = future.result()
+        except Exception as e:
+            debug_mode = os.getenv("DEBUG", "0") == "1"
+            if debug_mode:
+                print(f"\n发生异常：{str(e)}")
+            get_logger().debug("\n发生异常：%s", str(e))
+            return
+        self.usage_tokens += token_count
+        if budget is not None:
+            budget.add_tokens(token_count)
+        # 浓缩期间历史可能已经被清空或替换
+        if ok and self.history[: len(prefix)] == prefix:
+            self.history = [{"role": "assistant", "content": compressed_msg}] + self.history[len(prefix) :]
 
 
 class AgentTemplate:
@@ -0,0 +1,89 @@
+"""
+This module provides load_or_build, a versioned, content-hashed pickle cache for structures
+derived from asset files. The cache is rebuilt automatically when any source file changes
+or the format version is bumped, and is written atomically so concurrent workers never read
+a partial file.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Any, Callable
+
+from src.log import get_logger
+
+
+CACHE_FORMAT_VERSION = 1
+
+
+def sources_digest(paths: list[str]) -> str:
+    """按文件名和文件内容计算摘要，不存在的文件也计入摘要"""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                digest.update(file.read())
+        else:
+            digest.update(b"<missing>")
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _read_cache(cache_path: str, version: int, digest: str):
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, "rb") as file:
+            payload = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != version or payload.get("digest") != digest:
+        return None
+    return payload
+
+
+def _write_cache(cache_path: str, payload: dict) -> None:
+    directory = os.path.dirname(cache_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".pkl")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump(payload, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_or_build(
+    cache_path: str,
+    sources: list[str],
+    build: Callable[[], Any],
+    version: int = CACHE_FORMAT_VERSION,
+) -> Any:
+    """
+    读取缓存，源文件内容或版本号变化时重新构建并写回。
+
+    :param cache_path: 缓存文件路径。
+    :param sources: 构建所依赖的源文件，任何一个的内容变化都会触发重建。
+    :param build: 构建函数，返回值必须可以pickle。
+    :param version: 缓存格式版本号，构建逻辑变化时需要加一。
+    :return: 构建结果。
+    """
+    logger = get_logger()
+    digest = sources_digest(sources)
+    payload = _read_cache(cache_path, version, digest)
+    if payload is not None:
+        return payload["data"]
+    data = build()
+    try:
+        _write_cache(cache_path, {"version": version, "digest": digest, "data": data})
+        logger.info("资源缓存已重建: %s\n", cache_path)
+    except OSError as exc:
+        # 写不了缓存（比如只读目录）不影响使用
+        logger.info("资源缓存写入失败: %s, %s\n", cache_path, str(exc))
+    return data
@@ -0,0 +1,68 @@
+"""
+This module provides Budget, a per-question limit on wall time, LLM tokens and SQL calls
+that is passed through the workflows and agents so each layer can stop expensive steps early.
+"""
+
+import threading
+import time
+from typing import Optional
+
+
+class Budget:
+    """
+    单个问题的资源预算：墙钟时间、LLM token数、SQL执行次数，None表示不限制。
+    各层在开始昂贵的步骤前调用exhausted()检查，预算用尽时尽快收尾（比如直接进入总结），而不是抛异常。
+    """
+
+    def __init__(
+        self,
+        max_seconds: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        max_sql_calls: Optional[int] = None,
+    ):
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.max_sql_calls = max_sql_calls
+        self.start_time = time.monotonic()
+        self.tokens = 0
+        self.sql_calls = 0
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        """已用时间（秒）"""
+        return time.monotonic() - self.start_time
+
+    def remaining_seconds(self) -> Optional[float]:
+        """剩余时间（秒），不限时返回None"""
+        if self.max_seconds is None:
+            return None
+        return max(0.0, self.max_seconds - self.elapsed())
+
+    def add_tokens(self, count: int) -> None:
+        """记录消耗的token数"""
+        with self._lock:
+            self.tokens += count
+
+    def add_sql_call(self) -> None:
+        """记录一次SQL执行"""
+        with self._lock:
+            self.sql_calls += 1
+
+    def exhausted(self, need_sql: bool = False) -> Optional[str]:
+        """
+        检查预算是否用尽。
+
+        :param need_sql: 接下来要执行SQL时为True，此时也检查SQL执行次数。
+        :return: 用尽的原因，没有用尽时返回None。
+        """
+        if self.max_seconds is not None and self.elapsed() >= self.max_seconds:
+            return "time"
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return "tokens"
+        if need_sql and self.max_sql_calls is not None and self.sql_calls >= self.max_sql_calls:
+            return "sql_calls"
+        return None
+
+    def summary(self) -> dict:
+        """返回已消耗的资源"""
+        return {"elapsed": round(self.elapsed(), 1), "tokens": self.tokens, "sql_calls": self.sql_calls}
@@ -0,0 +1,124 @@
+"""
+This module provides ConvergenceMonitor, which tracks whether the iterations of SqlQuery
+are still making progress (new SQL, new results, new errors, new facts) so the loop can stop
+and summarize early when it keeps retrying near-identical queries.
+"""
+
+import hashlib
+import re
+from typing import Optional
+
+from src.utils import char_ngrams, jaccard_similarity
+
+
+STOP_ANSWERED = "answered"
+STOP_MAX_ITERATIONS = "max_iterations"
+STOP_STALLED = "stalled"
+STOP_BUDGET = "budget"
+
+_LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+_ERROR_NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+
+def sql_fingerprint(sql: str) -> str:
+    """
+    SQL指纹：去掉反引号、末尾分号和多余空白，字符串字面量以外的部分转成小写。
+    字面量保留原样，因为换一个查询值是有意义的尝试。
+    """
+    parts = []
+    last = 0
+    for match in _LITERAL_PATTERN.finditer(sql):
+        parts.append(sql[last : match.start()].lower().replace("`", ""))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(sql[last:].lower().replace("`", ""))
+    return _WHITESPACE_PATTERN.sub(" ", "".join(parts)).strip().rstrip(";").strip()
+
+
+def error_signature(error: str) -> str:
+    """
+    错误签名：把错误信息里的数字（错误码、行号等）替换成占位符。
+    字段名、表名和字面量保留，同一个错误重复出现才得到相同的签名，换了一个写错的字段名是新的错误。
+    """
+    return _WHITESPACE_PATTERN.sub(" ", _ERROR_NUMBER_PATTERN.sub("?", error)).strip().lower()
+
+
+class ConvergenceMonitor:
+    """
+    记录每轮迭代是否有进展，连续stall_turns轮没有进展时判定为停滞。
+    有进展的一轮：执行了没见过的SQL，并且得到了没见过的结果（且理解出的事实与已有事实不重复）或没见过的错误。
+    没有给出可执行SQL、重复SQL、重复结果、重复错误都算没有进展。
+    空结果本身不带信息，按SQL区分：新的SQL查询为空是有意义的尝试，算有进展。
+    """
+
+    def __init__(self, stall_turns: int = 3, fact_similarity: float = 0.9):
+        self.stall_turns = stall_turns
+        self.fact_similarity = fact_similarity
+        self.sql_fingerprints = set()
+        self.error_signatures = set()
+        self.result_hashes = set()
+        self.facts_grams = []
+        self.stall_count = 0
+        self.history = []  # 每轮的观察记录，用于日志
+
+    def _novel_facts(self, facts: str) -> bool:
+        grams = char_ngrams(facts, 2)
+        if any(jaccard_similarity(grams, seen) >= self.fact_similarity for seen in self.facts_grams):
+            return False
+        self.facts_grams.append(grams)
+        return True
+
+    def observe(
+        self,
+        sql: Optional[str] = None,
+        result: Optional[object] = None,
+        error: Optional[str] = None,
+        facts: Optional[str] = None,
+    ) -> bool:
+        """
+        记录一轮迭代。
+
+        :param sql: 本轮执行的SQL，没有执行SQL时为None。
+        :param result: 查询结果，str()应得到稳定的文本。
+        :param error: 查询异常信息。
+        :param facts: 从结果里理解出的事实。
+        :return: 本轮是否有进展。
+        """
+        progress = False
+        reason = "no_sql"
+        if sql is not None:
+            fingerprint = sql_fingerprint(sql)
+            new_sql = fingerprint not in self.sql_fingerprints
+            self.sql_fingerprints.add(fingerprint)
+            if not new_sql:
+                reason = "repeated_sql"
+            elif error is not None:
+                signature = error_signature(error)
+                progress = signature not in self.error_signatures
+                self.error_signatures.add(signature)
+                reason = "new_error" if progress else "repeated_error"
+            else:
+                # 不同SQL的空结果不算重复，非空的相同结果换一种SQL查出来也没有新信息
+                text = str(result) if _has_rows(result) else f"{fingerprint}\n{result}"
+                result_hash = hashlib.md5(text.encode("utf-8")).hexdigest()
+                progress = result_hash not in self.result_hashes
+                self.result_hashes.add(result_hash)
+                reason = "new_result" if progress else "repeated_result"
+                if progress and facts:
+                    progress = self._novel_facts(facts)
+                    reason = "new_facts" if progress else "repeated_facts"
+        self.stall_count = 0 if progress else self.stall_count + 1
+        self.history.append(reason)
+        return progress
+
+    def stalled(self) -> bool:
+        """是否已经连续stall_turns轮没有进展"""
+        return self.stall_turns > 0 and self.stall_count >= self.stall_turns
+
+
+def _has_rows(result: Optional[object]) -> bool:
+    try:
+        return len(result) > 0
+    except TypeError:
+        return result is not None
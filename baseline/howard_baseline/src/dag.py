@@ -0,0 +1,112 @@
+"""
+This module provides StageGraph, a small DAG executor for pipeline stages:
+each stage declares the stages it depends on, and stages whose dependencies are done
+run concurrently on a shared thread pool.
+"""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+
+_executors: dict[str, ThreadPoolExecutor] = {}
+_executor_lock = threading.Lock()
+
+
+def get_executor(name: str = "stage", max_workers: int = 8) -> ThreadPoolExecutor:
+    """
+    获取进程内共享的线程池，首次调用时创建。
+    会在任务里再提交任务并等待的场景（比如阶段里的agent并行采样）要用不同名字的线程池，避免线程池被占满后互相等待。
+    """
+    executor = _executors.get(name)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+                _executors[name] = executor
+    return executor
+
+
+@dataclass
+class Stage:
+    """流水线里的一个阶段"""
+
+    name: str
+    func: Callable[[dict], Any]  # 参数是inputs和已完成阶段的结果 {阶段名: 结果}
+    deps: tuple = field(default_factory=tuple)
+
+
+class StageGraph:
+    """
+    阶段依赖图。
+    - add()声明阶段和依赖，run()按依赖顺序执行，没有相互依赖的阶段并发执行
+    - 任何阶段抛出异常时，不再启动新的阶段，等已经在跑的阶段结束后把异常抛给调用方
+    """
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        self.executor = executor
+        self.stages: dict[str, Stage] = {}
+
+    def add(self, name: str, func: Callable[[dict], Any], deps: tuple = ()) -> "StageGraph":
+        """添加阶段，返回self以便链式调用"""
+        if name in self.stages:
+            raise ValueError(f"阶段重复: {name}")
+        self.stages[name] = Stage(name=name, func=func, deps=tuple(deps))
+        return self
+
+    def _check(self, inputs: dict) -> None:
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages and dep not in inputs:
+                    raise ValueError(f"阶段{stage.name}依赖的{dep}不存在")
+        # 检查环
+        visiting, visited = set(), set()
+
+        def visit(name: str):
+            if name in visited or name not in self.stages:
+                return
+            if name in visiting:
+                raise ValueError(f"阶段之间存在循环依赖: {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def run(self, inputs: Optional[dict] = None) -> dict:
+        """
+        执行所有阶段。
+
+        :param inputs: 初始输入，可以被阶段当作依赖引用。
+        :return: {阶段名: 结果}，包含inputs。
+        """
+        results = dict(inputs or {})
+        self._check(results)
+        executor = self.executor if self.executor is not None else get_executor()
+        pending = {name: stage for name, stage in self.stages.items() if name not in results}
+        running: dict[Future, str] = {}
+        error: Optional[BaseException] = None
+        while pending or running:
+            if error is None:
+                for name, stage in list(pending.items()):
+                    if all(dep in results for dep in stage.deps):
+                        del pending[name]
+                        running[executor.submit(stage.func, dict(results))] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    error = error or exc
+                else:
+                    results[name] = future.result()
+        if error is not None:
+            raise error
+        return results
@@ -1,42 +1,204 @@
 """
-This module provides a MySQLConnector class for executing SQL queries
-and returning results in JSON format.
+This module provides MySQLConnector and AsyncMySQLConnector classes for executing SQL queries
+and returning results as SqlResult.
 """
 
-import json
-import datetime
+import asyncio
+import hashlib
+import re
+import threading
+import weakref
+from typing import Optional, Union
 import mysql.connector
+from mysql.connector import pooling
+from src.sql_result import SqlResult
+
+try:
+    import aiomysql
+except ImportError:  # 只有AsyncMySQLConnector需要aiomysql
+    aiomysql = None
+
+_SELECT_PATTERN = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+
+def _apply_timeout(sql: str, query_timeout: Optional[float]) -> str:
+    if query_timeout is None:
+        return sql
+    return _SELECT_PATTERN.sub(f"SELECT /*+ MAX_EXECUTION_TIME({int(query_timeout * 1000)}) */", sql, count=1)
+
+
+def _pool_name(user: str, host: str, port: int, database: str) -> str:
+    """
+    默认的连接池名。mysql-connector只允许字母、数字和._:-*$#这些字符，且不超过64个字符，
+    所以替换掉其它字符，截断后加上连接参数的短哈希，避免不同连接截断后重名。
+    """
+    name = f"{user}@{host}:{port}/{database}"
+    digest = hashlib.md5(name.encode("utf-8")).hexdigest()[:8]
+    return re.sub(r"[^a-zA-Z0-9.:\-]", "_", name)[:55] + "_" + digest
 
 
 class MySQLConnector:
-    """A class to connect to a MySQL database and execute SQL queries."""
+    """
+    A class to connect to a MySQL database and execute SQL queries.
+    使用连接池，可被多个workflow并发使用：
+    - 取连接时ping检查，断线自动重连
+    - 连接池用尽时阻塞等待，而不是报错
+    - SELECT语句通过MAX_EXECUTION_TIME限制执行时间
+    - 用非缓冲游标流式读取，最多读取max_rows行
+    """
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        password: str,
+        database: str,
+        port: int = 3306,
+        pool_size: int = 5,
+        pool_name: Optional[str] = None,
+        query_timeout: Optional[float] = 30,
+        max_rows: Optional[int] = None,
+        fetch_size: int = 500,
+    ):
+        self.query_timeout = query_timeout
+        self.max_rows = max_rows
+        self.fetch_size = fetch_size
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name=pool_name if pool_name is not None else _pool_name(user, host, port, database),
+            pool_size=pool_size,
+            pool_reset_session=True,
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            database=database,
+        )
+        self._slots = threading.BoundedSemaphore(pool_size)
 
-    def __init__(self, host: str, user: str, password: str, database: str):
-        self.connection = mysql.connector.connect(host=host, user=user, password=password, database=database)
+    def _apply_timeout(self, sql: str) -> str:
+        return _apply_timeout(sql, self.query_timeout)
 
-    def execute_sql_query(self, sql: str) -> str:
-        """Executes a SQL query and returns the result in JSON format."""
+    def execute_sql_query(self, sql: str) -> Union[SqlResult, str]:
+        """Executes a SQL query and returns the result, or an error message string."""
         sql = sql.replace("\\n", " ")
         connection = None
         cursor = None
+        with self._slots:
+            try:
+                connection = self.pool.get_connection()
+                connection.ping(reconnect=True, attempts=3, delay=1)
+                cursor = connection.cursor(buffered=False)
+                cursor.execute(self._apply_timeout(sql))
+                if cursor.description is None:
+                    return SqlResult([], [])
+                result = []
+                while self.max_rows is None or len(result) < self.max_rows:
+                    size = (
+                        self.fetch_size if self.max_rows is None else min(self.fetch_size, self.max_rows - len(result))
+                    )
+                    rows = cursor.fetchmany(size)
+                    if not rows:
+                        break
+                    result.extend(rows)
+                # 丢弃超出max_rows的剩余行，连接才能被复用
+                if connection.unread_result:
+                    connection.consume_results()
+                # 日期按列转换成字符串
+                return SqlResult.from_cursor(cursor.description, result)
+            except mysql.connector.Error as err:
+                return f"Error: {err}"
+            finally:
+                if cursor is not None:
+                    try:
+                        cursor.close()
+                    except mysql.connector.Error:
+                        pass
+                if connection is not None:
+                    # 归还到连接池
+                    connection.close()
+
+
+class AsyncMySQLConnector:
+    """
+    MySQLConnector的异步版本，基于aiomysql的连接池，返回值与MySQLConnector相同。
+    连接池只能在创建它的事件循环里使用，所以每个事件循环各一个，在该循环首次查询时创建。
+    """
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        password: str,
+        database: str,
+        port: int = 3306,
+        pool_size: int = 5,
+        query_timeout: Optional[float] = 30,
+        max_rows: Optional[int] = None,
+        fetch_size: int = 500,
+    ):
+        if aiomysql is None:
+            raise ImportError("AsyncMySQLConnector需要安装aiomysql: pip install aiomysql")
+        self.query_timeout = query_timeout
+        self.max_rows = max_rows
+        self.fetch_size = fetch_size
+        self._pool_kwargs = {
+            "host": host,
+            "port": port,
+            "user": user,
+            "password": password,
+            "db": database,
+            "minsize": 1,
+            "maxsize": pool_size,
+            "pool_recycle": 3600,
+        }
+        # 事件循环 -> [创建连接池用的锁, 连接池]，事件循环被回收时一起释放
+        self._pools: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._pools_lock = threading.Lock()
+
+    async def _get_pool(self):
+        """当前事件循环的连接池，首次使用时创建"""
+        loop = asyncio.get_running_loop()
+        with self._pools_lock:
+            entry = self._pools.get(loop)
+            if entry is None:
+                entry = [asyncio.Lock(), None]
+                self._pools[loop] = entry
+        if entry[1] is None:
+            async with entry[0]:
+                if entry[1] is None:
+                    entry[1] = await aiomysql.create_pool(**self._pool_kwargs)
+        return entry[1]
+
+    async def execute_sql_query(self, sql: str) -> Union[SqlResult, str]:
+        """Executes a SQL query and returns the result, or an error message string."""
+        sql = sql.replace("\\n", " ")
+        pool = await self._get_pool()
         try:
-            # 连接到MySQL数据库
-            cursor = self.connection.cursor()
-            cursor.execute(sql)
-            columns = [column[0] for column in cursor.description]
-            result = cursor.fetchall()
-            # Convert date objects to strings
-            result_dict = [
-                {
-                    column: (value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value)
-                    for column, value in zip(columns, row)
-                }
-                for row in result
-            ]
-            return json.dumps(result_dict, ensure_ascii=False)
-        except mysql.connector.Error as err:
+            # 连接池用尽时acquire会等待；SSCursor是非缓冲游标，流式读取
+            async with pool.acquire() as connection:
+                async with connection.cursor(aiomysql.SSCursor) as cursor:
+                    await cursor.execute(_apply_timeout(sql, self.query_timeout))
+                    if cursor.description is None:
+                        return SqlResult([], [])
+                    result = []
+                    while self.max_rows is None or len(result) < self.max_rows:
+                        size = (
+                            self.fetch_size
+                            if self.max_rows is None
+                            else min(self.fetch_size, self.max_rows - len(result))
+                        )
+                        rows = await cursor.fetchmany(size)
+                        if not rows:
+                            break
+                        result.extend(rows)
+                    return SqlResult.from_cursor(cursor.description, result)
+        except aiomysql.Error as err:
             return f"Error: {err}"
-        finally:
-            if connection is not None and connection.is_connected():
-                cursor.close()
-                connection.close()
+
+    async def close(self) -> None:
+        """关闭当前事件循环的连接池，应在事件循环结束前调用"""
+        with self._pools_lock:
+            entry = self._pools.pop(asyncio.get_running_loop(), None)
+        if entry is not None and entry[1] is not None:
+            entry[1].close()
+            await entry[1].wait_closed()
@@ -0,0 +1,156 @@
+"""
+This module provides EntityResolver, an in-process index over security master rows
+(names, abbreviations, codes, former names and pinyin) for resolving company/security entities
+without querying the database.
+"""
+
+import bisect
+import json
+from typing import Optional
+
+from src.utils import char_ngrams, normalize_text
+
+
+MATCH_EXACT = "exact"
+MATCH_PREFIX = "prefix"
+MATCH_SUBSTRING = "substring"
+MATCH_PINYIN = "pinyin"
+
+# 匹配类型的优先级，数值越大越优先
+_MATCH_RANK = {MATCH_EXACT: 3, MATCH_PINYIN: 2, MATCH_PREFIX: 1, MATCH_SUBSTRING: 0}
+
+
+class EntityResolver:
+    """
+    公司/证券实体解析器。
+    对名称类字段建立精确、前缀（有序键+二分查找）、子串（字符bigram倒排）索引，
+    对代码字段只做精确匹配，对拼音缩写字段做精确和前缀匹配。
+    解析时只返回最优匹配类型下的结果，并按匹配到的名称与查询词的接近程度排序。
+    """
+
+    def __init__(
+        self,
+        rows: list[dict],
+        name_fields: tuple = ("ChiName", "ChiNameAbbr", "EngName", "EngNameAbbr", "SecuAbbr", "FormerName"),
+        code_fields: tuple = ("SecuCode",),
+        pinyin_fields: tuple = ("ChiSpelling",),
+        result_fields: Optional[tuple] = None,
+    ):
+        """
+        rows: 证券主表的行，每行是一个dict，应包含TableName字段标明所在数据表。
+        result_fields: 解析结果里保留的字段，None表示保留全部字段。
+        """
+        self.rows = rows
+        self.result_fields = result_fields
+        self._exact: dict[str, set[int]] = {}
+        self._pinyin: dict[str, set[int]] = {}
+        self._keys: list[str] = []  # 去重后的名称键
+        self._key_rows: list[set[int]] = []
+        self._sorted_keys: list[tuple[str, int]] = []
+        self._sorted_pinyin: list[tuple[str, int]] = []
+        self._gram_index: dict[str, set[int]] = {}
+
+        key_ids: dict[str, int] = {}
+        for row_id, row in enumerate(rows):
+            for field in code_fields:
+                key = normalize_text(str(row.get(field) or ""))
+                if key:
+                    self._exact.setdefault(key, set()).add(row_id)
+            for field in pinyin_fields:
+                key = normalize_text(str(row.get(field) or ""))
+                if key:
+                    self._pinyin.setdefault(key, set()).add(row_id)
+            for field in name_fields:
+                key = normalize_text(str(row.get(field) or ""))
+                if not key:
+                    continue
+                self._exact.setdefault(key, set()).add(row_id)
+                if key not in key_ids:
+                    key_ids[key] = len(self._keys)
+                    self._keys.append(key)
+                    self._key_rows.append(set())
+                    for gram in char_ngrams(key, 2):
+                        self._gram_index.setdefault(gram, set()).add(key_ids[key])
+                self._key_rows[key_ids[key]].add(row_id)
+        self._sorted_keys = sorted((key, key_id) for key, key_id in key_ids.items())
+        self._sorted_pinyin = sorted((key, 0) for key in self._pinyin)
+
+    @classmethod
+    def from_snapshot(cls, path: str, **kwargs) -> "EntityResolver":
+        """从快照文件(JSON数组)构建解析器"""
+        with open(path, encoding="utf-8") as file:
+            return cls(json.load(file), **kwargs)
+
+    @staticmethod
+    def _prefix_range(sorted_keys: list[tuple[str, int]], prefix: str) -> list[tuple[str, int]]:
+        start = bisect.bisect_left(sorted_keys, (prefix,))
+        end = bisect.bisect_left(sorted_keys, (prefix + "\U0010ffff",))
+        return sorted_keys[start:end]
+
+    def match(self, name: str) -> list[tuple[int, str, str]]:
+        """
+        查找名称的所有匹配。
+
+        :param name: 实体名称、代码或拼音缩写。
+        :return: [(row_id, 匹配类型, 匹配到的键)]
+        """
+        query = normalize_text(name)
+        if not query:
+            return []
+        matches: dict[int, tuple[str, str]] = {}
+
+        def add(row_ids, match_type: str, key: str):
+            for row_id in row_ids:
+                current = matches.get(row_id)
+                if current is None or (_MATCH_RANK[match_type], -len(key)) > (
+                    _MATCH_RANK[current[0]],
+                    -len(current[1]),
+                ):
+                    matches[row_id] = (match_type, key)
+
+        add(self._exact.get(query, ()), MATCH_EXACT, query)
+        if query.isascii() and query.isalpha():
+            add(self._pinyin.get(query, ()), MATCH_PINYIN, query)
+            for key, _ in self._prefix_range(self._sorted_pinyin, query):
+                add(self._pinyin[key], MATCH_PINYIN, key)
+        for key, key_id in self._prefix_range(self._sorted_keys, query):
+            add(self._key_rows[key_id], MATCH_PREFIX, key)
+        if len(query) >= 2:
+            candidates = None
+            for gram in char_ngrams(query, 2):
+                postings = self._gram_index.get(gram)
+                if postings is None:
+                    candidates = set()
+                    break
+                candidates = set(postings) if candidates is None else candidates & postings
+            for key_id in candidates or ():
+                key = self._keys[key_id]
+                if query in key:
+                    add(self._key_rows[key_id], MATCH_SUBSTRING, key)
+        return [(row_id, match_type, key) for row_id, (match_type, key) in matches.items()]
+
+    def resolve(self, name: str, limit: int = 10) -> list[dict]:
+        """
+        解析实体，只返回最优匹配类型下的结果，按匹配到的键与查询词的长度差从小到大排序。
+
+        :param name: 实体名称、代码或拼音缩写。
+        :param limit: 最多返回的行数。
+        :return: 匹配到的行。
+        """
+        matches = self.match(name)
+        if not matches:
+            return []
+        best_rank = max(_MATCH_RANK[match_type] for _, match_type, _ in matches)
+        query_len = len(normalize_text(name))
+        ranked = sorted(
+            (len(key) - query_len, row_id)
+            for row_id, match_type, key in matches
+            if _MATCH_RANK[match_type] == best_rank
+        )
+        results = []
+        for _, row_id in ranked[:limit]:
+            row = self.rows[row_id]
+            if self.result_fields is not None:
+                row = {k: row.get(k) for k in self.result_fields}
+            results.append(dict(row))
+        return results
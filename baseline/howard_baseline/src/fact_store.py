@@ -0,0 +1,124 @@
+"""
+This module provides FactStore, which keeps the facts understood from earlier SQL results
+of a question team, drops near-duplicates, and selects only the facts relevant to the
+current question within a token budget, so prompts do not grow with the team length.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from src.utils import char_ngrams, estimate_tokens, jaccard_similarity, normalize_text
+
+
+_ID_PATTERN = re.compile(r"(?<![\d.])\d{3,}(?![\d.])")
+
+
+def extract_ids(text: str) -> set[str]:
+    """提取文本里的编码类数字（InnerCode、CompanyCode、股票代码等，至少3位的整数）"""
+    return set(_ID_PATTERN.findall(text))
+
+
+@dataclass
+class Fact:
+    """一条已知事实"""
+
+    text: str
+    grams: set
+    ids: set
+    tokens: int
+    seq: int  # 最近一次加入的序号，越大越新
+
+
+class FactStore:
+    """
+    已知事实库。
+    - add()按归一化文本和字符n-gram的Jaccard相似度去重，重复的事实只刷新它的新旧顺序
+    - select()按和问题的词面重合度、共有的编码数字打分（同分时新的优先），在max_tokens以内取得分最高的top_k条，按加入顺序返回
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = 1500,
+        top_k: Optional[int] = 8,
+        min_score: float = 0.1,
+        dedup_similarity: float = 0.9,
+        ngram: int = 2,
+    ):
+        self.max_tokens = max_tokens
+        self.top_k = top_k
+        self.min_score = min_score
+        self.dedup_similarity = dedup_similarity
+        self.ngram = ngram
+        self.facts: list[Fact] = []
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+    def clear(self) -> None:
+        """清空事实库"""
+        self.facts = []
+        self._seq = 0
+
+    def add(self, text: str) -> bool:
+        """
+        添加一条事实。
+
+        :param text: 事实文本。
+        :return: 是否是新事实，重复的事实返回False。
+        """
+        text = text.strip()
+        if text == "":
+            return False
+        self._seq += 1
+        grams = char_ngrams(normalize_text(text), self.ngram)
+        for fact in self.facts:
+            if fact.text == text or jaccard_similarity(grams, fact.grams) >= self.dedup_similarity:
+                fact.seq = self._seq
+                return False
+        self.facts.append(
+            Fact(text=text, grams=grams, ids=extract_ids(text), tokens=estimate_tokens(text), seq=self._seq)
+        )
+        return True
+
+    def load(self, texts: list[str]) -> None:
+        """用保存下来的事实文本重建事实库"""
+        self.clear()
+        for text in texts:
+            self.add(text)
+
+    def texts(self) -> list[str]:
+        """所有事实文本，按加入顺序"""
+        return [fact.text for fact in self.facts]
+
+    def score(self, fact: Fact, query_grams: set, query_ids: set) -> float:
+        """事实和问题的相关度：问题的n-gram被事实覆盖的比例 + 共有编码的奖励"""
+        overlap = len(fact.grams & query_grams) / len(query_grams) if query_grams else 0.0
+        id_bonus = 0.5 if fact.ids & query_ids else 0.0
+        return overlap + id_bonus
+
+    def select(self, query: str, hints: str = "") -> list[str]:
+        """
+        选出和问题相关的事实。
+
+        :param query: 当前问题（重写后的问题）。
+        :param hints: 其他已知信息（比如实体提取的结果），只用来提供编码数字。
+        :return: 事实文本，按加入顺序。
+        """
+        query_grams = char_ngrams(normalize_text(query), self.ngram)
+        query_ids = extract_ids(query) | extract_ids(hints)
+        scored = sorted(
+            ((self.score(fact, query_grams, query_ids), fact) for fact in self.facts),
+            key=lambda item: (-item[0], -item[1].seq),
+        )
+        selected = []
+        used_tokens = 0
+        for score, fact in scored:
+            if score < self.min_score or (self.top_k is not None and len(selected) >= self.top_k):
+                break
+            if self.max_tokens is not None and used_tokens + fact.tokens > self.max_tokens:
+                continue
+            selected.append(fact)
+            used_tokens += fact.tokens
+        return [fact.text for fact in sorted(selected, key=lambda fact: fact.seq)]
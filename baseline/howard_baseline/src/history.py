@@ -0,0 +1,73 @@
+"""
+This module provides token-based helpers for managing an agent's conversation history:
+estimating the size of a message list, choosing which older messages to compress, and an
+extractive (non-LLM) compressor that keeps the fact-bearing sentences of those messages.
+"""
+
+import re
+
+from src.utils import estimate_tokens
+
+
+HISTORY_COMPRESSOR_LLM = "llm"
+HISTORY_COMPRESSOR_EXTRACTIVE = "extractive"
+
+_SENTENCE_PATTERN = re.compile(r"[^\n。；;！!？?]+[。；;！!？?]?")
+_FACT_PATTERN = re.compile(r"\d|查询结果|表明|结论|答案|[A-Za-z]+(?:Code|Name)")
+_CODE_BLOCK_PATTERN = re.compile(r"```.*?```", re.DOTALL)
+
+
+def messages_tokens(messages: list[dict]) -> int:
+    """估计消息列表的token数"""
+    return sum(estimate_tokens(msg["content"]) for msg in messages)
+
+
+def split_for_compression(messages: list[dict], keep_tokens: int, min_keep: int = 2) -> int:
+    """
+    计算压缩的分割点：分割点之后的消息保留原样，之前的消息被压缩。
+    从后往前保留消息，直到保留部分超过keep_tokens，但至少保留min_keep条。
+
+    :param messages: 消息列表。
+    :param keep_tokens: 保留原样的消息的token上限。
+    :param min_keep: 至少保留原样的消息数。
+    :return: 分割点下标，0表示不需要压缩。
+    """
+    used = 0
+    index = len(messages)
+    while index > 0:
+        tokens = estimate_tokens(messages[index - 1]["content"])
+        if len(messages) - index >= min_keep and used + tokens > keep_tokens:
+            break
+        used += tokens
+        index -= 1
+    return index
+
+
+def extractive_summary(messages: list[dict], max_tokens: int) -> str:
+    """
+    抽取式压缩：去掉代码块，按句子切分，只保留带数字或结论性词语的句子，重复的句子只保留一次；
+    超出max_tokens时优先保留较新的句子。
+
+    :param messages: 要压缩的消息。
+    :param max_tokens: 压缩结果的token上限。
+    :return: 压缩后的文本，每行一句。
+    """
+    seen = set()
+    sentences = []
+    for msg in messages:
+        content = _CODE_BLOCK_PATTERN.sub(" ", msg["content"])
+        for match in _SENTENCE_PATTERN.finditer(content):
+            sentence = match.group(0).strip()
+            if sentence == "" or sentence in seen or not _FACT_PATTERN.search(sentence):
+                continue
+            seen.add(sentence)
+            sentences.append(sentence)
+    kept = []
+    used = 0
+    for sentence in reversed(sentences):
+        tokens = estimate_tokens(sentence)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    return "\n".join(reversed(kept))
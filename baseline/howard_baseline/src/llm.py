@@ -8,9 +8,6 @@ from typing import Optional, Callable
 import os
 import re
 import json
-from ollama import Client
-from zhipuai import ZhipuAI
-from openai import OpenAI
 from src.log import get_logger
 
 CHAT_OPTION_TEMPERATURE = "temperature"
@@ -62,7 +59,9 @@ class OllamaLLM(LLM):
         self.host = host
         self.model = model
         self.post_process = post_process
-        # 初始化其他必要的参数
+        # 初始化其他必要的参数，SDK在用到时才导入
+        from ollama import Client  # pylint: disable=import-outside-toplevel
+
         self.client = Client(host)
 
     def generate_response(
@@ -179,6 +178,8 @@ class ZhipuLLM(LLM):
         self.api_key = api_key
         self.model = model
         self.post_process = post_process
+        from zhipuai import ZhipuAI  # pylint: disable=import-outside-toplevel
+
         self.client = ZhipuAI(api_key=api_key)
 
     def generate_response(
@@ -306,7 +307,9 @@ class OpenAILLM(LLM):
         self.api_key = api_key
         self.model = model
         self.post_process = post_process
-        # 初始化其他必要的参数
+        # 初始化其他必要的参数，SDK在用到时才导入
+        from openai import OpenAI  # pylint: disable=import-outside-toplevel
+
         self.client = OpenAI(api_key=api_key, base_url=base_url)
         if self.model.startswith("o"):
             self.system_role = "developer"
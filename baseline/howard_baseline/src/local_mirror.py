@@ -0,0 +1,513 @@
+"""
+This module provides LocalMirror, a local SQLite mirror of the competition databases,
+with a translator for the MySQL constructs used by the agents,
+so that queries can be executed locally instead of through the remote query API.
+
+Usage (ingest table dumps):
+    python -m src.local_mirror --schema ../../assets/all_tables_schema.txt --dump-dir DUMP_DIR --mirror MIRROR_PATH
+
+Each dump file is named `database_name.table_name.csv` (with a header row) or `database_name.table_name.jsonl`.
+"""
+
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Callable, Iterator, Optional
+
+from src.log import get_logger
+from src.sql_result import SqlResult
+
+
+TABLE_NAME_SEP = "__"
+NULL_VALUES = {"", "NULL", "null", "None"}
+
+_STRING_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_PLACEHOLDER_PATTERN = re.compile(r"\x00(\d+)\x00")
+_NUMBER_PATTERN = re.compile(r"^-?\d+(\.\d+)?([eE][-+]?\d+)?$")
+_INTERVAL_PATTERN = re.compile(r"^\s*INTERVAL\s+(-?[\w.]+)\s+(DAY|WEEK|MONTH|QUARTER|YEAR)\s*$", re.IGNORECASE)
+_DATE_PART_FORMATS = {"YEAR": "%Y", "MONTH": "%m", "DAY": "%d", "DAYOFMONTH": "%d"}
+_MYSQL_DATE_FORMATS = {
+    "%Y": lambda d: d.strftime("%Y"),
+    "%y": lambda d: d.strftime("%y"),
+    "%m": lambda d: d.strftime("%m"),
+    "%c": lambda d: str(d.month),
+    "%d": lambda d: d.strftime("%d"),
+    "%e": lambda d: str(d.day),
+    "%H": lambda d: d.strftime("%H"),
+    "%i": lambda d: d.strftime("%M"),
+    "%s": lambda d: d.strftime("%S"),
+    "%S": lambda d: d.strftime("%S"),
+}
+
+
+def parse_tables_schema(text: str) -> dict[str, list[tuple[str, str, str]]]:
+    """
+    解析all_tables_schema.txt。
+
+    :param text: 文件内容。
+    :return: {database_name.table_name: [(列名, 注释, 数据示例)]}
+    """
+    tables = {}
+    current = None
+    for line in text.split("\n"):
+        match = re.match(r"^=== (\S+) 表结构 ===$", line.strip())
+        if match:
+            current = match.group(1).lower()
+            tables[current] = []
+            continue
+        if current is None or line.strip() == "" or line.startswith("列名") or line.startswith("---"):
+            continue
+        # 固定宽度: 列名(21) + 注释(31) + 数据示例
+        tables[current].append((line[:21].strip(), line[21:52].strip(), line[52:].strip()))
+    return tables
+
+
+def infer_affinity(column: str, example: str) -> str:
+    """
+    根据数据示例推断SQLite的列类型亲和性。
+    以0开头的数字代码（如股票代码）保持TEXT，避免被转换成整数丢失前导0。
+    """
+    if example in NULL_VALUES:
+        if column.endswith(("Code", "Abbr", "Name", "Spelling")) and column not in {
+            "InnerCode",
+            "CompanyCode",
+            "IndexCode",
+            "IndexInnerCode",
+            "SecuInnerCode",
+            "ConceptCode",
+            "AreaInnerCode",
+        }:
+            return "TEXT"
+        return "NUMERIC"
+    if _NUMBER_PATTERN.match(example) and not (
+        example.lstrip("-").startswith("0") and len(example.lstrip("-")) > 1 and "." not in example
+    ):
+        return "NUMERIC"
+    return "TEXT"
+
+
+def _find_closing_paren(sql: str, start: int) -> int:
+    depth = 0
+    for idx in range(start, len(sql)):
+        if sql[idx] == "(":
+            depth += 1
+        elif sql[idx] == ")":
+            depth -= 1
+            if depth == 0:
+                return idx
+    raise SyntaxError("SQL的括号不匹配")
+
+
+def _split_args(args: str) -> list[str]:
+    parts, depth, last = [], 0, 0
+    for idx, char in enumerate(args):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(args[last:idx])
+            last = idx + 1
+    parts.append(args[last:])
+    return [part.strip() for part in parts]
+
+
+def _interval_modifier(interval: str, sign: int) -> str:
+    match = _INTERVAL_PATTERN.match(interval)
+    if match is None:
+        raise SyntaxError(f"不支持的INTERVAL表达式: {interval}")
+    amount, unit = match.group(1), match.group(2).upper()
+    if unit == "WEEK":
+        amount, unit = f"({amount})*7", "DAY"
+    elif unit == "QUARTER":
+        amount, unit = f"({amount})*3", "MONTH"
+    return f"printf('%+d {unit.lower()}s', {sign}*({amount}))"
+
+
+def _rewrite_call(name: str, args: list[str]) -> Optional[str]:
+    upper = name.upper()
+    if upper in _DATE_PART_FORMATS and len(args) == 1:
+        return f"CAST(strftime('{_DATE_PART_FORMATS[upper]}', {args[0]}) AS INTEGER)"
+    if upper == "QUARTER" and len(args) == 1:
+        return f"((CAST(strftime('%m', {args[0]}) AS INTEGER) + 2) / 3)"
+    if upper == "IF" and len(args) == 3:
+        return f"IIF({', '.join(args)})"
+    if upper in {"DATE_ADD", "ADDDATE", "DATE_SUB", "SUBDATE"} and len(args) == 2:
+        sign = 1 if upper in {"DATE_ADD", "ADDDATE"} else -1
+        return f"datetime({args[0]}, {_interval_modifier(args[1], sign)})"
+    return None
+
+
+_CALL_PATTERN = re.compile(
+    r"\b(YEAR|MONTH|DAY|DAYOFMONTH|QUARTER|IF|DATE_ADD|ADDDATE|DATE_SUB|SUBDATE)\s*\(", re.IGNORECASE
+)
+
+
+def _rewrite_calls(sql: str) -> str:
+    result, pos = [], 0
+    while True:
+        match = _CALL_PATTERN.search(sql, pos)
+        if match is None:
+            result.append(sql[pos:])
+            return "".join(result)
+        open_idx = match.end() - 1
+        close_idx = _find_closing_paren(sql, open_idx)
+        args = _split_args(_rewrite_calls(sql[open_idx + 1 : close_idx]))
+        replacement = _rewrite_call(match.group(1), args)
+        result.append(sql[pos : match.start()])
+        if replacement is None:
+            result.append(f"{match.group(1)}({', '.join(args)})")
+        else:
+            result.append(replacement)
+        pos = close_idx + 1
+
+
+def _mysql_date_format(value, fmt):
+    if value is None or fmt is None:
+        return None
+    parsed = _parse_datetime(value)
+    if parsed is None:
+        return None
+    out = []
+    idx = 0
+    while idx < len(fmt):
+        token = fmt[idx : idx + 2]
+        if token in _MYSQL_DATE_FORMATS:
+            out.append(_MYSQL_DATE_FORMATS[token](parsed))
+            idx += 2
+        else:
+            out.append(fmt[idx])
+            idx += 1
+    return "".join(out)
+
+
+def _parse_datetime(value) -> Optional[datetime.datetime]:
+    text = str(value).strip().replace("T", " ")
+    for fmt, length in (("%Y-%m-%d %H:%M:%S", 19), ("%Y-%m-%d", 10)):
+        try:
+            return datetime.datetime.strptime(text[:length], fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _datediff(a, b):
+    date_a, date_b = _parse_datetime(a), _parse_datetime(b)
+    if date_a is None or date_b is None:
+        return None
+    return (date_a.date() - date_b.date()).days
+
+
+def _field(value, *candidates):
+    for idx, candidate in enumerate(candidates, start=1):
+        if candidate is not None and value is not None and str(candidate) == str(value):
+            return idx
+    return 0
+
+
+def _concat(*args):
+    if any(arg is None for arg in args):
+        return None
+    return "".join(str(arg) for arg in args)
+
+
+def _truncate(value, digits):
+    if value is None or digits is None:
+        return None
+    factor = 10 ** int(digits)
+    return int(float(value) * factor) / factor
+
+
+def _regexp(pattern, value):
+    if pattern is None or value is None:
+        return None
+    return 1 if re.search(str(pattern), str(value), re.IGNORECASE) else 0
+
+
+_DIVIDE_PATTERN = re.compile(r"(?<![/*])/(?![/*])")
+_DIV_PATTERN = re.compile(r"\bDIV\b", re.IGNORECASE)
+_OPERAND_PATTERN = re.compile(r"(?:`[^`]*`|[\w\x00.])+")
+
+
+def _left_operand_start(sql: str, end: int) -> int:
+    """DIV左操作数的起点，DIV和*、/、%优先级相同且左结合，所以左边连续的乘除运算都属于左操作数"""
+    start = _operand_start(sql, end)
+    idx = start
+    while idx > 0 and sql[idx - 1].isspace():
+        idx -= 1
+    if idx > 0 and sql[idx - 1] in "*/%" and sql[idx - 2 : idx] not in {"/*", "*/"}:
+        return _left_operand_start(sql, idx - 1)
+    return start
+
+
+def _operand_start(sql: str, end: int) -> int:
+    idx = end
+    while idx > 0 and sql[idx - 1].isspace():
+        idx -= 1
+    if idx > 0 and sql[idx - 1] == ")":
+        depth = 0
+        for pos in range(idx - 1, -1, -1):
+            if sql[pos] == ")":
+                depth += 1
+            elif sql[pos] == "(":
+                depth -= 1
+                if depth == 0:
+                    idx = pos
+                    break
+        else:
+            raise SyntaxError("SQL的括号不匹配")
+    start = idx
+    while start > 0 and (sql[start - 1].isalnum() or sql[start - 1] in "_`.\x00"):
+        start -= 1
+    if start == end or sql[start:end].strip() == "":
+        raise SyntaxError("DIV缺少左操作数")
+    return start
+
+
+def _right_operand_end(sql: str, start: int) -> int:
+    idx = start
+    while idx < len(sql) and sql[idx].isspace():
+        idx += 1
+    if idx < len(sql) and sql[idx] in "+-":
+        idx += 1
+    match = _OPERAND_PATTERN.match(sql, idx)
+    if match is not None:
+        idx = match.end()
+    if idx < len(sql) and sql[idx] == "(":
+        idx = _find_closing_paren(sql, idx) + 1
+    if sql[start:idx].strip() in {"", "+", "-"}:
+        raise SyntaxError("DIV缺少右操作数")
+    return idx
+
+
+def _rewrite_division(sql: str) -> str:
+    """
+    MySQL的/是实数除法，SQLite两个整数相除是整数除法（7/2=3）：
+    - a / b 改写成 a * 1.0 / b，*和/优先级相同且左结合，运算顺序不变
+    - a DIV b（整数除法，向0取整）改写成 CAST(a * 1.0 / b AS INTEGER)，操作数是单个值、字段、函数调用或括号表达式
+    """
+    sql = _DIVIDE_PATTERN.sub("* 1.0 /", sql)
+    while True:
+        match = _DIV_PATTERN.search(sql)
+        if match is None:
+            return sql
+        start = _left_operand_start(sql, match.start())
+        end = _right_operand_end(sql, match.end())
+        left, right = sql[start : match.start()].strip(), sql[match.end() : end].strip()
+        sql = f"{sql[:start]}CAST({left} * 1.0 / {right} AS INTEGER){sql[end:]}"
+
+
+def translate_mysql_sql(sql: str, rewrite_tables: Optional[Callable[[str], str]] = None) -> str:
+    """
+    把MySQL方言的SQL改写成SQLite可执行的SQL:
+    - 表名由rewrite_tables改写，它拿到的是字符串字面量被替换成占位符的SQL
+    - YEAR()/MONTH()/DAY()/QUARTER() 改写成整数类型的strftime，与'2020'这类字符串比较时也能正确比较
+    - IF() 改写成IIF()，DATE_ADD()/DATE_SUB() 的INTERVAL改写成datetime()的修饰符
+    - / 改写成实数除法，DIV 改写成向0取整的除法，见_rewrite_division
+    - 双引号字符串改写成单引号字符串
+    DATE()、ORDER BY FIELD()、LIMIT、反引号等由SQLite本身或register_mysql_functions注册的函数支持。
+    """
+    literals = []
+
+    def mask(match: re.Match) -> str:
+        literal = match.group(0)
+        if literal.startswith('"'):
+            literal = "'" + literal[1:-1].replace('""', '"').replace("'", "''") + "'"
+        literals.append(literal)
+        return f"\x00{len(literals) - 1}\x00"
+
+    masked = _STRING_PATTERN.sub(mask, sql.strip().rstrip(";"))
+    if re.match(r"^\s*SHOW\b", masked, re.IGNORECASE):
+        raise SyntaxError("本地镜像不支持SHOW语句，请直接查询数据表")
+    if rewrite_tables is not None:
+        masked = rewrite_tables(masked)
+    masked = _rewrite_calls(_rewrite_division(masked))
+    return _PLACEHOLDER_PATTERN.sub(lambda m: literals[int(m.group(1))], masked)
+
+
+def register_mysql_functions(conn: sqlite3.Connection) -> None:
+    """在SQLite连接上注册agents常用、SQLite没有的MySQL函数"""
+    conn.create_function("FIELD", -1, _field, deterministic=True)
+    conn.create_function("CONCAT", -1, _concat, deterministic=True)
+    conn.create_function("DATEDIFF", 2, _datediff, deterministic=True)
+    conn.create_function("DATE_FORMAT", 2, _mysql_date_format, deterministic=True)
+    conn.create_function("TRUNCATE", 2, _truncate, deterministic=True)
+    conn.create_function("REGEXP", 2, _regexp, deterministic=True)
+    conn.create_function("LEFT", 2, lambda s, n: None if s is None else str(s)[: int(n)], deterministic=True)
+    conn.create_function(
+        "RIGHT",
+        2,
+        lambda s, n: None if s is None else (str(s)[-int(n) :] if int(n) > 0 else ""),
+        deterministic=True,
+    )
+    conn.create_function("NOW", 0, lambda: datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    conn.create_function("CURDATE", 0, lambda: datetime.date.today().isoformat())
+
+
+class LocalMirror:
+    """
+    比赛数据库的本地SQLite镜像。
+    database_name.table_name 在SQLite里存为表 database_name__table_name，执行前由translate_sql改写。
+    """
+
+    def __init__(self, path: str, max_rows: Optional[int] = None):
+        self.path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._table_pattern: Optional[re.Pattern] = None
+
+    def _connect(self, read_only: bool = True) -> sqlite3.Connection:
+        if read_only:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        else:
+            conn = sqlite3.connect(self.path)
+        register_mysql_functions(conn)
+        return conn
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """当前线程的只读连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect(read_only=True)
+            self._local.conn = conn
+        return conn
+
+    def _get_table_pattern(self) -> re.Pattern:
+        if self._table_pattern is None:
+            rows = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+            names = sorted(
+                (row[0].split(TABLE_NAME_SEP, 1) for row in rows if TABLE_NAME_SEP in row[0]), key=lambda x: -len(x[1])
+            )
+            alternatives = "|".join(
+                rf"`?{re.escape(db_name)}`?\s*\.\s*`?{re.escape(table_name)}`?" for db_name, table_name in names
+            )
+            self._table_pattern = re.compile(rf"(?<![\w.`])(?:{alternatives or '(?!)'})(?![\w`])", re.IGNORECASE)
+        return self._table_pattern
+
+    def translate_sql(self, sql: str) -> str:
+        """
+        把MySQL方言的SQL改写成SQLite可执行的SQL，database_name.table_name 改写成镜像里的表名，
+        其余改写见translate_mysql_sql。
+        """
+        return translate_mysql_sql(
+            sql,
+            rewrite_tables=lambda masked: self._get_table_pattern().sub(
+                lambda m: re.sub(r"[`\s]", "", m.group(0)).replace(".", TABLE_NAME_SEP), masked
+            ),
+        )
+
+    def query(self, sql: str) -> SqlResult:
+        """执行SQL并返回结果"""
+        cursor = self.connection.execute(self.translate_sql(sql))
+        try:
+            if cursor.description is None:
+                return SqlResult([], [])
+            rows = cursor.fetchall() if self.max_rows is None else cursor.fetchmany(self.max_rows)
+            return SqlResult.from_cursor(cursor.description, rows)
+        finally:
+            cursor.close()
+
+    def execute_sql_query(self, sql: str) -> SqlResult:
+        """
+        Executes an SQL query against the local mirror and returns the result,
+        with the same contract as the remote query API executor.
+        """
+        debug_mode = os.getenv("DEBUG", "0") == "1"
+        sql = sql.replace("\\n", " ")
+        logger = get_logger()
+        logger.info("\n>>>>> 查询sql:\n%s\n", sql)
+        if debug_mode:
+            print(f"\n>>>>> 查询ql:\n{sql}")
+        try:
+            data = self.query(sql)
+        except sqlite3.Error as exc:
+            logger.info("查询失败: %s\n", str(exc))
+            if debug_mode:
+                print("查询失败:" + str(exc))
+            raise RuntimeError(str(exc)) from exc
+        logger.info("查询结果:\n%s\n", data)
+        if debug_mode:
+            print(f"查询结果:\n{data}")
+        return data
+
+    async def aexecute_sql_query(self, sql: str) -> SqlResult:
+        """execute_sql_query的异步版本，SQLite查询在线程池里执行"""
+        return await asyncio.to_thread(self.execute_sql_query, sql)
+
+    def ingest(self, dump_dir: str, tables_schema: dict[str, list[tuple[str, str, str]]], batch_size: int = 5000):
+        """
+        导入数据表的导出文件。
+
+        :param dump_dir: 导出文件所在目录，文件名为database_name.table_name.csv或.jsonl。
+        :param tables_schema: parse_tables_schema的结果，用于推断列类型。
+        :param batch_size: 每批写入的行数。
+        """
+        logger = get_logger()
+        conn = self._connect(read_only=False)
+        try:
+            for file_name in sorted(os.listdir(dump_dir)):
+                table, ext = os.path.splitext(file_name)
+                table = table.lower()
+                if ext not in {".csv", ".jsonl"} or table.count(".") != 1:
+                    continue
+                rows = self._read_dump(os.path.join(dump_dir, file_name), ext)
+                header = next(rows, None)
+                if header is None:
+                    continue
+                affinities = {col: infer_affinity(col, example) for col, _, example in tables_schema.get(table, [])}
+                sqlite_table = table.replace(".", TABLE_NAME_SEP)
+                columns_sql = ", ".join(f'"{col}" {affinities.get(col, "NUMERIC")}' for col in header)
+                conn.execute(f'DROP TABLE IF EXISTS "{sqlite_table}"')
+                conn.execute(f'CREATE TABLE "{sqlite_table}" ({columns_sql})')
+                insert_sql = f'INSERT INTO "{sqlite_table}" VALUES ({", ".join("?" * len(header))})'
+                count = 0
+                batch = []
+                for row in rows:
+                    batch.append([None if value in NULL_VALUES else value for value in row])
+                    if len(batch) >= batch_size:
+                        conn.executemany(insert_sql, batch)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    conn.executemany(insert_sql, batch)
+                    count += len(batch)
+                conn.commit()
+                logger.info("导入%s: %d行\n", table, count)
+                print(f"导入{table}: {count}行")
+        finally:
+            conn.close()
+        self._table_pattern = None
+
+    @staticmethod
+    def _read_dump(path: str, ext: str) -> Iterator[list]:
+        with open(path, encoding="utf-8", newline="") as file:
+            if ext == ".csv":
+                yield from csv.reader(file)
+                return
+            header = None
+            for line in file:
+                if line.strip() == "":
+                    continue
+                record = json.loads(line)
+                if header is None:
+                    header = list(record.keys())
+                    yield header
+                yield [None if record.get(col) is None else str(record.get(col)) for col in header]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导入数据表导出文件，构建本地SQLite镜像")
+    parser.add_argument("--schema", required=True, help="all_tables_schema.txt的路径")
+    parser.add_argument("--dump-dir", required=True, help="导出文件所在目录")
+    parser.add_argument("--mirror", required=True, help="SQLite镜像文件路径")
+    cli_args = parser.parse_args()
+    with open(cli_args.schema, encoding="utf-8") as schema_file:
+        schema = parse_tables_schema(schema_file.read())
+    LocalMirror(cli_args.mirror).ingest(cli_args.dump_dir, schema)
@@ -0,0 +1,138 @@
+"""
+This module provides ResultPager, which runs in front of a SQL executor whose results are capped at
+`limit` rows. When a result comes back with exactly `limit` rows, it runs a COUNT(*) probe over the
+same query and records the true total on the result, so the caller sees "N of total" instead of
+guessing whether rows are missing. It also provides offset paging for callers that need every row.
+"""
+
+import re
+import threading
+from typing import Awaitable, Callable, Iterator, Optional
+
+from src.log import get_logger
+from src.sql_result import SqlResult, as_sql_result
+from src.sql_rewrite import MaskedSql
+
+
+_SELECT_PATTERN = re.compile(r"^\s*\(?\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+_LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(\d+)(?:\s*,\s*(\d+)|\s+OFFSET\s+\d+)?\s*$", re.IGNORECASE)
+
+
+def strip_sql(sql: str) -> str:
+    """去掉SQL末尾的分号和空白"""
+    return sql.strip().rstrip(";").rstrip()
+
+
+def outer_limit(sql: str) -> Optional[int]:
+    """SQL最外层的LIMIT行数，没有时返回None（只看语句末尾，子查询里的LIMIT不算）"""
+    match = _LIMIT_PATTERN.search(MaskedSql(strip_sql(sql)).text)
+    if match is None:
+        return None
+    return int(match.group(2) if match.group(2) is not None else match.group(1))
+
+
+def count_sql(sql: str) -> str:
+    """统计SQL结果总行数的探测SQL"""
+    return f"SELECT COUNT(*) AS total FROM (\n{strip_sql(sql)}\n) AS _count_probe;"
+
+
+def page_sql(sql: str, limit: int, offset: int) -> str:
+    """
+    分页SQL：直接在原SQL后面加LIMIT/OFFSET，保留原SQL的ORDER BY。
+    原SQL自带LIMIT时无法分页，调用方应先用outer_limit()判断。
+    """
+    return f"{strip_sql(sql)} LIMIT {limit} OFFSET {offset};"
+
+
+def iter_pages(
+    execute_sql_query: Callable[[str], SqlResult], sql: str, page_size: int, max_rows: Optional[int] = None
+) -> Iterator[SqlResult]:
+    """
+    按OFFSET分页执行SQL，逐页返回结果，直到不满一页或者取够max_rows行。
+    SQL需要有确定的ORDER BY，否则分页之间可能重复或遗漏。
+
+    :param execute_sql_query: SQL执行函数。
+    :param sql: 不带LIMIT的SQL。
+    :param page_size: 每页行数，不应超过执行函数的行数上限。
+    :param max_rows: 最多取多少行，None表示取完。
+    """
+    if outer_limit(sql) is not None:
+        raise ValueError("SQL自带LIMIT，无法分页: " + sql)
+    offset = 0
+    while max_rows is None or offset < max_rows:
+        size = page_size if max_rows is None else min(page_size, max_rows - offset)
+        page = as_sql_result(execute_sql_query(page_sql(sql, size, offset)))
+        yield page
+        if len(page) < size:
+            break
+        offset += size
+
+
+class ResultPager:
+    """
+    截断检测：结果恰好有limit行时，用COUNT(*)探测总行数，并通过SqlResult.total告诉调用方。
+    - SQL最外层自带不超过limit的LIMIT时，结果不是被截断的，不探测
+    - 探测失败（比如派生表里有重名字段）只记录日志，原结果照常返回
+    """
+
+    def __init__(self, limit: Optional[int]):
+        self.limit = limit
+        self.truncated = 0
+        self.probes = 0
+        self.probe_errors = 0
+        self._lock = threading.Lock()
+
+    def need_probe(self, sql: str, result: SqlResult) -> bool:
+        """结果是否可能被执行函数的行数上限截断"""
+        if self.limit is None or len(result) != self.limit or not _SELECT_PATTERN.match(sql):
+            return False
+        limit = outer_limit(sql)
+        return limit is None or limit > self.limit
+
+    def _count(self, result: SqlResult, counted: SqlResult) -> SqlResult:
+        total = int(counted.rows[0][0]) if len(counted) > 0 else None
+        if total is None:
+            return result
+        if total > len(result):
+            with self._lock:
+                self.truncated += 1
+            get_logger().info("\n查询结果被截断: 共%d行，只返回了%d行\n", total, len(result))
+        return result.with_total(total)
+
+    def _on_probe_error(self, sql: str, exc: Exception) -> None:
+        with self._lock:
+            self.probe_errors += 1
+        get_logger().info("\n统计总行数失败: %s\n%s\n", str(exc), sql)
+
+    def run(self, sql: str, execute: Callable[[str], SqlResult]) -> SqlResult:
+        """执行SQL，结果可能被截断时探测总行数"""
+        result = as_sql_result(execute(sql))
+        if not self.need_probe(sql, result):
+            return result
+        with self._lock:
+            self.probes += 1
+        try:
+            counted = as_sql_result(execute(count_sql(sql)))
+        except Exception as exc:  # pylint: disable=broad-except
+            self._on_probe_error(sql, exc)
+            return result
+        return self._count(result, counted)
+
+    async def arun(self, sql: str, aexecute: Callable[[str], Awaitable[SqlResult]]) -> SqlResult:
+        """run的异步版本"""
+        result = as_sql_result(await aexecute(sql))
+        if not self.need_probe(sql, result):
+            return result
+        with self._lock:
+            self.probes += 1
+        try:
+            counted = as_sql_result(await aexecute(count_sql(sql)))
+        except Exception as exc:  # pylint: disable=broad-except
+            self._on_probe_error(sql, exc)
+            return result
+        return self._count(result, counted)
+
+    def stats(self) -> dict:
+        """返回探测次数、确认被截断的次数和探测失败次数"""
+        with self._lock:
+            return {"probes": self.probes, "truncated": self.truncated, "probe_errors": self.probe_errors}
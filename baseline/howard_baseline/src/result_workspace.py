@@ -0,0 +1,147 @@
+"""
+This module provides ResultWorkspace, a per-question in-memory SQLite database that keeps the SQL
+results fetched so far as tables result_1, result_2, ... Later SQL can reference them as
+`FROM @result_N` to sort, filter, de-duplicate or compute on rows already fetched, and SQL without
+any table (e.g. `SELECT 1+1`) is evaluated locally too, both without a round trip to the database.
+The MySQL dialect is translated the same way as for the local mirror.
+"""
+
+import re
+import sqlite3
+import threading
+from typing import Callable, Optional
+
+from src.local_mirror import register_mysql_functions, translate_mysql_sql
+from src.log import get_logger
+from src.sql_result import SqlResult
+from src.sql_rewrite import MaskedSql
+
+
+RESULT_PREFIX = "result_"
+
+_REFERENCE_PATTERN = re.compile(rf"@({RESULT_PREFIX}\d+)\b")
+_SELECT_PATTERN = re.compile(r"^\s*\(?\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+_FROM_PATTERN = re.compile(r"\bFROM\b", re.IGNORECASE)
+_TABLE_ERROR_MARKS = ("no such table", "unknown database")
+
+
+class ResultWorkspace:
+    """
+    单个问题的查询结果工作区。
+    - add()把查询结果保存成表result_N，返回名字
+    - 引用了@result_N、或者没有FROM的SELECT，由execute()在本地执行
+    - 本地执行的结果超过max_rows行时只返回前max_rows行，并记录真实总行数
+    - 算式按MySQL的语义计算：/是实数除法（7/2=3.5），DIV是整数除法，见translate_mysql_sql
+    """
+
+    def __init__(self, max_rows: Optional[int] = None):
+        self.max_rows = max_rows
+        self.tables: dict[str, SqlResult] = {}
+        self.local_queries = 0
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        register_mysql_functions(self._conn)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.tables)
+
+    def close(self) -> None:
+        """释放内存数据库"""
+        with self._lock:
+            self._conn.close()
+            self.tables = {}
+
+    def add(self, result: SqlResult) -> Optional[str]:
+        """
+        保存查询结果。
+
+        :param result: 查询结果。
+        :return: 表名（SQL里用@表名引用），没有字段的结果不保存，返回None。
+        """
+        if len(result.columns) == 0:
+            return None
+        columns = []
+        for column in result.columns:
+            name, idx = column, 1
+            while name.lower() in (c.lower() for c in columns):
+                idx += 1
+                name = f"{column}_{idx}"
+            columns.append(name)
+        with self._lock:
+            name = f"{RESULT_PREFIX}{len(self.tables) + 1}"
+            quoted = ", ".join('"' + column.replace('"', '""') + '"' for column in columns)
+            self._conn.execute(f"CREATE TABLE {name} ({quoted})")
+            self._conn.executemany(
+                f"INSERT INTO {name} VALUES ({', '.join('?' * len(columns))})",
+                (
+                    [value if isinstance(value, (int, float, str, bytes)) else _text(value) for value in row]
+                    for row in result.rows
+                ),
+            )
+            self.tables[name] = result
+        return name
+
+    @staticmethod
+    def references(sql: str) -> list[str]:
+        """SQL里引用的@result_N（字符串字面量里的不算）"""
+        return list(dict.fromkeys(_REFERENCE_PATTERN.findall(MaskedSql(sql).text)))
+
+    def is_local(self, sql: str) -> bool:
+        """SQL是否在本地执行：引用了@result_N的查询，或者是没有FROM的SELECT"""
+        masked = MaskedSql(sql).text
+        if not _SELECT_PATTERN.match(masked):
+            return False
+        return bool(_REFERENCE_PATTERN.search(masked)) or not _FROM_PATTERN.search(masked)
+
+    def query(self, sql: str) -> SqlResult:
+        """
+        在本地执行SQL。
+
+        :raises ValueError: 引用了不存在的@result_N。
+        :raises RuntimeError: SQLite执行失败。
+        """
+        missing = [name for name in self.references(sql) if name not in self.tables]
+        if missing:
+            raise ValueError(
+                f"@{missing[0]}不存在，可以引用的查询结果: " + (", ".join(f"@{name}" for name in self.tables) or "无")
+            )
+        translated = translate_mysql_sql(sql, rewrite_tables=lambda masked: _REFERENCE_PATTERN.sub(r"\1", masked))
+        with self._lock:
+            try:
+                cursor = self._conn.execute(translated)
+            except sqlite3.Error as exc:
+                message = str(exc)
+                if any(mark in message for mark in _TABLE_ERROR_MARKS):
+                    message += "。@result_N只能和其它@result_N一起查询，不能和数据库表混用"
+                raise RuntimeError(message) from exc
+            try:
+                rows = cursor.fetchall()
+                data = SqlResult.from_cursor(cursor.description, rows) if cursor.description else SqlResult([], [])
+            finally:
+                cursor.close()
+            self.local_queries += 1
+        if self.max_rows is not None and len(data) > self.max_rows:
+            data = SqlResult(data.columns, data.rows[: self.max_rows], total=len(data))
+        return data
+
+    def execute(self, sql: str, fallback: Optional[Callable[[str], SqlResult]] = None) -> SqlResult:
+        """
+        在本地执行SQL，记录日志。
+        没有引用@result_N的SQL（比如用了SQLite不支持的MySQL函数的算式）本地执行失败时，交给fallback执行。
+        """
+        logger = get_logger()
+        logger.info("\n>>>>> 本地执行sql:\n%s\n", sql)
+        try:
+            data = self.query(sql)
+        except (ValueError, RuntimeError, SyntaxError) as exc:
+            if fallback is None or self.references(sql):
+                logger.info("本地执行失败: %s\n", str(exc))
+                raise
+            logger.info("本地执行失败，改为查询数据库: %s\n", str(exc))
+            return fallback(sql)
+        logger.info("本地执行结果:\n%s\n", data)
+        return data
+
+
+def _text(value) -> Optional[str]:
+    return None if value is None else str(value)
@@ -0,0 +1,131 @@
+"""
+This module provides RetryPolicy, which classifies failed LLM calls of Agent.chat as transient
+transport errors, rate limits or semantic errors (bad tool call / unusable answer) and decides
+how to retry each class: backoff with jitter for the first two, a correction turn for the last.
+Retry counts per agent and class are collected in retry_stats.
+"""
+
+import random
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+
+FAILURE_TRANSPORT = "transport"
+FAILURE_RATE_LIMIT = "rate_limit"
+FAILURE_SEMANTIC = "semantic"
+
+_RATE_LIMIT_MARKS = ("429", "rate limit", "ratelimit", "too many requests", "请求过于频繁", "并发数过高")
+_TRANSPORT_MARKS = (
+    "timeout",
+    "timed out",
+    "connect",
+    "network",
+    "remote end closed",
+    "temporarily unavailable",
+    "service unavailable",
+    "bad gateway",
+    "502",
+    "503",
+    "504",
+)
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for obj in (exc, getattr(exc, "response", None)):
+        code = getattr(obj, "status_code", None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def classify_exception(exc: BaseException) -> str:
+    """
+    按异常判断失败类型。各家SDK的异常类型不同，所以按HTTP状态码、异常类名和异常信息判断。
+
+    :param exc: LLM调用抛出的异常。
+    :return: FAILURE_RATE_LIMIT、FAILURE_TRANSPORT 或 FAILURE_SEMANTIC。
+    """
+    status = _status_code(exc)
+    if status == 429:
+        return FAILURE_RATE_LIMIT
+    if status is not None and status >= 500:
+        return FAILURE_TRANSPORT
+    text = f"{type(exc).__name__} {exc}".lower()
+    if any(mark in text for mark in _RATE_LIMIT_MARKS):
+        return FAILURE_RATE_LIMIT
+    if isinstance(exc, (ConnectionError, TimeoutError)) or any(mark in text for mark in _TRANSPORT_MARKS):
+        return FAILURE_TRANSPORT
+    return FAILURE_SEMANTIC
+
+
+@dataclass
+class RetryPolicy:
+    """
+    重试策略。
+    - 传输错误和限流：指数退避加随机抖动（full jitter）后原样重试，不改动提示
+    - 语义错误：不等待，追加一轮纠正，把失败的输出和错误信息带给模型
+    """
+
+    base_delay: float = 1.0  # 传输错误的初始退避时间(秒)
+    rate_limit_base_delay: float = 5.0  # 限流的初始退避时间(秒)
+    max_delay: float = 30.0
+
+    def delay(self, failure: str, retry_index: int) -> float:
+        """
+        第retry_index次（从0开始）同类重试前等待的秒数。
+
+        :param failure: 失败类型。
+        :param retry_index: 这一类失败已经重试过的次数。
+        :return: 等待秒数。
+        """
+        if failure == FAILURE_SEMANTIC:
+            return 0.0
+        base = self.rate_limit_base_delay if failure == FAILURE_RATE_LIMIT else self.base_delay
+        return random.uniform(0, min(self.max_delay, base * 2**retry_index))
+
+    def correction_messages(self, failed_output: str, error: str = "") -> list[dict]:
+        """
+        语义错误后追加的纠正轮。
+
+        :param failed_output: 上一次失败的输出。
+        :param error: 失败原因。
+        :return: 追加到原消息后面的消息。
+        """
+        content = "上面的回答有问题" + (f"：{error}" if error else "") + "。请修正后重试"
+        return [
+            {"role": "assistant", "content": failed_output if failed_output else "（无输出）"},
+            {"role": "user", "content": content},
+        ]
+
+
+class RetryStats:
+    """按agent和失败类型统计的重试次数"""
+
+    def __init__(self):
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, agent_name: str, failure: str) -> None:
+        """记录一次重试"""
+        with self._lock:
+            self._counts[(agent_name, failure)] += 1
+
+    def snapshot(self) -> dict:
+        """返回 {失败类型: 次数, ...} 和 {agent: {失败类型: 次数}}"""
+        with self._lock:
+            by_failure: Counter = Counter()
+            by_agent: dict = {}
+            for (agent_name, failure), count in self._counts.items():
+                by_failure[failure] += count
+                by_agent.setdefault(agent_name, {})[failure] = count
+        return {"by_failure": dict(by_failure), "by_agent": by_agent}
+
+    def clear(self) -> None:
+        """清空统计"""
+        with self._lock:
+            self._counts.clear()
+
+
+retry_stats = RetryStats()
@@ -0,0 +1,133 @@
+"""
+This module provides SchemaSelectionCache, which caches the tables and columns
+selected by CheckDbStructure for a rewritten question. Entries are partitioned by a context string
+(e.g. which securities tables the known entities live in), so similar questions only share a
+selection when that context is the same.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from src.utils import char_ngrams, normalize_text
+
+
+@dataclass
+class SchemaSelection:
+    """A cached db -> table -> column selection result."""
+
+    tables: list[str]
+    column_filter: dict
+
+
+class SchemaSelectionCache:
+    """
+    缓存问题对应的选表、选字段结果。
+    先按归一化后的问题文本精确查找，找不到时按字符n-gram的Jaccard相似度找最相近的问题，
+    相似度不低于threshold才算命中。
+    context是影响选表结果的上下文（比如实体所在的证券主表），只有context完全相同的缓存项才会命中。
+    """
+
+    def __init__(self, threshold: float = 0.85, ngram: int = 2, max_size: int = 2000):
+        self.threshold = threshold
+        self.ngram = ngram
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, str], tuple[set[str], SchemaSelection]] = OrderedDict()
+        self._gram_index: dict[str, set[tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, question: str, context: str = "") -> Optional[SchemaSelection]:
+        """
+        查找问题对应的选择结果，未命中返回None。
+
+        :param question: 重写后的问题。
+        :param context: 影响选表结果的上下文。
+        :return: SchemaSelection 或 None。
+        """
+        text = normalize_text(question)
+        key = (_digest(context), text)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][1]
+            grams = char_ngrams(text, self.ngram)
+            # 通过倒排索引统计候选问题的公共gram数，避免和所有缓存项逐一比较
+            overlaps: dict[tuple[str, str], int] = {}
+            for gram in grams:
+                for candidate in self._gram_index.get(gram, ()):
+                    if candidate[0] == key[0]:
+                        overlaps[candidate] = overlaps.get(candidate, 0) + 1
+            best_key, best_score = None, 0.0
+            for candidate, inter in overlaps.items():
+                candidate_grams = self._entries[candidate][0]
+                score = inter / (len(grams) + len(candidate_grams) - inter)
+                if score > best_score:
+                    best_key, best_score = candidate, score
+            if best_key is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return self._entries[best_key][1]
+            self.misses += 1
+            return None
+
+    def put(self, question: str, selection: SchemaSelection, context: str = "") -> None:
+        """
+        缓存问题对应的选择结果。
+
+        :param question: 重写后的问题。
+        :param selection: 选表、选字段的结果。
+        :param context: 影响选表结果的上下文。
+        """
+        text = normalize_text(question)
+        if text == "":
+            return
+        key = (_digest(context), text)
+        grams = char_ngrams(text, self.ngram)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (grams, selection)
+            for gram in grams:
+                self._gram_index.setdefault(gram, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """清空缓存。"""
+        with self._lock:
+            self._entries.clear()
+            self._gram_index.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """返回缓存项数、命中次数、未命中次数和命中率"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups > 0 else 0.0,
+            }
+
+    def _remove(self, key: tuple[str, str]) -> None:
+        grams, _ = self._entries.pop(key)
+        for gram in grams:
+            keys = self._gram_index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._gram_index[gram]
+
+
+def _digest(context: str) -> str:
+    return hashlib.md5(context.encode("utf-8")).hexdigest() if context else ""
@@ -0,0 +1,178 @@
+"""
+This module provides SchemaCatalog, a read-only index over the database structure
+(db_table / table_column) with pre-serialized JSON fragments,
+so that rendering a table or column selection is mostly string joins.
+"""
+
+import json
+import threading
+from typing import Iterable, Optional
+
+from src.utils import COLUMN_LIST_MARK
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+class SchemaCatalog:
+    """
+    数据库结构目录，启动时构建一次，可被所有workflow共享（构建后只读）。
+    渲染结果与直接对原始结构做json.dumps的结果完全一致。
+    """
+
+    _shared: dict[tuple[int, int], tuple[dict, dict, "SchemaCatalog"]] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db_table: dict, table_column: dict):
+        self.db_table = db_table
+        self.table_column = table_column
+        # database_name -> 已序列化的表清单片段
+        self._db_table_fragments: dict[str, str] = {}
+        # database_name.table_name -> 已序列化的表字段片段
+        self._table_fragments: dict[str, str] = {}
+        # table_name -> [(column_name, 已序列化的字段片段)]
+        self._column_fragments: dict[str, list[tuple[str, str]]] = {}
+
+        for table_name, cols in table_column.items():
+            self._column_fragments[table_name] = [(col["column"], _dumps(col)) for col in cols]
+        for db_name, db in db_table.items():
+            table_items = []
+            for table in db["表"]:
+                table_name = table["表英文"]
+                full_name = f"{db_name}.{table_name}"
+                table_items.append(_dumps({"表名": full_name, "说明": table["cols_summary"]}))
+                if table_name in self._column_fragments:
+                    self._table_fragments[full_name] = self._render_table(
+                        full_name, (frag for _, frag in self._column_fragments[table_name])
+                    )
+            self._db_table_fragments[db_name] = ", ".join(table_items)
+
+    @classmethod
+    def shared(cls, db_table: dict, table_column: dict) -> "SchemaCatalog":
+        """
+        获取与给定db_table、table_column对象绑定的共享目录，同一对对象只构建一次。
+        """
+        key = (id(db_table), id(table_column))
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = (db_table, table_column, cls(db_table, table_column))
+            return cls._shared[key][2]
+
+    @classmethod
+    def register(cls, catalog: "SchemaCatalog") -> "SchemaCatalog":
+        """
+        把已经构建好的目录（比如从缓存加载的）登记为它的db_table、table_column对象的共享目录，
+        之后shared()直接返回它，不再重复构建。已经有共享目录时返回已有的。
+        """
+        key = (id(catalog.db_table), id(catalog.table_column))
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = (catalog.db_table, catalog.table_column, catalog)
+            return cls._shared[key][2]
+
+    @staticmethod
+    def _render_table(full_name: str, fragments: Iterable[str]) -> str:
+        return '{"表名": ' + _dumps(full_name) + ', "表字段": [' + ", ".join(fragments) + "]}"
+
+    @staticmethod
+    def _split_table_name(table: str) -> tuple[str, str]:
+        if "." not in table or table.count(".") != 1:
+            raise ValueError(f"发生异常: 表名`{table}`格式不正确，应该为database_name.table_name")
+        db_name, table_name = table.split(".")
+        return db_name, table_name
+
+    def has_db(self, db_name: str) -> bool:
+        """数据库是否存在"""
+        return db_name in self._db_table_fragments
+
+    def has_table(self, table: str) -> bool:
+        """表（database_name.table_name）是否存在"""
+        return table in self._table_fragments
+
+    def get_columns(self, table_name: str) -> list[dict]:
+        """获取表的字段信息列表"""
+        return self.table_column[table_name]
+
+    def render_table_list(self, dbs: list[str]) -> str:
+        """
+        渲染多个数据库的表清单。
+
+        :param dbs: 数据库名列表。
+        :return: 表清单字符串。
+        """
+        fragments = []
+        for db_name in dbs:
+            if db_name not in self._db_table_fragments:
+                raise KeyError(f"发生异常: 数据库名`{db_name}`不存在")
+            if self._db_table_fragments[db_name] != "":
+                fragments.append(self._db_table_fragments[db_name])
+        return "数据库表信息如下:\n[" + ", ".join(fragments) + "]\n"
+
+    def render_column_list(self, tables: list[str]) -> str:
+        """
+        渲染多个表的全部字段信息。
+
+        :param tables: 表名列表，格式为database_name.table_name。
+        :return: 字段信息字符串。
+        """
+        fragments = []
+        for table in tables:
+            db_name, _ = self._split_table_name(table)
+            if db_name not in self._db_table_fragments:
+                raise KeyError(f"发生异常: 数据库名`{db_name}`不存在")
+            if table in self._table_fragments:
+                fragments.append(self._table_fragments[table])
+        return f"已取得可用的{COLUMN_LIST_MARK}:\n[" + ", ".join(fragments) + "]\n"
+
+    def render_filtered_column_list(
+        self,
+        tables: list[str],
+        column_filter: dict,
+        import_column_names: Optional[set] = None,
+        foreign_key_hub: Optional[dict] = None,
+    ) -> str:
+        """
+        渲染筛选后的字段信息。
+
+        :param tables: 表名列表，格式为database_name.table_name。
+        :param column_filter: dict{"database_name.table_name": ["col1", "col2"]}。
+        :param import_column_names: 总是保留的重要字段。
+        :param foreign_key_hub: 总是附带的外键枢纽表及其字段。
+        :return: 字段信息字符串。
+        """
+        import_column_names = import_column_names if import_column_names is not None else set()
+        foreign_key_hub = foreign_key_hub if foreign_key_hub is not None else {}
+        fragments = []
+        for table in tables:
+            db_name, table_name = self._split_table_name(table)
+            if table not in column_filter:
+                continue
+            if db_name not in self._db_table_fragments:
+                raise KeyError(f"发生异常: 数据库名`{db_name}`不存在")
+            if table in self._table_fragments:
+                selected = set(column_filter[table])
+                fragments.append(
+                    self._render_table(
+                        table,
+                        (
+                            frag
+                            for col_name, frag in self._column_fragments[table_name]
+                            if col_name in selected or col_name in import_column_names
+                        ),
+                    )
+                )
+        for table, cols in foreign_key_hub.items():
+            if table not in tables:
+                _, table_name = table.split(".")
+                fragments.append(
+                    self._render_table(
+                        table,
+                        (
+                            frag
+                            for col_name, frag in self._column_fragments[table_name]
+                            if col_name in cols or col_name in import_column_names
+                        ),
+                    )
+                )
+        return f"已取得可用的{COLUMN_LIST_MARK}:\n[" + ", ".join(fragments) + "]\n"
@@ -0,0 +1,262 @@
+"""
+This module provides HttpSqlClient, a thread-safe client for the remote SQL query API
+with a pooled keep-alive session, retries for transport errors and a concurrency cap.
+It also provides an awaitable execute path based on httpx for use from an event loop.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.log import get_logger
+from src.sql_result import SqlResult, loads
+
+
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+
+class LatencyHistogram:
+    """A thread-safe latency histogram with fixed millisecond buckets."""
+
+    def __init__(self, bounds_ms: tuple = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)):
+        self.bounds_ms = bounds_ms
+        self.counts = [0] * (len(bounds_ms) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms: float) -> None:
+        """记录一次耗时"""
+        idx = len(self.bounds_ms)
+        for i, bound in enumerate(self.bounds_ms):
+            if elapsed_ms <= bound:
+                idx = i
+                break
+        with self._lock:
+            self.counts[idx] += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        """返回当前统计信息"""
+        with self._lock:
+            total = sum(self.counts)
+            buckets = {f"<={bound}ms": cnt for bound, cnt in zip(self.bounds_ms, self.counts)}
+            buckets[f">{self.bounds_ms[-1]}ms"] = self.counts[-1]
+            return {
+                "count": total,
+                "avg_ms": round(self.total_ms / total, 1) if total > 0 else 0.0,
+                "max_ms": round(self.max_ms, 1),
+                "buckets": buckets,
+            }
+
+
+class HttpSqlClient:
+    """
+    远程SQL查询接口的客户端，可被所有workflow和会话共享。
+    - 复用keep-alive连接池
+    - 仅对传输层错误（连接失败、连接超时、连接被重置、5xx）按指数退避重试，SQL本身的错误和读超时不重试
+    - 用信号量限制同时在途的查询数
+    - 记录查询耗时分布
+    """
+
+    def __init__(
+        self,
+        url: str,
+        access_token: Optional[str] = None,
+        limit: Optional[int] = None,
+        timeout: float = 30,
+        connect_timeout: float = 5,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_backoff: float = 8,
+        max_concurrency: int = 8,
+        pool_size: int = 16,
+    ):
+        self.url = url
+        self.limit = limit
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.latency = LatencyHistogram()
+        self.retry_count = 0
+        self._retry_lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        # 异步客户端和信号量只能在创建它们的事件循环里使用，所以每个事件循环各一份，事件循环被回收时一起释放
+        self._async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {access_token if access_token is not None else ''}",
+            }
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.max_backoff, self.backoff_factor * (2**attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _post(self, sql: str) -> requests.Response:
+        payload = {"sql": sql}
+        if self.limit is not None:
+            payload["limit"] = self.limit
+        logger = get_logger()
+        attempt = 0
+        while True:
+            try:
+                with self._semaphore:
+                    start = time.perf_counter()
+                    try:
+                        response = self.session.post(
+                            self.url, json=payload, timeout=(self.connect_timeout, self.timeout)
+                        )
+                    finally:
+                        self.latency.record((time.perf_counter() - start) * 1000)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                reason = f"HTTP {response.status_code}"
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as exc:
+                if attempt >= self.max_retries:
+                    raise RuntimeError(f"SQL查询接口连接失败: {str(exc)}") from exc
+                reason = str(exc)
+            delay = self._backoff(attempt)
+            attempt += 1
+            with self._retry_lock:
+                self.retry_count += 1
+            logger.info("SQL查询接口暂时不可用(%s)，%.1f秒后第%d次重试\n", reason, delay, attempt)
+            time.sleep(delay)
+
+    def _get_async_client(self) -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        """当前事件循环的异步客户端和信号量，首次使用时创建"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            entry = self._async_clients.get(loop)
+            if entry is None:
+                entry = (
+                    httpx.AsyncClient(
+                        headers=dict(self.session.headers),
+                        timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                        limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                    ),
+                    asyncio.Semaphore(self.max_concurrency),
+                )
+                self._async_clients[loop] = entry
+        return entry
+
+    async def _apost(self, sql: str) -> httpx.Response:
+        client, semaphore = self._get_async_client()
+        payload = {"sql": sql}
+        if self.limit is not None:
+            payload["limit"] = self.limit
+        logger = get_logger()
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        response = await client.post(self.url, json=payload)
+                    finally:
+                        self.latency.record((time.perf_counter() - start) * 1000)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                reason = f"HTTP {response.status_code}"
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.RemoteProtocolError) as exc:
+                if attempt >= self.max_retries:
+                    raise RuntimeError(f"SQL查询接口连接失败: {str(exc)}") from exc
+                reason = str(exc)
+            delay = self._backoff(attempt)
+            attempt += 1
+            with self._retry_lock:
+                self.retry_count += 1
+            logger.info("SQL查询接口暂时不可用(%s)，%.1f秒后第%d次重试\n", reason, delay, attempt)
+            await asyncio.sleep(delay)
+
+    def _log_sql(self, sql: str) -> str:
+        sql = sql.replace("\\n", " ")
+        get_logger().info("\n>>>>> 查询sql:\n%s\n", sql)
+        if os.getenv("DEBUG", "0") == "1":
+            print(f"\n>>>>> 查询ql:\n{sql}")
+        return sql
+
+    def _on_timeout(self) -> RuntimeError:
+        get_logger().info("请求超时，无法执行SQL查询，请优化SQL")
+        if os.getenv("DEBUG", "0") == "1":
+            print("请求超时，无法执行SQL查询，请优化SQL")
+        return RuntimeError("执行SQL查询超时，请优化SQL后重试。")
+
+    def _parse_response(self, status_code: int, content: bytes) -> SqlResult:
+        debug_mode = os.getenv("DEBUG", "0") == "1"
+        logger = get_logger()
+        if status_code in RETRY_STATUS_CODES:
+            raise RuntimeError(f"SQL查询接口暂时不可用: HTTP {status_code}")
+        result = loads(content)
+        if "success" in result and result["success"] is True:
+            data = SqlResult.from_records(result["data"])
+            logger.info("查询结果:\n%s\n", data)
+            if debug_mode:
+                print(f"查询结果:\n{data}")
+            return data
+        logger.info("查询失败: %s\n", result["detail"])
+        if debug_mode:
+            print("查询失败:" + result["detail"])
+        if "Commands out of sync" in result["detail"]:
+            raise SyntaxError("不能同时执行多组SQL: " + result["detail"])
+        raise RuntimeError(result["detail"])
+
+    def execute_sql_query(self, sql: str) -> SqlResult:
+        """
+        Executes an SQL query using the API endpoint and returns the result.
+
+        Args:
+            sql (str): The SQL query to be executed.
+
+        Returns:
+            SqlResult: The result of the SQL query execution, rendered as JSON by str().
+        """
+        sql = self._log_sql(sql)
+        try:
+            response = self._post(sql)
+        except requests.exceptions.Timeout as exc:
+            raise self._on_timeout() from exc
+        return self._parse_response(response.status_code, response.content)
+
+    async def aexecute_sql_query(self, sql: str) -> SqlResult:
+        """execute_sql_query的异步版本，返回值和异常与同步版本一致"""
+        sql = self._log_sql(sql)
+        try:
+            response = await self._apost(sql)
+        except httpx.TimeoutException as exc:
+            raise self._on_timeout() from exc
+        return self._parse_response(response.status_code, response.content)
+
+    def stats(self) -> dict:
+        """返回查询耗时分布和重试次数"""
+        return {"latency": self.latency.snapshot(), "retries": self.retry_count}
+
+    def close(self) -> None:
+        """关闭连接池"""
+        self.session.close()
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的异步连接池，应在事件循环结束前调用"""
+        with self._async_lock:
+            entry = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].aclose()
@@ -0,0 +1,166 @@
+"""
+This module provides SqlResult, a lightweight SQL query result made of column names and row tuples.
+The result is decoded once, and its JSON text is rendered lazily on first use and then cached,
+so it can be embedded in several prompts and cached without being re-serialized.
+"""
+
+import datetime
+import hashlib
+import json
+from operator import itemgetter
+from typing import Iterator, Optional, Union
+
+
+try:
+    import orjson
+except ImportError:  # orjson是可选依赖，没有安装时使用标准库
+    orjson = None
+
+
+def loads(data: Union[str, bytes]):
+    """解码JSON，安装了orjson时使用orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, (datetime.date, datetime.datetime, datetime.time)) else value
+
+
+class SqlResult:
+    """
+    SQL查询结果：字段名列表 + 行元组列表。
+    - len()得到行数，无需解析JSON
+    - 迭代和下标访问得到dict形式的行，按需生成
+    - str()/format()得到与json.dumps(list[dict], ensure_ascii=False)一致的JSON文本，只渲染一次
+    """
+
+    __slots__ = ("columns", "rows", "_json", "notes", "total")
+
+    def __init__(
+        self,
+        columns: list[str],
+        rows: list[tuple],
+        json_text: Optional[str] = None,
+        notes: tuple[str, ...] = (),
+        total: Optional[int] = None,
+    ):
+        self.columns = columns
+        self.rows = rows
+        self._json = json_text
+        self.notes = notes  # 执行层附加的说明（比如SQL被自动修正），会反馈给LLM
+        self.total = total  # 探测到的真实总行数，None表示没有探测过
+
+    @property
+    def truncated(self) -> bool:
+        """结果是否被行数上限截断（只有探测过总行数时才能确定）"""
+        return self.total is not None and self.total > len(self.rows)
+
+    @classmethod
+    def from_records(cls, records: list[dict]) -> "SqlResult":
+        """从dict形式的行构建，各行的字段以第一行为准"""
+        if len(records) == 0:
+            return cls([], [])
+        columns = list(records[0].keys())
+        if len(columns) == 1:
+            column = columns[0]
+            return cls(columns, [(record.get(column),) for record in records])
+        getter = itemgetter(*columns)
+        try:
+            rows = [getter(record) for record in records]
+        except KeyError:
+            rows = [tuple(record.get(column) for column in columns) for record in records]
+        return cls(columns, rows)
+
+    @classmethod
+    def from_json(cls, data: Union[str, bytes]) -> "SqlResult":
+        """从JSON数组文本构建，保留原文本作为渲染结果"""
+        result = cls.from_records(loads(data))
+        if isinstance(data, str) and len(result.rows) > 0:
+            result._json = data
+        return result
+
+    @classmethod
+    def from_cursor(cls, description, rows: list[tuple]) -> "SqlResult":
+        """
+        从DB-API游标的description和fetch结果构建。
+        日期时间按列转换成ISO格式字符串：每列只检查第一个非空值的类型，没有日期时间的列不做任何复制。
+        """
+        columns = [column[0] for column in description]
+        date_columns = []
+        for idx in range(len(columns)):
+            for row in rows:
+                if row[idx] is not None:
+                    if isinstance(row[idx], (datetime.date, datetime.datetime, datetime.time)):
+                        date_columns.append(idx)
+                    break
+        if len(date_columns) == 0:
+            return cls(columns, rows if isinstance(rows, list) else list(rows))
+        values = list(zip(*rows))
+        for idx in date_columns:
+            values[idx] = [_isoformat(value) for value in values[idx]]
+        return cls(columns, list(zip(*values)))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[dict]:
+        columns = self.columns
+        for row in self.rows:
+            yield dict(zip(columns, row))
+
+    def __getitem__(self, idx: int) -> dict:
+        return dict(zip(self.columns, self.rows[idx]))
+
+    def to_dicts(self) -> list[dict]:
+        """返回dict形式的全部行"""
+        return list(self)
+
+    def drop(self, *columns: str) -> "SqlResult":
+        """返回去掉指定字段后的结果"""
+        keep = [idx for idx, column in enumerate(self.columns) if column not in columns]
+        if len(keep) == len(self.columns):
+            return self
+        return SqlResult([self.columns[idx] for idx in keep], [tuple(row[idx] for idx in keep) for row in self.rows])
+
+    def with_notes(self, *notes: str) -> "SqlResult":
+        """返回附加了说明的结果，行数据和JSON缓存共用，不修改原结果（原结果可能在缓存里）"""
+        if len(notes) == 0:
+            return self
+        return SqlResult(self.columns, self.rows, self._json, self.notes + tuple(notes), self.total)
+
+    def with_total(self, total: int) -> "SqlResult":
+        """返回记录了真实总行数的结果，不修改原结果"""
+        return SqlResult(self.columns, self.rows, self._json, self.notes, total)
+
+    def digest(self) -> str:
+        """
+        结果集的摘要：和行顺序、字段名无关，只由字段数和各行的值决定，
+        用于判断不同写法的SQL是否得到了相同的结果。
+        """
+        rows = sorted(json.dumps(row, ensure_ascii=False, default=str) for row in self.rows)
+        text = json.dumps([len(self.columns), rows], ensure_ascii=False)
+        return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+    def to_json(self) -> str:
+        """渲染成JSON文本，结果会被缓存"""
+        if self._json is None:
+            self._json = json.dumps(self.to_dicts(), ensure_ascii=False, default=str)
+        return self._json
+
+    def __str__(self) -> str:
+        return self.to_json()
+
+    def __format__(self, format_spec: str) -> str:
+        return format(self.to_json(), format_spec)
+
+    def __repr__(self) -> str:
+        return f"SqlResult(columns={self.columns!r}, rows={len(self.rows)})"
+
+
+def as_sql_result(data: Union["SqlResult", str]) -> "SqlResult":
+    """兼容返回JSON字符串的执行函数"""
+    if isinstance(data, SqlResult):
+        return data
+    return SqlResult.from_json(data)
@@ -0,0 +1,281 @@
+"""
+This module provides SqlRewriter, a deterministic rule engine that runs in front of the SQL
+executors. Each rule looks at the SQL with its string literals masked, and either fixes a known
+mistake (e.g. `Rank` used as an alias, quoted ConceptCode values, date columns compared without
+DATE()), flags it before it costs a round trip (e.g. CompanyCode = InnerCode), or adds a note to the
+result (e.g. duplicated rows without DISTINCT). Fired rules are logged and counted.
+"""
+
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from src.log import get_logger
+from src.sql_result import SqlResult, as_sql_result
+
+
+_STRING_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_PLACEHOLDER_PATTERN = re.compile(r"\x00(\d+)\x00")
+
+
+class SqlRuleError(ValueError):
+    """SQL命中了必然出错的写法，不执行，直接把原因反馈给调用方"""
+
+
+class MaskedSql:
+    """把字符串字面量替换成占位符 \\x00N\\x00 的SQL，规则只改写字面量以外的部分"""
+
+    def __init__(self, sql: str):
+        self.literals: list[str] = []
+
+        def mask(match: re.Match) -> str:
+            self.literals.append(match.group(0))
+            return f"\x00{len(self.literals) - 1}\x00"
+
+        self.text = _STRING_PATTERN.sub(mask, sql)
+
+    def literal_value(self, placeholder: str) -> Optional[str]:
+        """占位符对应的字面量的值（去掉引号），不是占位符时返回None"""
+        match = _PLACEHOLDER_PATTERN.fullmatch(placeholder.strip())
+        if match is None:
+            return None
+        return self.literals[int(match.group(1))][1:-1]
+
+    def unmask(self) -> str:
+        return _PLACEHOLDER_PATTERN.sub(lambda m: self.literals[int(m.group(1))], self.text)
+
+
+@dataclass
+class RuleOutcome:
+    """一条规则的处理结果"""
+
+    rule: str
+    action: str  # fixed: 已自动修正; flagged: 拒绝执行; noted: 在结果里附加提示
+    message: str
+
+
+class SqlRule:
+    """
+    规则基类。
+    - rewrite()在执行前调用，可以修改masked.text，返回RuleOutcome表示规则生效
+    - check()在执行后调用，返回附加到结果里的提示
+    """
+
+    name = "rule"
+
+    def rewrite(self, masked: MaskedSql) -> Optional[RuleOutcome]:  # pylint: disable=unused-argument
+        return None
+
+    def check(self, sql: str, result: SqlResult) -> Optional[RuleOutcome]:  # pylint: disable=unused-argument
+        return None
+
+
+class RankAliasRule(SqlRule):
+    """MySQL 8里RANK是保留字，`AS Rank`会报语法错误：给别名及其引用加上反引号"""
+
+    name = "rank_alias"
+    _ALIAS_PATTERN = re.compile(r"\bAS\s+rank\b(?!\s*\()", re.IGNORECASE)
+    _REF_PATTERN = re.compile(r"(?<![`.\w])rank\b(?!\s*\()(?!`)", re.IGNORECASE)
+
+    def rewrite(self, masked: MaskedSql) -> Optional[RuleOutcome]:
+        if not self._ALIAS_PATTERN.search(masked.text):
+            return None
+        masked.text = self._REF_PATTERN.sub(lambda m: f"`{m.group(0)}`", masked.text)
+        return RuleOutcome(self.name, "fixed", "别名Rank是保留字，已加上反引号")
+
+
+_SECUMAIN_HINT = "可以通过constantdb.secumain、constantdb.hk_secumain或constantdb.us_secumain换取对方"
+
+
+class CodeMismatchRule(SqlRule):
+    """不对应的编码字段做等值比较（比如CompanyCode = InnerCode），结果必然是错的"""
+
+    name = "code_mismatch"
+    MISMATCHES = {
+        frozenset(("CompanyCode", "InnerCode")): _SECUMAIN_HINT,
+        frozenset(("ConceptCode", "InnerCode")): "",
+        frozenset(("IndustryCode", "CompanyCode")): "",
+        frozenset(("AreaInnerCode", "CompanyCode")): "",
+    }
+    _CODES = "CompanyCode|InnerCode|ConceptCode|IndustryCode|AreaInnerCode"
+    _PATTERN = re.compile(
+        rf"(?:[\w`]+\.)?(?<![\w`])`?({_CODES})`?\s*=\s*(?:[\w`]+\.)?(?<![\w`])`?({_CODES})`?(?![\w`])"
+    )
+
+    def rewrite(self, masked: MaskedSql) -> Optional[RuleOutcome]:
+        for match in self._PATTERN.finditer(masked.text):
+            pair = frozenset((match.group(1), match.group(2)))
+            if pair in self.MISMATCHES:
+                hint = self.MISMATCHES[pair]
+                raise SqlRuleError(
+                    f"{match.group(1)}跟{match.group(2)}不对应，不能写`{match.group(1)}`=`{match.group(2)}`"
+                    + (f"，{hint}" if hint else "")
+                )
+        return None
+
+
+class QuotedCodeRule(SqlRule):
+    """ConceptCode等编码是数字，和字符串比较时去掉引号"""
+
+    name = "quoted_code"
+    _PATTERN = re.compile(r"(`?\b(?:ConceptCode)\b`?\s*(?:=|<>|!=)\s*)(\x00\d+\x00)", re.IGNORECASE)
+    _IN_PATTERN = re.compile(r"(`?\b(?:ConceptCode)\b`?\s+(?:NOT\s+)?IN\s*\()([^()]*)(\))", re.IGNORECASE)
+
+    def rewrite(self, masked: MaskedSql) -> Optional[RuleOutcome]:
+        fixed = False
+
+        def unquote(placeholder: str) -> str:
+            nonlocal fixed
+            value = masked.literal_value(placeholder)
+            if value is not None and value.strip().isdigit():
+                fixed = True
+                return value.strip()
+            return placeholder
+
+        masked.text = self._PATTERN.sub(lambda m: m.group(1) + unquote(m.group(2)), masked.text)
+        masked.text = self._IN_PATTERN.sub(
+            lambda m: (
+                m.group(1)
+                + ",".join(item.replace(item.strip(), unquote(item.strip())) for item in m.group(2).split(","))
+                + m.group(3)
+            ),
+            masked.text,
+        )
+        if fixed:
+            return RuleOutcome(self.name, "fixed", "ConceptCode是数字，已去掉引号")
+        return None
+
+
+class DateCompareRule(SqlRule):
+    """
+    时间日期字段直接和'YYYY-MM-DD'、'YYYY'做等值比较时，分别用DATE()、YEAR()格式化字段。
+    范围比较不改写：`EndDate > '2020'`改成`YEAR(EndDate) > '2020'`会去掉2020年的行，改变结果。
+    """
+
+    name = "date_compare"
+    _PATTERN = re.compile(r"(?<![\w(`.])((?:[\w`]+\.)?`?\w*(?:Date|Day|Time)`?)(\s*(?:=|<>|!=)\s*)(\x00\d+\x00)")
+    _DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+    _YEAR_PATTERN = re.compile(r"\d{4}")
+
+    def rewrite(self, masked: MaskedSql) -> Optional[RuleOutcome]:
+        fixed = False
+
+        def wrap(match: re.Match) -> str:
+            nonlocal fixed
+            column, op, placeholder = match.groups()
+            value = masked.literal_value(placeholder) or ""
+            if self._DATE_PATTERN.fullmatch(value):
+                fixed = True
+                return f"DATE({column}){op}{placeholder}"
+            if self._YEAR_PATTERN.fullmatch(value):
+                fixed = True
+                return f"YEAR({column}){op}{placeholder}"
+            return match.group(0)
+
+        masked.text = self._PATTERN.sub(wrap, masked.text)
+        if fixed:
+            return RuleOutcome(self.name, "fixed", "时间日期字段已用DATE()/YEAR()格式化后再比较")
+        return None
+
+
+class DistinctHintRule(SqlRule):
+    """没有用DISTINCT的查询返回了重复行时，提示考虑DISTINCT"""
+
+    name = "distinct_hint"
+    _DISTINCT_PATTERN = re.compile(r"\bDISTINCT\b|\bGROUP\s+BY\b", re.IGNORECASE)
+
+    def check(self, sql: str, result: SqlResult) -> Optional[RuleOutcome]:
+        if len(result) < 2 or self._DISTINCT_PATTERN.search(MaskedSql(sql).text):
+            return None
+        if len(set(map(repr, result.rows))) == len(result.rows):
+            return None
+        return RuleOutcome(self.name, "noted", "查询结果存在完全重复的行，如果需要去重，请使用DISTINCT重新查询")
+
+
+def default_rules() -> list[SqlRule]:
+    return [CodeMismatchRule(), RankAliasRule(), QuotedCodeRule(), DateCompareRule(), DistinctHintRule()]
+
+
+class SqlRewriter:
+    """
+    规则引擎，包装SQL执行函数：执行前按顺序应用规则，执行后检查结果。
+    统计每条规则生效的次数；修正过的SQL执行成功且结果非空时，记为省下了一轮迭代，
+    被拒绝执行的SQL记为省下了一次查询。
+    """
+
+    def __init__(self, rules: Optional[list[SqlRule]] = None):
+        self.rules = rules if rules is not None else default_rules()
+        self.fired: Counter = Counter()
+        self.saved_iterations = 0
+        self.saved_calls = 0
+        self._lock = threading.Lock()
+
+    def _record(self, outcomes: list[RuleOutcome]) -> None:
+        with self._lock:
+            for outcome in outcomes:
+                self.fired[f"{outcome.rule}.{outcome.action}"] += 1
+
+    def prepare(self, sql: str) -> tuple[str, list[RuleOutcome]]:
+        """
+        执行前应用规则。
+
+        :param sql: 原始SQL。
+        :return: (改写后的SQL, 生效的规则)。
+        :raises SqlRuleError: 命中了必须拒绝执行的规则。
+        """
+        masked = MaskedSql(sql)
+        outcomes = []
+        try:
+            for rule in self.rules:
+                outcome = rule.rewrite(masked)
+                if outcome is not None:
+                    outcomes.append(outcome)
+        except SqlRuleError as exc:
+            outcomes.append(RuleOutcome(rule.name, "flagged", str(exc)))
+            self._record(outcomes)
+            with self._lock:
+                self.saved_calls += 1
+            get_logger().info("\nSQL规则[%s]拒绝执行: %s\n%s\n", rule.name, str(exc), sql)
+            raise
+        if outcomes:
+            self._record(outcomes)
+            get_logger().info(
+                "\nSQL规则[%s]已修正SQL:\n%s\n=>\n%s\n", ",".join(o.rule for o in outcomes), sql, masked.unmask()
+            )
+        return masked.unmask(), outcomes
+
+    def finish(self, sql: str, result: SqlResult, outcomes: list[RuleOutcome]) -> SqlResult:
+        """执行后检查结果，把修正说明和提示附加到结果上"""
+        notes = [f"SQL已自动修正（{o.message}），实际执行的是: {sql}" for o in outcomes if o.action == "fixed"][:1]
+        checked = []
+        for rule in self.rules:
+            outcome = rule.check(sql, result)
+            if outcome is not None:
+                checked.append(outcome)
+                notes.append(outcome.message)
+        self._record(checked)
+        if outcomes and len(result) > 0:
+            with self._lock:
+                self.saved_iterations += 1
+        return result.with_notes(*notes)
+
+    def run(self, sql: str, execute: Callable[[str], SqlResult]) -> SqlResult:
+        """改写并执行SQL"""
+        rewritten, outcomes = self.prepare(sql)
+        return self.finish(rewritten, as_sql_result(execute(rewritten)), outcomes)
+
+    async def arun(self, sql: str, aexecute: Callable[[str], Awaitable[SqlResult]]) -> SqlResult:
+        """run的异步版本"""
+        rewritten, outcomes = self.prepare(sql)
+        return self.finish(rewritten, as_sql_result(await aexecute(rewritten)), outcomes)
+
+    def stats(self) -> dict:
+        """返回各规则生效次数和省下的迭代、查询次数"""
+        with self._lock:
+            return {
+                "fired": dict(self.fired),
+                "saved_iterations": self.saved_iterations,
+                "saved_calls": self.saved_calls,
+            }
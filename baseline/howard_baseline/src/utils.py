@@ -4,9 +4,11 @@ This module provides utility functions.
 
 import re
 import json
-from typing import Optional
+from typing import NamedTuple, Optional
 
 COLUMN_LIST_MARK = "数据表的字段信息如下"
+_NORMALIZE_PATTERN = re.compile(r"[\s\W_]+", re.UNICODE)
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
 
 
 def generate_markdown_table(data_list, key_title_map):
@@ -34,22 +36,121 @@ def get_column_list(db_table, table_column, tables: list[str]) -> str:
     """
     tables: list of table names, format is database_name.table_name
     """
-    column_lists = []
-    for table in tables:
-        if "." not in table or table.count(".") != 1:
-            raise ValueError(f"发生异常: 表名`{table}`格式不正确，应该为`database_name.table_name`")
-        db_name, table_name = table.split(".")
-        if db_name not in db_table:
-            raise KeyError(f"发生异常: 数据库名`{db_name}`不存在")
-        if any(t["表英文"] == table_name for t in db_table[db_name]["表"]):
-            column_lists.append(
-                {
-                    "表名": table,
-                    "表字段": table_column[table_name],
-                }
-            )
-    result = f"已取得可用的{COLUMN_LIST_MARK}:\n" + json.dumps(column_lists, ensure_ascii=False) + "\n"
-    return result
+    from src.schema_catalog import SchemaCatalog  # pylint: disable=import-outside-toplevel
+
+    return SchemaCatalog.shared(db_table, table_column).render_column_list(tables)
+
+
+def normalize_text(text: str) -> str:
+    """
+    归一化文本：转小写、去掉空白和标点，用于文本之间的相似度比较。
+
+    :param text: 原始文本。
+    :return: 归一化后的文本。
+    """
+    return _NORMALIZE_PATTERN.sub("", text.lower())
+
+
+def char_ngrams(text: str, n: int = 2) -> set[str]:
+    """
+    把文本切分成字符级的n-gram集合，文本长度不足n时，整段文本作为一个gram。
+
+    :param text: 文本（一般先经过normalize_text）。
+    :param n: gram的长度。
+    :return: n-gram集合。
+    """
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计文本的token数：中文字符和全角标点按1个token计，其余字符按4个字符1个token计。
+
+    :param text: 文本。
+    :return: 估计的token数。
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def jaccard_similarity(a: set, b: set) -> float:
+    """
+    计算两个集合的Jaccard相似度。
+
+    :param a: 集合a。
+    :param b: 集合b。
+    :return: 0~1之间的相似度。
+    """
+    if not a and not b:
+        return 1.0
+    inter = len(a & b)
+    return inter / (len(a) + len(b) - inter)
+
+
+class FencedBlock(NamedTuple):
+    """LLM回答里的一个代码块"""
+
+    kind: str  # 代码块标记，如exec_sql、sql、json，没有标记时为空字符串
+    content: str  # 去掉首尾空白后的内容
+
+
+# 代码块：```标记 + 内容 + ```，标记只能是字母、数字、下划线
+_FENCE_PATTERN = re.compile(r"```(\w*)(.*?)```", re.DOTALL)
+# 只取json代码块时直接匹配比解析全部代码块快
+_JSON_BLOCK_PATTERN = re.compile(r"```json(.*?)```", re.DOTALL)
+# SQL词法单元：字符串/引号标识符、注释、分号，其它字符成段匹配
+_SQL_TOKEN_PATTERN = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'"  # 单引号字符串
+    r'|"(?:[^"\\]|\\.|"")*"'  # 双引号字符串
+    r"|`[^`]*`"  # 反引号标识符
+    r"|--[^\n]*|/\*.*?\*/"  # 注释
+    r"|;"
+    r"|[^'\"`;/-]+|.",
+    re.DOTALL,
+)
+
+
+def parse_fenced_blocks(text: str) -> list[FencedBlock]:
+    """
+    一次扫描把文本解析成代码块列表。
+
+    :param text: LLM的回答。
+    :return: 按出现顺序排列的代码块。
+    """
+    blocks = []
+    for match in _FENCE_PATTERN.finditer(text):
+        blocks.append(FencedBlock(match.group(1), match.group(2).strip()))
+    return blocks
+
+
+def split_sql_statements(sql: str) -> list[str]:
+    """
+    把SQL文本拆分成语句并去掉注释。字符串、引号标识符里的分号和--不会被当作分隔符或注释。
+
+    :param sql: SQL文本。
+    :return: 去掉首尾空白后的非空语句，不带分号。
+    """
+    statements = []
+    current = []
+    for match in _SQL_TOKEN_PATTERN.finditer(sql):
+        token = match.group(0)
+        if token == ";":
+            statement = "".join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        elif token.startswith("--"):
+            continue
+        elif token.startswith("/*"):
+            current.append(" ")
+        else:
+            current.append(token)
+    statement = "".join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
 
 
 def extract_last_sql(query_string: str, block_mark: str) -> Optional[str]:
@@ -60,17 +161,10 @@ def extract_last_sql(query_string: str, block_mark: str) -> Optional[str]:
     :param block_mark: SQL 代码块的标记。
     :return: 最后一组 SQL 语句。
     """
-    # 使用正则表达式匹配 SQL 语句块
-    sql_pattern = re.compile(rf"(?s)```{re.escape(block_mark)}\s+(.*?)\s+```")
-    matches = sql_pattern.findall(query_string)
-    if matches:
-        # 提取最后一个 SQL 代码块
-        last_sql_block = matches[-1].strip()
-        # 去掉注释但保留分号
-        last_sql_block = re.sub(r"--.*(?=\n)|--.*$", "", last_sql_block)
-        # 分割 SQL 语句
-        sql_statements = [stmt.strip() for stmt in last_sql_block.split(";") if stmt.strip()]
-        # 返回最后一个非空 SQL 语句
+    blocks = [block for block in parse_fenced_blocks(query_string) if block.kind == block_mark]
+    if blocks:
+        # 返回最后一个代码块里最后一个非空 SQL 语句
+        sql_statements = split_sql_statements(blocks[-1].content)
         return sql_statements[-1] + ";" if sql_statements else None
     return None
 
@@ -83,17 +177,11 @@ def count_total_sql(query_string: str, block_mark: str) -> int:
     :param block_mark: SQL 代码块的标记。
     :return: SQL 语句的总数。
     """
-    # 使用正则表达式匹配 SQL 语句块
-    sql_pattern = re.compile(rf"(?s)```{re.escape(block_mark)}\s+(.*?)\s+```")
-    matches = sql_pattern.findall(query_string)
-    total_sql_count = 0
-    for sql_block in matches:
-        # 去掉注释但保留分号
-        sql_block = re.sub(r"--.*(?=\n)|--.*$", "", sql_block)
-        # 分割 SQL 语句并计数
-        sql_statements = [stmt.strip() for stmt in sql_block.split(";") if stmt.strip()]
-        total_sql_count += len(sql_statements)
-    return total_sql_count
+    return sum(
+        len(split_sql_statements(block.content))
+        for block in parse_fenced_blocks(query_string)
+        if block.kind == block_mark
+    )
 
 
 def extract_last_json(text: str) -> Optional[str]:
@@ -106,8 +194,7 @@ def extract_last_json(text: str) -> Optional[str]:
     Returns:
         Optional[str]: 提取的JSON字符串，如果未找到则返回None。
     """
-    pattern = r"```json(.*?)```"
-    matches = re.findall(pattern, text, re.DOTALL)
+    matches = _JSON_BLOCK_PATTERN.findall(text)
     return matches[-1].strip() if matches else None
 
 
@@ -0,0 +1,159 @@
+"""
+This module provides ValueIndex, an offline-built index of column values
+used to link question terms to `table.column = value` hints without querying the database.
+"""
+
+import json
+import os
+from typing import Callable, Optional
+
+from src.log import get_logger
+from src.sql_result import SqlResult, as_sql_result
+from src.utils import normalize_text
+
+
+class ValueIndex:
+    """
+    字段取值索引。
+    对低基数字段/枚举字段保存全部去重后的取值，对高基数字段只保存样例取值。
+    匹配时在问题里查找出现过的取值，生成"词 → 表.字段 = 值"的提示。
+    """
+
+    def __init__(self, columns: Optional[dict] = None, min_term_len: int = 2):
+        """
+        columns: dict{
+            "database_name.table_name.column_name": {
+                "values": [str, ...],           # 去重后的取值（或样例）
+                "complete": bool,               # values是否为全部取值
+                "distinct_count": int,          # 去重后的取值数量
+                "extras": {value: {col: val}},  # 可选，取值对应的其他字段（如ct_systemconst的LB、DM）
+            }
+        }
+        """
+        self.columns = columns if columns is not None else {}
+        self.min_term_len = min_term_len
+        self._terms: dict[str, list[tuple[str, str]]] = {}
+        self._max_term_len = 0
+        for column, info in self.columns.items():
+            for value in info["values"]:
+                term = normalize_text(str(value))
+                if len(term) < self.min_term_len:
+                    continue
+                self._terms.setdefault(term, []).append((column, str(value)))
+                self._max_term_len = max(self._max_term_len, len(term))
+
+    @classmethod
+    def build(
+        cls,
+        execute_sql_query: Callable[[str], SqlResult],
+        columns: list[dict],
+        max_distinct: int = 500,
+        sample_size: int = 20,
+        page_size: int = 100,
+    ) -> "ValueIndex":
+        """
+        通过SQL查询构建索引。
+
+        :param execute_sql_query: 执行SQL并返回SqlResult（或JSON字符串）的函数。
+        :param columns: 要索引的字段，每项形如
+            {"column": "database_name.table_name.column_name", "extras": ["col"], "max_distinct": int}，
+            其中extras和max_distinct可选。
+        :param max_distinct: 去重后取值数不超过该值的字段保存全部取值，否则只保存样例。
+        :param sample_size: 高基数字段的样例数量。
+        :param page_size: 分页拉取取值时每页的行数，不应大于查询接口的行数限制。
+        :return: ValueIndex
+        """
+        logger = get_logger()
+        index = {}
+        for spec in columns:
+            table, column = spec["column"].rsplit(".", 1)
+            extras = spec.get("extras", [])
+            rows = as_sql_result(execute_sql_query(f"SELECT COUNT(DISTINCT {column}) AS cnt FROM {table};"))
+            distinct_count = int(rows[0]["cnt"]) if rows else 0
+            complete = distinct_count <= spec.get("max_distinct", max_distinct)
+            select_cols = ", ".join([column] + extras)
+            values, value_extras, seen = [], {}, set()
+            offset = 0
+            while True:
+                limit = page_size if complete else min(page_size, sample_size - len(values))
+                if limit <= 0:
+                    break
+                rows = as_sql_result(
+                    execute_sql_query(
+                        f"SELECT DISTINCT {select_cols} FROM {table} WHERE {column} IS NOT NULL "
+                        f"ORDER BY {column} LIMIT {limit} OFFSET {offset};"
+                    )
+                )
+                for row in rows:
+                    value = row[column]
+                    if value in seen:
+                        continue
+                    seen.add(value)
+                    values.append(value)
+                    if extras:
+                        value_extras[str(value)] = {col: row[col] for col in extras}
+                if len(rows) < limit:
+                    break
+                offset += limit
+            logger.info("构建字段取值索引 %s: %d/%d\n", spec["column"], len(values), distinct_count)
+            index[spec["column"]] = {
+                "values": values,
+                "complete": complete,
+                "distinct_count": distinct_count,
+            }
+            if value_extras:
+                index[spec["column"]]["extras"] = value_extras
+        return cls(index)
+
+    @classmethod
+    def load(cls, path: str) -> "ValueIndex":
+        """从文件加载索引"""
+        with open(path, encoding="utf-8") as file:
+            return cls(json.load(file))
+
+    def save(self, path: str) -> None:
+        """把索引保存到文件"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.columns, file, ensure_ascii=False)
+
+    def match(self, text: str, max_hints: int = 20) -> list[tuple[str, str, str]]:
+        """
+        在文本中查找出现过的字段取值，优先保留更长的匹配，被更长匹配覆盖的短匹配会被丢弃。
+
+        :param text: 问题文本。
+        :param max_hints: 最多返回的匹配数。
+        :return: [(词, database_name.table_name.column_name, 值)]
+        """
+        text = normalize_text(text)
+        spans = []
+        for start in range(len(text)):
+            for end in range(start + self.min_term_len, min(len(text), start + self._max_term_len) + 1):
+                if text[start:end] in self._terms:
+                    spans.append((start, end))
+        spans.sort(key=lambda span: (span[0] - span[1], span[0]))
+        covered = []
+        results = []
+        for start, end in spans:
+            if any(s <= start and end <= e for s, e in covered):
+                continue
+            covered.append((start, end))
+            term = text[start:end]
+            for column, value in self._terms[term]:
+                results.append((term, column, value))
+                if len(results) >= max_hints:
+                    return results
+        return results
+
+    def format_hints(self, text: str, max_hints: int = 20) -> str:
+        """
+        生成问题中的词与字段取值的对应提示，没有匹配时返回空字符串。
+        """
+        lines = []
+        for term, column, value in self.match(text, max_hints=max_hints):
+            line = f"- {term} → {column} = '{value}'"
+            extras = self.columns[column].get("extras", {}).get(value)
+            if extras:
+                line += " (" + ", ".join(f"{k}={v}" for k, v in extras.items()) + ")"
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,75 @@
+"""
+This module provides cheap deterministic voting over parallel samples: answer_fingerprint maps
+an answer to a canonical key (its JSON block, its SQL fingerprint or its normalized text), and
+Vote tallies keys, reports when k samples agree and picks the winner without another LLM call.
+"""
+
+import json
+from collections import Counter
+from typing import Any, Hashable, Optional
+
+from src.convergence import sql_fingerprint
+from src.utils import extract_last_json, normalize_text, parse_fenced_blocks, split_sql_statements
+
+
+def answer_fingerprint(answer: str, sql_block_mark: str = "exec_sql") -> str:
+    """
+    回答的规范化指纹，用于判断多个采样是否一致：
+    有json代码块时取最后一个json（按key排序后序列化），有SQL代码块时取最后一条SQL的指纹，否则取归一化后的文本。
+
+    :param answer: LLM的回答。
+    :param sql_block_mark: SQL代码块的标记。
+    :return: 指纹。
+    """
+    json_text = extract_last_json(answer)
+    if json_text is not None:
+        try:
+            return "json:" + json.dumps(json.loads(json_text), ensure_ascii=False, sort_keys=True)
+        except json.JSONDecodeError:
+            pass
+    for block in reversed(parse_fenced_blocks(answer)):
+        if block.kind == sql_block_mark:
+            statements = split_sql_statements(block.content)
+            if statements:
+                return "sql:" + sql_fingerprint(statements[-1])
+    return "text:" + normalize_text(answer)
+
+
+class Vote:
+    """
+    多数投票。
+    - add()加入一票，某个key的票数达到agree时返回True，调用方可以提前停止
+    - winner()返回票数最多的key对应的第一个候选，票数相同时取最先得票的key，结果是确定的
+    """
+
+    def __init__(self, agree: Optional[int] = None):
+        self.agree = agree
+        self.counts: Counter = Counter()
+        self.first: dict[Hashable, Any] = {}  # key -> 第一个投给它的候选
+        self.order: list[Hashable] = []  # key第一次得票的顺序
+
+    def __len__(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, key: Hashable, candidate: Any) -> bool:
+        """
+        加入一票。
+
+        :param key: 候选的指纹。
+        :param candidate: 候选本身。
+        :return: 是否已经有key达到agree票。
+        """
+        if key not in self.first:
+            self.first[key] = candidate
+            self.order.append(key)
+        self.counts[key] += 1
+        return self.agree is not None and self.counts[key] >= self.agree
+
+    def winner(self) -> Optional[tuple[Hashable, Any, float]]:
+        """
+        :return: (key, 候选, 置信度)，置信度是得票占比；没有任何票时返回None。
+        """
+        if not self.order:
+            return None
+        best = max(self.order, key=lambda key: (self.counts[key], -self.order.index(key)))
+        return best, self.first[best], self.counts[best] / len(self)
@@ -4,13 +4,39 @@ which handles recalling database information using various agents.
 """
 
 import json, os, copy
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Callable, Optional
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
 
 from src.log import get_logger
 from src.llm import LLM
 from src.agent import Agent, AgentConfig
-from src.utils import generate_markdown_table, extract_last_sql, extract_last_json, COLUMN_LIST_MARK, count_total_sql
+from src.budget import Budget
+from src.fact_store import FactStore
+from src.history import extractive_summary, messages_tokens, split_for_compression
+from src.dag import get_executor
+from src.voting import Vote
+from src.convergence import (
+    sql_fingerprint,
+    ConvergenceMonitor,
+    STOP_ANSWERED,
+    STOP_BUDGET,
+    STOP_MAX_ITERATIONS,
+    STOP_STALLED,
+)
+from src.result_workspace import ResultWorkspace
+from src.schema_cache import SchemaSelection, SchemaSelectionCache
+from src.schema_catalog import SchemaCatalog
+from src.sql_result import SqlResult, as_sql_result
+from src.sql_rewrite import SqlRewriter
+from src.utils import (
+    generate_markdown_table,
+    extract_last_json,
+    COLUMN_LIST_MARK,
+    parse_fenced_blocks,
+    split_sql_statements,
+)
 
 
 class Workflow(ABC):
@@ -51,6 +77,28 @@ class Workflow(ABC):
         """
 
 
+@dataclass
+class _SqlQueryState:
+    """SqlQuery单次运行的状态"""
+
+    messages: list
+    first_user_msg: str
+    db_structs: list
+    local_db_structs: list
+    same_sqls: dict = field(default_factory=dict)
+    told_specific_columns: set = field(default_factory=set)
+    usage_tokens: int = 0
+    iterate_num: int = 0
+    is_finish: bool = False
+    budget: Optional[Budget] = None
+    monitor: Optional[ConvergenceMonitor] = None
+    stop_reason: Optional[str] = None
+    last_failed: bool = False  # 上一次执行的SQL是否出错或结果为空
+    head: list = field(default_factory=list)  # 初始消息，压缩历史时保留原样
+    history_summary: str = ""  # 被压缩掉的中间消息的摘要
+    workspace: Optional[ResultWorkspace] = None  # 本次运行查询到的结果，可以用@result_N引用
+
+
 class SqlQuery(Workflow):
     """
     Implements the functionality to write and execute sql to fetch data, inheriting from Workflow.
@@ -58,23 +106,51 @@ class SqlQuery(Workflow):
 
     def __init__(
         self,
-        execute_sql_query: Callable[[str], str],
+        execute_sql_query: Callable[[str], SqlResult],
         llm: LLM,
         max_iterate_num: int = 5,
         name: Optional[str] = None,
         specific_column_desc: Optional[dict] = None,
         cache_history_facts: Optional[bool] = False,
         default_sql_limit: Optional[int] = None,
+        execute_sql_query_async: Optional[Callable[[str], Awaitable[SqlResult]]] = None,
+        stall_turns: Optional[int] = None,
+        fact_store: Optional[FactStore] = None,
+        max_history_tokens: Optional[int] = None,
+        sql_candidates: int = 1,
+        sql_candidates_on_failure: bool = True,
+        result_workspace: bool = False,
+        sql_rewriter: Optional[SqlRewriter] = None,
     ):
         self.name = "Sql_query" if name is None else name
         self.execute_sql_query = execute_sql_query
+        self.execute_sql_query_async = execute_sql_query_async
+        self.stall_turns = stall_turns  # 连续多少轮没有进展就停止迭代，None表示不检测
         self.max_iterate_num = max_iterate_num
+        # 迭代消息的估计token数超过它时，抽取式压缩较早的迭代，None表示不压缩
+        self.max_history_tokens = max_history_tokens
+        # 大于1时再生成sql_candidates-1个候选SQL并发执行，按结果集投票；
+        # sql_candidates_on_failure为True时只在上一次SQL出错或结果为空后才这么做
+        self.sql_candidates = sql_candidates
+        self.sql_candidates_on_failure = sql_candidates_on_failure
+        # 为True时每个问题的查询结果保存成内存表，引用@result_N或者不查询数据表的SQL在本地执行
+        self.result_workspace = result_workspace
+        # 执行agent给出的SQL前用规则修正或拦截常见的错误写法，只作用于本工作流，不影响其它地方的内部查询
+        self.sql_rewriter = sql_rewriter
         self.usage_tokens = 0
         self.is_cache_history_facts = cache_history_facts
-        self.history_facts = []
+        # 同组问题之前查询到的事实，只把和当前问题相关的注入到提示里
+        self.fact_store = fact_store if fact_store is not None else FactStore()
         self.max_db_struct_num = 1
         self.specific_column_desc = specific_column_desc if specific_column_desc is not None else {}
         self.default_sql_limit = default_sql_limit
+        if result_workspace:
+            calc_hint = (
+                """（如果涉及到数学运算即便是用已知的纯数字做计算，也可以通过SQL语句来进行，保证计算结果的正确性，如`SELECT 1+1 AS a`，这类不查询数据表的SQL在本地执行）\n"""
+                """（每个非空的查询结果都会保存为@result_N，如果只是对已有的查询结果做排序、筛选、去重、计数或计算，用`SELECT ... FROM @result_N`在本地执行，不要重新查询数据库；@result_N不能和数据库表一起查询）\n"""
+            )
+        else:
+            calc_hint = """（如果涉及到数学运算即便是用已知的纯数字做计算，也可以通过SQL语句来进行，保证计算结果的正确性，如`SELECT 1+1 AS a`）\n"""
         self.agent_master = Agent(
             AgentConfig(
                 name=self.name + ".master",
@@ -128,8 +204,8 @@ class SqlQuery(Workflow):
                     """（这里必须使用已知的数据库表和字段，不能假设任何数据表或字典）\n"""
                     """【执行SQL语句】\n"""
                     """（唯一允许的SQL代码块，如果当前阶段无需继续执行SQL，那么这里写"无"）\n"""
-                    """（如果涉及到数学运算即便是用已知的纯数字做计算，也可以通过SQL语句来进行，保证计算结果的正确性，如`SELECT 1+1 AS a`）\n"""
-                    """（这里必须使用已知的数据库表和字段，不能假设任何数据表或字典）\n"""
+                    + calc_hint
+                    + """（这里必须使用已知的数据库表和字段，不能假设任何数据表或字典）\n"""
                     """```exec_sql\n"""
                     """SELECT [精准字段] \n"""
                     """FROM [完整表名] \n"""
@@ -139,7 +215,8 @@ class SqlQuery(Workflow):
                     """（如果当前阶段无执行SQL，那么这里写"无"）\n"""
                 ),
                 llm=llm,
-                enable_history=True,
+                # 迭代的消息由SqlQuery自己维护（见_fit_messages），agent不需要保存历史
+                enable_history=False,
                 # temperature = 0.8,
                 # top_p = 0.7,
                 stream=False,
@@ -182,7 +259,7 @@ class SqlQuery(Workflow):
             agent.clear_history()
 
     def clear_history_facts(self):
-        self.history_facts = []
+        self.fact_store.clear()
 
     def add_system_prompt_kv(self, kv: dict):
         for agent in self.agent_lists:
@@ -197,17 +274,8 @@ class SqlQuery(Workflow):
         for agent in self.agent_lists:
             agent.clear_system_prompt_kv()
 
-    def run(self, inputs: dict) -> dict:
-        """
-        inputs:
-            - messages: list[dict] # 消息列表，每个元素是一个dict，包含role和content
-        """
-        debug_mode = os.getenv("DEBUG", "0") == "1"
-        logger = get_logger()
-        usage_tokens = 0
-        same_sqls = {}
-        told_specific_columns = set()
-
+    def _prepare(self, inputs: dict) -> "_SqlQueryState":
+        """解析输入消息，注入已知的数据库结构，返回本次运行的状态"""
         if "messages" not in inputs:
             raise KeyError("发生异常: inputs缺少'messages'字段")
 
@@ -224,192 +292,488 @@ class SqlQuery(Workflow):
                 )
             else:
                 messages.append(msg)
-        local_db_structs = copy.deepcopy(db_structs)
 
         first_user_msg = messages[-1]["content"]
-        if len(self.history_facts) > 0:
+        history_facts = self.fact_store.select(first_user_msg, hints=inputs.get("fact_hints", ""))
+        if len(history_facts) > 0:
+            get_logger().debug("\n>>>>> 注入历史事实: %d/%d\n", len(history_facts), len(self.fact_store))
             messages[-1]["content"] = (
-                "之前已查询到信息如下:\n" + "\n---\n".join(self.history_facts) + "\n\n请问:" + first_user_msg
+                "之前已查询到信息如下:\n" + "\n---\n".join(history_facts) + "\n\n请问:" + first_user_msg
             )
+        return _SqlQueryState(
+            messages=messages,
+            first_user_msg=first_user_msg,
+            db_structs=db_structs,
+            local_db_structs=copy.deepcopy(db_structs),
+            budget=inputs.get("budget"),
+            monitor=ConvergenceMonitor(stall_turns=self.stall_turns) if self.stall_turns is not None else None,
+            head=list(messages),
+            workspace=ResultWorkspace(max_rows=self.default_sql_limit) if self.result_workspace else None,
+        )
+
+    def _fit_messages(self, state: "_SqlQueryState") -> None:
+        """
+        迭代消息超过max_history_tokens时，保留初始消息和最近的迭代，中间的迭代抽取式压缩成摘要附在初始消息后面。
+        不调用LLM，不增加延迟。
+        """
+        if self.max_history_tokens is None or messages_tokens(state.messages) <= self.max_history_tokens:
+            return
+        head_len = len(state.head)
+        split = head_len + split_for_compression(state.messages[head_len:], self.max_history_tokens // 2)
+        # 保留的部分从assistant消息开始，保持user/assistant交替
+        while split < len(state.messages) and state.messages[split]["role"] != "assistant":
+            split += 1
+        if split <= head_len or split >= len(state.messages):
+            return
+        middle = state.messages[head_len:split]
+        if state.history_summary != "":
+            middle = [{"role": "user", "content": state.history_summary}] + middle
+        state.history_summary = extractive_summary(middle, self.max_history_tokens // 4)
+        last = state.head[-1]
+        state.messages = (
+            state.head[:-1]
+            + [
+                {
+                    "role": last["role"],
+                    "content": last["content"] + "\n\n之前的查询过程摘要:\n" + state.history_summary,
+                }
+            ]
+            + state.messages[split:]
+        )
+        get_logger().debug("\n>>>>> 压缩迭代历史: %d条消息\n", split - head_len)
 
-        iterate_num = 0
-        is_finish = False
-        answer = ""
-        while iterate_num < self.max_iterate_num:
-            iterate_num += 1
-            answer, tkcnt_1 = self.agent_master.chat(messages=messages)
-            usage_tokens += tkcnt_1
-
-            if "```exec_sql" in answer and ("SELECT " in answer or "SHOW " in answer):
-                sql_cnt = count_total_sql(
-                    query_string=answer,
-                    block_mark="exec_sql",
+    def _parse_answer(self, state: "_SqlQueryState", answer: str) -> Optional[str]:
+        """
+        处理agent_master的回复。
+        返回待执行的SQL；回复里没有SQL时把回复记入消息并标记结束；SQL不合规或已执行过时追加提示，返回None。
+        """
+        if "```exec_sql" in answer and ("SELECT " in answer or "SHOW " in answer):
+            # 只解析一次回答，得到每个exec_sql代码块里的SQL语句
+            statements = [
+                split_sql_statements(block.content)
+                for block in parse_fenced_blocks(answer)
+                if block.kind == "exec_sql"
+            ]
+            sql_cnt = sum(len(stmts) for stmts in statements)
+            if sql_cnt > 1:
+                emphasize = "一次仅允许给出一组待执行的SQL写到代码块```exec_sql ```中"
+                if emphasize not in state.messages[-1]["content"]:
+                    state.messages[-1]["content"] += f"\n\n{emphasize}"
+                self._observe(state)
+                return None
+            sql = statements[-1][-1] + ";" if len(statements) > 0 and len(statements[-1]) > 0 else None
+            if sql is None:
+                emphasize = "请务必需要把待执行的SQL写到代码块```exec_sql ```中"
+                if emphasize not in state.messages[-1]["content"]:
+                    state.messages[-1]["content"] += f"\n\n{emphasize}"
+                self._observe(state)
+                return None
+            state.messages.append(
+                {
+                    "role": "assistant",
+                    "content": answer,
+                }
+            )
+            if sql in state.same_sqls:
+                emphasize = (
+                    f"下面的sql已经执行过:\n{sql}\n结果是:\n{state.same_sqls[sql]}\n"
+                    "请不要重复执行，考虑其它思路:\n"
+                    "如果遇到字段不存在的错误,可以用`SELECT * FROM database_name.table_name LIMIT 1;`来查看这个表的字段值的形式;\n"
+                    "如果原SQL过于复杂，可以考虑先查询简单SQL获取必要信息再逐步推进;\n"
                 )
-                if sql_cnt > 1:
-                    emphasize = "一次仅允许给出一组待执行的SQL写到代码块```exec_sql ```中"
-                    if emphasize not in messages[-1]["content"]:
-                        messages[-1]["content"] += f"\n\n{emphasize}"
-                else:
-                    sql = extract_last_sql(
-                        query_string=answer,
-                        block_mark="exec_sql",
-                    )
-                    if sql is None:
-                        emphasize = "请务必需要把待执行的SQL写到代码块```exec_sql ```中"
-                        if emphasize not in messages[-1]["content"]:
-                            messages[-1]["content"] += f"\n\n{emphasize}"
-                    else:
-                        messages.append(
-                            {
-                                "role": "assistant",
-                                "content": answer,
-                            }
-                        )
-                        if sql in same_sqls:
-                            emphasize = (
-                                f"下面的sql已经执行过:\n{sql}\n结果是:\n{same_sqls[sql]}\n"
-                                "请不要重复执行，考虑其它思路:\n"
-                                "如果遇到字段不存在的错误,可以用`SELECT * FROM database_name.table_name LIMIT 1;`来查看这个表的字段值的形式;\n"
-                                "如果原SQL过于复杂，可以考虑先查询简单SQL获取必要信息再逐步推进;\n"
-                            )
-                            messages.append(
-                                {
-                                    "role": "user",
-                                    "content": emphasize,
-                                }
-                            )
-                        else:
-                            need_tell_cols = []
-                            for t_name, cols in self.specific_column_desc.items():
-                                if t_name in sql:
-                                    for col_name in cols:
-                                        if (
-                                            col_name in sql
-                                            and f"{t_name}.{col_name}" not in told_specific_columns
-                                            and not any(col_name in db_struct for db_struct in db_structs)
-                                        ):
-                                            need_tell_cols.append({col_name: cols[col_name]})
-                                            told_specific_columns.add(f"{t_name}.{col_name}")
-                            if len(need_tell_cols) > 0:
-                                local_db_structs.append(json.dumps(need_tell_cols, ensure_ascii=False))
-                                self.agent_master.add_system_prompt_kv(
-                                    {"KNOWN DATABASE STRUCTURE": "\n\n---\n\n".join(local_db_structs)}
-                                )
-                                self.agent_understand_query_result.add_system_prompt_kv(
-                                    {"KNOWN DATABASE STRUCTURE": "\n\n---\n\n".join(local_db_structs)}
-                                )
-                            try:
-                                data = self.execute_sql_query(sql=sql)
-                                rows = json.loads(data)
-                                if len(rows) == 0:  # 空结果
-                                    messages.append(
-                                        {
-                                            "role": "user",
-                                            "content": (
-                                                f"查询SQL:\n{sql}\n查询结果:\n{data}\n"
-                                                + (
-                                                    ""
-                                                    if len(need_tell_cols) == 0
-                                                    else "\n补充字段说明如下:\n"
-                                                    + json.dumps(need_tell_cols, ensure_ascii=False)
-                                                )
-                                                + "\n请检查筛选条件是否存在问题，比如时间日期字段没有用DATE()或YEAR()格式化？当然，如果没问题，那么就根据结果考虑下一步"
-                                            ),
-                                        }
-                                    )
-                                elif self.default_sql_limit is not None and len(rows) == self.default_sql_limit:
-                                    messages.append(
-                                        {
-                                            "role": "user",
-                                            "content": (
-                                                f"查询SQL:\n{sql}\n查询结果:\n{data}\n"
-                                                + (
-                                                    ""
-                                                    if len(need_tell_cols) == 0
-                                                    else "\n补充字段说明如下:\n"
-                                                    + json.dumps(need_tell_cols, ensure_ascii=False)
-                                                )
-                                                + f"\n请注意，这里返回的不一定是全部结果，因为默认限制了只返回{self.default_sql_limit}个，你可以根据现在看到的情况，采取子查询的方式去进行下一步"
-                                            ),
-                                        }
-                                    )
-                                else:
-                                    facts, tkcnt_1 = self.agent_understand_query_result.answer(
-                                        (
-                                            f"查询SQL:\n{sql}\n查询结果:\n{data}\n"
-                                            + (
-                                                ""
-                                                if len(need_tell_cols) == 0
-                                                else "\n补充字段说明如下:\n"
-                                                + json.dumps(need_tell_cols, ensure_ascii=False)
-                                            )
-                                            + "\n请理解查询结果"
-                                        )
-                                    )
-                                    if self.is_cache_history_facts:
-                                        self.history_facts.append(facts)
-                                    usage_tokens += tkcnt_1
-                                    messages.append(
-                                        {
-                                            "role": "user",
-                                            "content": (
-                                                f"查询SQL:\n{sql}\n查询结果:\n{data}\n"
-                                                + (
-                                                    ""
-                                                    if len(need_tell_cols) == 0
-                                                    else "\n补充字段说明如下:\n"
-                                                    + json.dumps(need_tell_cols, ensure_ascii=False)
-                                                )
-                                                + (f"\n{facts}\n" if facts != "" else "\n")
-                                                + "\n请检查筛选条件是否存在问题，比如时间日期字段没有用DATE()或YEAR()格式化？当然，如果没问题，那么就根据结果考虑下一步；"
-                                                + f'那么当前掌握的信息是否能够回答"{first_user_msg}"？还是要继续执行下一阶段SQL查询？'
-                                            ),
-                                        }
-                                    )
-
-                                same_sqls[sql] = data
-                            except Exception as e:
-                                messages.append(
-                                    {
-                                        "role": "user",
-                                        "content": (
-                                            f"查询SQL:\n{sql}\n查询发生异常：{str(e)}\n"
-                                            + (
-                                                ""
-                                                if len(need_tell_cols) == 0
-                                                else "\n补充字段说明如下:\n"
-                                                + json.dumps(need_tell_cols, ensure_ascii=False)
-                                            )
-                                            + "\n请修正"
-                                        ),
-                                    }
-                                )
-                                same_sqls[sql] = f"查询发生异常：{str(e)}"
-            else:
-                messages.append(
+                state.messages.append(
                     {
-                        "role": "assistant",
-                        "content": answer,
+                        "role": "user",
+                        "content": emphasize,
                     }
                 )
-                is_finish = True
-                break
-        if not is_finish:
-            if debug_mode:
-                print(f"Workflow【{self.name}】迭代次数超限({self.max_iterate_num})，中断并退出")
-            logger.debug("Workflow【%s】迭代次数超限(%d)，中断并退出", self.name, self.max_iterate_num)
+                self._observe(state, sql=sql)
+                return None
+            return sql
+        state.messages.append(
+            {
+                "role": "assistant",
+                "content": answer,
+            }
+        )
+        state.is_finish = True
+        return None
+
+    @staticmethod
+    def _single_sql(answer: str) -> Optional[str]:
+        """回答里恰好只有一条exec_sql语句时返回它，否则返回None"""
+        statements = [
+            stmt
+            for block in parse_fenced_blocks(answer)
+            if block.kind == "exec_sql"
+            for stmt in split_sql_statements(block.content)
+        ]
+        return statements[0] + ";" if len(statements) == 1 else None
 
-        answer, tkcnt_1 = self.agent_summary.chat(
-            messages[-2:] + [{"role": "user", "content": f'''充分尊重前面给出的结论，回答问题:"{first_user_msg}"'''}]
+    def _execute(self, sql: str) -> SqlResult:
+        """执行agent给出的SQL，设置了sql_rewriter时先按规则修正"""
+        if self.sql_rewriter is not None:
+            return self.sql_rewriter.run(sql, lambda rewritten: self.execute_sql_query(sql=rewritten))
+        return as_sql_result(self.execute_sql_query(sql=sql))
+
+    async def _aexecute(self, sql: str) -> SqlResult:
+        """_execute的异步版本，没有提供execute_sql_query_async时在线程池里执行同步版本"""
+        if self.execute_sql_query_async is None:
+            return await asyncio.to_thread(self._execute, sql)
+        if self.sql_rewriter is not None:
+            return await self.sql_rewriter.arun(sql, self.execute_sql_query_async)
+        return as_sql_result(await self.execute_sql_query_async(sql))
+
+    @staticmethod
+    def _is_local(state: "_SqlQueryState", sql: str) -> bool:
+        """SQL是否由结果工作区在本地执行"""
+        return state.workspace is not None and state.workspace.is_local(sql)
+
+    def _sql_fallback(self, state: "_SqlQueryState") -> Optional[Callable[[str], SqlResult]]:
+        """
+        本地执行失败时改为查询数据库的函数，查询会计入SQL次数预算；
+        预算已经用尽时返回None，不再回退到数据库。
+        """
+        if state.budget is not None and state.budget.exhausted(need_sql=True) is not None:
+            return None
+
+        def execute(sql: str) -> SqlResult:
+            if state.budget is not None:
+                state.budget.add_sql_call()
+            return self._execute(sql)
+
+        return execute
+
+    def _use_candidates(self, state: "_SqlQueryState") -> bool:
+        return self.sql_candidates > 1 and (state.last_failed or not self.sql_candidates_on_failure)
+
+    def _execute_candidates(self, state: "_SqlQueryState", sql: str) -> tuple:
+        """
+        再生成sql_candidates-1个候选SQL，和sql一起并发执行，按结果集摘要投票。
+        返回 (胜出的SQL, 查询结果, 异常)，查询结果和异常有且只有一个不是None。
+        """
+        logger = get_logger()
+        # 候选回答的agent_master.chat自己会在"samples"线程池里并行采样并等待，候选用单独的线程池，避免嵌套等待占满同一个线程池
+        executor = get_executor("candidates", max_workers=16)
+        # 候选回答基于agent_master给出sql之前的消息
+        messages = state.messages[:-1]
+        answer_futures = [
+            executor.submit(self.agent_master.chat, messages=list(messages), budget=state.budget)
+            for _ in range(self.sql_candidates - 1)
+        ]
+        candidates = {sql_fingerprint(sql): (sql, state.messages[-1]["content"])}
+        for future in answer_futures:
+            try:
+                answer, tkcnt = future.result()
+            except Exception as e:
+                logger.debug("\n生成候选SQL发生异常：%s\n", str(e))
+                continue
+            state.usage_tokens += tkcnt
+            candidate = self._single_sql(answer)
+            # 在本地执行的候选不参与投票，它们不需要查询数据库
+            if candidate is not None and candidate not in state.same_sqls and not self._is_local(state, candidate):
+                candidates.setdefault(sql_fingerprint(candidate), (candidate, answer))
+        runnable = []
+        for candidate, answer in candidates.values():
+            if state.budget is not None:
+                if state.budget.exhausted(need_sql=True) is not None:
+                    break
+                state.budget.add_sql_call()
+            runnable.append((candidate, answer))
+        if len(runnable) == 0:
+            runnable = [(sql, state.messages[-1]["content"])]
+            if state.budget is not None:
+                state.budget.add_sql_call()
+        futures = [executor.submit(self._execute, candidate) for candidate, _ in runnable]
+        vote = Vote()
+        first_error = None
+        for (candidate, answer), future in zip(runnable, futures):
+            try:
+                data = as_sql_result(future.result())
+            except Exception as e:
+                first_error = first_error or (candidate, e)
+                continue
+            vote.add(data.digest(), (candidate, answer, data))
+        winner = vote.winner()
+        if winner is None:
+            return first_error[0], None, first_error[1]
+        key, (candidate, answer, data), confidence = winner
+        logger.info(
+            "\n>>>>> 候选SQL投票: %d个候选, %d个执行成功, 胜出结果%d票, 置信度%.2f\n%s\n",
+            len(runnable),
+            len(vote),
+            vote.counts[key],
+            confidence,
+            candidate,
         )
-        usage_tokens += tkcnt_1
+        # 用胜出候选的回答替换agent_master原来的回答，保持消息和执行的SQL一致
+        state.messages[-1] = {"role": "assistant", "content": answer}
+        return candidate, data, None
 
-        self.usage_tokens += usage_tokens
+    def _tell_specific_columns(self, state: "_SqlQueryState", sql: str) -> list:
+        """找出SQL用到、但还没告诉过agent的特殊字段说明，并注入到系统提示词"""
+        need_tell_cols = []
+        for t_name, cols in self.specific_column_desc.items():
+            if t_name in sql:
+                for col_name in cols:
+                    if (
+                        col_name in sql
+                        and f"{t_name}.{col_name}" not in state.told_specific_columns
+                        and not any(col_name in db_struct for db_struct in state.db_structs)
+                    ):
+                        need_tell_cols.append({col_name: cols[col_name]})
+                        state.told_specific_columns.add(f"{t_name}.{col_name}")
+        if len(need_tell_cols) > 0:
+            state.local_db_structs.append(json.dumps(need_tell_cols, ensure_ascii=False))
+            self.agent_master.add_system_prompt_kv(
+                {"KNOWN DATABASE STRUCTURE": "\n\n---\n\n".join(state.local_db_structs)}
+            )
+            self.agent_understand_query_result.add_system_prompt_kv(
+                {"KNOWN DATABASE STRUCTURE": "\n\n---\n\n".join(state.local_db_structs)}
+            )
+        return need_tell_cols
+
+    def _on_sql_result(self, state: "_SqlQueryState", sql: str, data: SqlResult, need_tell_cols: list):
+        """把查询结果反馈给agent_master，非空结果先交给agent_understand_query_result理解"""
+        cols_desc = (
+            ""
+            if len(need_tell_cols) == 0
+            else "\n补充字段说明如下:\n" + json.dumps(need_tell_cols, ensure_ascii=False)
+        )
+        # 执行层附加的说明，比如SQL被规则自动修正
+        cols_desc += "".join(f"\n提示: {note}" for note in data.notes)
+        name = state.workspace.add(data) if state.workspace is not None and len(data) > 0 else None
+        saved = "" if name is None else f"\n上面的查询结果已保存为@{name}，可以在后续SQL里引用"
+        if name is not None and (data.truncated or (data.total is None and len(data) == self.default_sql_limit)):
+            saved += f"（@{name}只包含上面返回的{len(data)}行）"
+        facts = None
+        if len(data) == 0:  # 空结果
+            content = (
+                f"查询SQL:\n{sql}\n查询结果:\n{data}\n"
+                + cols_desc
+                + "\n请检查筛选条件是否存在问题，比如时间日期字段没有用DATE()或YEAR()格式化？当然，如果没问题，那么就根据结果考虑下一步"
+            )
+        elif data.truncated:
+            content = (
+                f"查询SQL:\n{sql}\n查询结果:\n{data}\n"
+                + cols_desc
+                + saved
+                + f"\n请注意，查询结果共有{data.total}行，这里只返回了前{len(data)}行。"
+                + f"如果要的是数量，直接使用总行数{data.total}；如果需要其余的行，"
+                + f"可以加上更严格的筛选条件、用聚合函数汇总，或者在SQL末尾加上`LIMIT {len(data)} OFFSET {len(data)}`分页查询"
+            )
+        elif self.default_sql_limit is not None and len(data) == self.default_sql_limit and data.total is None:
+            content = (
+                f"查询SQL:\n{sql}\n查询结果:\n{data}\n"
+                + cols_desc
+                + saved
+                + f"\n请注意，这里返回的不一定是全部结果，因为默认限制了只返回{self.default_sql_limit}个，你可以根据现在看到的情况，采取子查询的方式去进行下一步"
+            )
+        else:
+            facts, tkcnt_1 = self.agent_understand_query_result.answer(
+                f"查询SQL:\n{sql}\n查询结果:\n{data}\n" + cols_desc + "\n请理解查询结果", budget=state.budget
+            )
+            if self.is_cache_history_facts:
+                self.fact_store.add(facts)
+            state.usage_tokens += tkcnt_1
+            content = (
+                f"查询SQL:\n{sql}\n查询结果:\n{data}\n"
+                + cols_desc
+                + saved
+                + (f"\n{facts}\n" if facts != "" else "\n")
+                + "\n请检查筛选条件是否存在问题，比如时间日期字段没有用DATE()或YEAR()格式化？当然，如果没问题，那么就根据结果考虑下一步；"
+                + f'那么当前掌握的信息是否能够回答"{state.first_user_msg}"？还是要继续执行下一阶段SQL查询？'
+            )
+        state.messages.append({"role": "user", "content": content})
+        state.same_sqls[sql] = data
+        state.last_failed = len(data) == 0
+        self._observe(state, sql=sql, result=data, facts=facts)
+
+    def _on_sql_error(self, state: "_SqlQueryState", sql: str, exc: Exception, need_tell_cols: list):
+        """把查询异常反馈给agent_master"""
+        state.messages.append(
+            {
+                "role": "user",
+                "content": (
+                    f"查询SQL:\n{sql}\n查询发生异常：{str(exc)}\n"
+                    + (
+                        ""
+                        if len(need_tell_cols) == 0
+                        else "\n补充字段说明如下:\n" + json.dumps(need_tell_cols, ensure_ascii=False)
+                    )
+                    + "\n请修正"
+                ),
+            }
+        )
+        state.same_sqls[sql] = f"查询发生异常：{str(exc)}"
+        state.last_failed = True
+        self._observe(state, sql=sql, error=str(exc))
+
+    def _observe(self, state: "_SqlQueryState", **kwargs):
+        if state.monitor is not None:
+            state.monitor.observe(**kwargs)
+
+    def _stalled(self, state: "_SqlQueryState") -> bool:
+        """连续多轮没有进展时停止迭代直接总结"""
+        if state.monitor is None or not state.monitor.stalled():
+            return False
+        state.stop_reason = STOP_STALLED
+        if os.getenv("DEBUG", "0") == "1":
+            print(f"Workflow【{self.name}】连续{state.monitor.stall_turns}轮没有进展，停止查询并总结")
+        get_logger().debug(
+            "Workflow【%s】连续%d轮没有进展(%s)，停止查询并总结",
+            self.name,
+            state.monitor.stall_turns,
+            ",".join(state.monitor.history),
+        )
+        return True
+
+    def _budget_exhausted(self, state: "_SqlQueryState", need_sql: bool = False) -> bool:
+        """检查问题预算，用尽时记录原因，调用方应停止迭代直接总结"""
+        if state.budget is None:
+            return False
+        reason = state.budget.exhausted(need_sql=need_sql)
+        if reason is None:
+            return False
+        state.stop_reason = f"{STOP_BUDGET}:{reason}"
+        if os.getenv("DEBUG", "0") == "1":
+            print(f"Workflow【{self.name}】预算已用尽({reason})，停止查询并总结")
+        get_logger().debug("Workflow【%s】预算已用尽(%s)，停止查询并总结", self.name, reason)
+        return True
+
+    def _summary_messages(self, state: "_SqlQueryState") -> list[dict]:
+        if state.is_finish:
+            state.stop_reason = STOP_ANSWERED
+        elif state.stop_reason is None:
+            state.stop_reason = STOP_MAX_ITERATIONS
+            debug_mode = os.getenv("DEBUG", "0") == "1"
+            if debug_mode:
+                print(f"Workflow【{self.name}】迭代次数超限({self.max_iterate_num})，中断并退出")
+            get_logger().debug("Workflow【%s】迭代次数超限(%d)，中断并退出", self.name, self.max_iterate_num)
+        return state.messages[-2:] + [
+            {"role": "user", "content": f'''充分尊重前面给出的结论，回答问题:"{state.first_user_msg}"'''}
+        ]
+
+    def _finish(self, state: "_SqlQueryState", answer: str, tkcnt: int) -> dict:
+        if state.workspace is not None:
+            if len(state.workspace) > 0:
+                get_logger().debug(
+                    "\n>>>>> 结果工作区: %d个结果, 本地执行%d次\n", len(state.workspace), state.workspace.local_queries
+                )
+            state.workspace.close()
+        state.usage_tokens += tkcnt
+        self.usage_tokens += state.usage_tokens
         return {
             "content": answer,
-            "usage_tokens": usage_tokens,
+            "usage_tokens": state.usage_tokens,
+            "stop_reason": state.stop_reason,
+            "iterate_num": state.iterate_num,
         }
 
+    def run(self, inputs: dict) -> dict:
+        """
+        inputs:
+            - messages: list[dict] # 消息列表，每个元素是一个dict，包含role和content
+            - budget: Budget # 可选，问题的资源预算，用尽时停止查询直接总结
+        return:
+            - content: str # 回答
+            - usage_tokens: int
+            - stop_reason: str # 停止迭代的原因: answered, max_iterations, stalled, budget:<原因>
+            - iterate_num: int # 迭代次数
+        """
+        state = self._prepare(inputs)
+        while state.iterate_num < self.max_iterate_num:
+            if self._budget_exhausted(state) or self._stalled(state):
+                break
+            state.iterate_num += 1
+            self._fit_messages(state)
+            answer, tkcnt_1 = self.agent_master.chat(messages=state.messages, budget=state.budget)
+            state.usage_tokens += tkcnt_1
+            sql = self._parse_answer(state, answer)
+            if state.is_finish:
+                break
+            if sql is None:
+                continue
+            if self._is_local(state, sql):
+                try:
+                    data = state.workspace.execute(sql, fallback=self._sql_fallback(state))
+                    self._on_sql_result(state, sql, data, [])
+                except Exception as e:
+                    self._on_sql_error(state, sql, e, [])
+                continue
+            if self._budget_exhausted(state, need_sql=True):
+                break
+            if self._use_candidates(state):
+                sql, data, error = self._execute_candidates(state, sql)
+                need_tell_cols = self._tell_specific_columns(state, sql)
+                if error is None:
+                    self._on_sql_result(state, sql, data, need_tell_cols)
+                else:
+                    self._on_sql_error(state, sql, error, need_tell_cols)
+                continue
+            if state.budget is not None:
+                state.budget.add_sql_call()
+            need_tell_cols = self._tell_specific_columns(state, sql)
+            try:
+                data = self._execute(sql)
+                self._on_sql_result(state, sql, data, need_tell_cols)
+            except Exception as e:
+                self._on_sql_error(state, sql, e, need_tell_cols)
+        answer, tkcnt_1 = self.agent_summary.chat(self._summary_messages(state), budget=state.budget)
+        return self._finish(state, answer, tkcnt_1)
+
+    async def arun(self, inputs: dict) -> dict:
+        """
+        run的异步版本，输入输出与run相同。
+        SQL通过execute_sql_query_async执行（未提供时在线程池里执行同步版本），LLM调用在线程池里执行，
+        所以同一个事件循环里可以并发运行多个问题的SqlQuery。
+        注意agent带有对话状态，并发的每个问题需要使用各自的SqlQuery实例。
+        """
+        state = self._prepare(inputs)
+        while state.iterate_num < self.max_iterate_num:
+            if self._budget_exhausted(state) or self._stalled(state):
+                break
+            state.iterate_num += 1
+            self._fit_messages(state)
+            answer, tkcnt_1 = await asyncio.to_thread(
+                self.agent_master.chat, messages=state.messages, budget=state.budget
+            )
+            state.usage_tokens += tkcnt_1
+            sql = self._parse_answer(state, answer)
+            if state.is_finish:
+                break
+            if sql is None:
+                continue
+            if self._is_local(state, sql):
+                try:
+                    data = await asyncio.to_thread(state.workspace.execute, sql, self._sql_fallback(state))
+                    await asyncio.to_thread(self._on_sql_result, state, sql, data, [])
+                except Exception as e:
+                    self._on_sql_error(state, sql, e, [])
+                continue
+            if self._budget_exhausted(state, need_sql=True):
+                break
+            if self._use_candidates(state):
+                sql, data, error = await asyncio.to_thread(self._execute_candidates, state, sql)
+                need_tell_cols = self._tell_specific_columns(state, sql)
+                if error is None:
+                    await asyncio.to_thread(self._on_sql_result, state, sql, data, need_tell_cols)
+                else:
+                    self._on_sql_error(state, sql, error, need_tell_cols)
+                continue
+            if state.budget is not None:
+                state.budget.add_sql_call()
+            need_tell_cols = self._tell_specific_columns(state, sql)
+            try:
+                data = await self._aexecute(sql)
+                await asyncio.to_thread(self._on_sql_result, state, sql, data, need_tell_cols)
+            except Exception as e:
+                self._on_sql_error(state, sql, e, need_tell_cols)
+        answer, tkcnt_1 = await asyncio.to_thread(
+            self.agent_summary.chat, self._summary_messages(state), budget=state.budget
+        )
+        return self._finish(state, answer, tkcnt_1)
+
 
 class CheckDbStructure(Workflow):
     """
@@ -429,7 +793,14 @@ class CheckDbStructure(Workflow):
         table_select_post_process: Optional[Callable[[list], list]] = None,
         import_column_names: Optional[set] = None,
         foreign_key_hub: Optional[dict] = None,
+        selection_cache: Optional[SchemaSelectionCache] = None,
+        schema_catalog: Optional[SchemaCatalog] = None,
+        selection_key: Optional[Callable[[str, dict], tuple[str, str]]] = None,
     ):
+        """
+        selection_key: 选表缓存的key，参数是问题和agent_table_selector的system_prompt_kv，返回(问题, 上下文)。
+            None时使用原问题和selection_context()，上下文有任何不同都不会命中缓存。
+        """
         self.name = "Check_db_structure" if name is None else name
         self.dbs_info = dbs_info
         self.db_table = db_table
@@ -439,6 +810,11 @@ class CheckDbStructure(Workflow):
         self.db_select_post_process = db_select_post_process
         self.table_select_post_process = table_select_post_process
         self.foreign_key_hub = foreign_key_hub if foreign_key_hub is not None else {}
+        self.selection_cache = selection_cache
+        self.selection_key = selection_key
+        self.schema_catalog = (
+            schema_catalog if schema_catalog is not None else SchemaCatalog.shared(db_table, table_column)
+        )
 
         self.agent_db_selector = Agent(
             AgentConfig(
@@ -540,73 +916,42 @@ class CheckDbStructure(Workflow):
         Returns:
         str: A formatted string containing the table information for each database.
         """
-        table_list = []
-        for db_name in dbs:
-            if db_name not in self.db_table:
-                raise KeyError(f"发生异常: 数据库名`{db_name}`不存在")
-            for table in self.db_table[db_name]["表"]:
-                table_list.append({"表名": f"{db_name}.{table['表英文']}", "说明": table["cols_summary"]})
-        result = "数据库表信息如下:\n" + json.dumps(table_list, ensure_ascii=False) + "\n"
-        return result
+        return self.schema_catalog.render_table_list(dbs)
 
     def get_column_list(self, tables: list[str]) -> str:
         """
         tables: list of table names, format is database_name.table_name
         """
-
-        column_lists = []
-        for table in tables:
-            if "." not in table or table.count(".") != 1:
-                raise ValueError(f"发生异常: 表名`{table}`格式不正确，应该为database_name.table_name")
-            db_name, table_name = table.split(".")
-            if db_name not in self.db_table:
-                raise KeyError(f"发生异常: 数据库名`{db_name}`不存在")
-            if any(t["表英文"] == table_name for t in self.db_table[db_name]["表"]):
-                column_lists.append(
-                    {
-                        "表名": table,
-                        "表字段": self.table_column[table_name],
-                    }
-                )
-        result = f"已取得可用的{COLUMN_LIST_MARK}:\n" + json.dumps(column_lists, ensure_ascii=False) + "\n"
-        return result
+        return self.schema_catalog.render_column_list(tables)
 
     def filter_column_list(self, tables: list[str], column_filter: dict) -> str:
         """
         tables: list of table names, format is database_name.table_name
         column_filter: dict{"table_name":["col1", "col2"]}
         """
-        column_lists = []
-        for table in tables:
-            if "." not in table or table.count(".") != 1:
-                raise ValueError(f"发生异常: 表名`{table}`格式不正确，应该为database_name.table_name")
-            if table not in column_filter:
-                continue
-            db_name, table_name = table.split(".")
-            if db_name not in self.db_table:
-                raise KeyError(f"发生异常: 数据库名`{db_name}`不存在")
-            if any(t["表英文"] == table_name for t in self.db_table[db_name]["表"]):
-                column_list = {
-                    "表名": table,
-                    "表字段": [],
-                }
-                for col in self.table_column[table_name]:
-                    if col["column"] in column_filter[table] or col["column"] in self.import_column_names:
-                        column_list["表字段"].append(col)
-                column_lists.append(column_list)
-        for table, cols in self.foreign_key_hub.items():
-            if table not in tables:
-                column_list = {
-                    "表名": table,
-                    "表字段": [],
-                }
-                db_name, table_name = table.split(".")
-                for col in self.table_column[table_name]:
-                    if col["column"] in cols or col["column"] in self.import_column_names:
-                        column_list["表字段"].append(col)
-                column_lists.append(column_list)
-        result = f"已取得可用的{COLUMN_LIST_MARK}:\n" + json.dumps(column_lists, ensure_ascii=False) + "\n"
-        return result
+        return self.schema_catalog.render_filtered_column_list(
+            tables=tables,
+            column_filter=column_filter,
+            import_column_names=self.import_column_names,
+            foreign_key_hub=self.foreign_key_hub,
+        )
+
+    def selection_context(self, messages: list[dict]) -> str:
+        """
+        选表结果依赖的全部上下文：注入到各个agent的system_prompt_kv和问题之前的消息。
+        没有设置selection_key时作为选表缓存的上下文。
+        """
+        parts = [
+            f"{key}\n{value}" for agent in self.agent_lists for key, value in sorted(agent.system_prompt_kv.items())
+        ]
+        parts.extend(msg["content"] for msg in messages[:-1])
+        return "\n---\n".join(parts)
+
+    def _selection_cache_key(self, messages: list[dict]) -> tuple[str, str]:
+        question = messages[-1]["content"] if len(messages) > 0 else ""
+        if self.selection_key is not None:
+            return self.selection_key(question, self.agent_table_selector.system_prompt_kv)
+        return question, self.selection_context(messages)
 
     def clear_history(self):
         self.usage_tokens = 0
@@ -626,15 +971,25 @@ class CheckDbStructure(Workflow):
         for agent in self.agent_lists:
             agent.clear_system_prompt_kv()
 
+    def _budget_exhausted(self, budget: Optional[Budget]) -> bool:
+        """预算用尽时不再重试"""
+        reason = budget.exhausted() if budget is not None else None
+        if reason is not None:
+            get_logger().debug("\nWorkflow【%s】预算已用尽(%s)，不再重试\n", self.name, reason)
+        return reason is not None
+
     def run(self, inputs: dict) -> dict:
         """
         inputs:
             - messages: list[dict] # 消息列表，每个元素是一个dict，包含role和content
+            - budget: Budget # 可选，问题的资源预算，用尽时不再重试
         """
 
         debug_mode = True
         logger = get_logger()
         usage_tokens = 0
+        budget = inputs.get("budget")
+        table_list, tables, column_list = None, None, ""
 
         if "messages" not in inputs:
             raise KeyError("发生异常: inputs缺少'messages'字段")
@@ -644,10 +999,26 @@ class CheckDbStructure(Workflow):
             if COLUMN_LIST_MARK not in msg["content"]:
                 messages.append(msg)
 
-        for _ in range(3):
+        if self.selection_cache is not None:
+            cache_question, cache_context = self._selection_cache_key(messages)
+            selection = self.selection_cache.get(cache_question, context=cache_context)
+            logger.debug("\nWorkflow【%s】选表缓存统计: %s\n", self.name, self.selection_cache.stats())
+            if selection is not None:
+                if debug_mode:
+                    print(f"\nWorkflow【{self.name}】命中选表缓存: {selection.tables}\n")
+                logger.debug("\nWorkflow【%s】命中选表缓存: %s\n", self.name, selection.tables)
+                return {
+                    "content": self.filter_column_list(tables=selection.tables, column_filter=selection.column_filter),
+                    "usage_tokens": 0,
+                }
+
+        for attempt in range(3):
+            if attempt > 0 and self._budget_exhausted(budget):
+                break
             try:
                 answer, tk_cnt = self.agent_db_selector.chat(
-                    messages=messages + [{"role": "user", "content": "请选择db，务必遵循输出的格式要求。"}]
+                    messages=messages + [{"role": "user", "content": "请选择db，务必遵循输出的格式要求。"}],
+                    budget=budget,
                 )
                 usage_tokens += tk_cnt
                 args_json = extract_last_json(answer)
@@ -663,11 +1034,16 @@ class CheckDbStructure(Workflow):
                 logger.debug("\nagent_db_selector 遇到问题: %s, 现在重试...\n", str(e))
 
         # 选择数据表
-        for _ in range(3):
+        for attempt in range(3):
+            if table_list is None:
+                break
+            if attempt > 0 and self._budget_exhausted(budget):
+                break
             try:
                 answer, tk_cnt = self.agent_table_selector.chat(
                     messages=messages
-                    + [{"role": "user", "content": f"{table_list}\n请选择table，务必遵循输出的格式要求。"}]
+                    + [{"role": "user", "content": f"{table_list}\n请选择table，务必遵循输出的格式要求。"}],
+                    budget=budget,
                 )
                 usage_tokens += tk_cnt
                 args_json = extract_last_json(answer)
@@ -683,17 +1059,28 @@ class CheckDbStructure(Workflow):
                 logger.debug("\nagent_table_selector 遇到问题: %s, 现在重试...\n", str(e))
 
         # 筛选字段
-        for _ in range(3):
+        for attempt in range(3):
+            if tables is None:
+                break
+            if attempt > 0 and self._budget_exhausted(budget):
+                break
             try:
                 answer, tk_cnt = self.agent_column_selector.chat(
                     messages=messages
-                    + [{"role": "user", "content": f"{column_list}\n请选择column，务必遵循输出的格式要求。"}]
+                    + [{"role": "user", "content": f"{column_list}\n请选择column，务必遵循输出的格式要求。"}],
+                    budget=budget,
                 )
                 usage_tokens += tk_cnt
                 args_json = extract_last_json(answer)
                 if args_json is not None:
                     column_filter = json.loads(args_json)
                     column_list = self.filter_column_list(tables=tables, column_filter=column_filter)
+                    if self.selection_cache is not None:
+                        self.selection_cache.put(
+                            cache_question,
+                            SchemaSelection(tables=list(tables), column_filter=column_filter),
+                            context=cache_context,
+                        )
                     break
             except Exception as e:
                 if debug_mode:
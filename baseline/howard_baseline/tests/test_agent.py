@@ -0,0 +1,56 @@
+import threading
+import time
+
+from src.agent import Agent, AgentConfig
+from src.llm import LLM
+from src.retry import RetryPolicy
+
+
+class SlowLastLLM(LLM):
+    """前两次调用立即返回同一个回答，之后的调用等待一会儿再返回或抛出连接错误"""
+
+    def __init__(self, fail_slow: bool = False):
+        self.fail_slow = fail_slow
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_response(self, system, messages, **kwargs):  # pylint: disable=arguments-differ
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if call <= 2:
+            return "答案是42", 1, True
+        time.sleep(0.2)
+        if self.fail_slow:
+            raise ConnectionError("connection reset")
+        return "答案是41", 5, True
+
+
+def sampling_agent(llm: LLM) -> Agent:
+    return Agent(
+        AgentConfig(
+            llm=llm,
+            name="sampler",
+            role="test",
+            enable_history=False,
+            samples=3,
+            vote_agree=2,
+            retry_policy=RetryPolicy(base_delay=5.0),
+        )
+    )
+
+
+def test_sample_counts_tokens_of_running_samples():
+    llm = SlowLastLLM()
+    answer, usage_tokens = sampling_agent(llm).chat([{"role": "user", "content": "?"}])
+    assert answer == "答案是42"
+    assert usage_tokens == 7
+
+
+def test_sample_stops_retrying_after_vote():
+    llm = SlowLastLLM(fail_slow=True)
+    start = time.monotonic()
+    answer, usage_tokens = sampling_agent(llm).chat([{"role": "user", "content": "?"}])
+    assert answer == "答案是42" and usage_tokens == 2
+    assert llm.calls == 3
+    assert time.monotonic() - start < 2
@@ -0,0 +1,27 @@
+from src.asset_cache import load_or_build
+
+
+def test_load_or_build_rebuilds_on_source_or_version_change(tmp_path):
+    source = tmp_path / "schema.json"
+    source.write_text("v1", encoding="utf-8")
+    cache_path = str(tmp_path / "cache" / "schema.pkl")
+    builds = []
+
+    def build():
+        builds.append(source.read_text(encoding="utf-8"))
+        return {"content": builds[-1]}
+
+    assert load_or_build(cache_path, [str(source)], build) == {"content": "v1"}
+    assert load_or_build(cache_path, [str(source)], build) == {"content": "v1"}
+    assert builds == ["v1"]
+    source.write_text("v2", encoding="utf-8")
+    assert load_or_build(cache_path, [str(source)], build) == {"content": "v2"}
+    assert load_or_build(cache_path, [str(source)], build, version=2) == {"content": "v2"}
+    assert builds == ["v1", "v2", "v2"]
+
+
+def test_load_or_build_ignores_corrupt_cache(tmp_path):
+    cache_path = tmp_path / "schema.pkl"
+    cache_path.write_bytes(b"not a pickle")
+    assert load_or_build(str(cache_path), [str(tmp_path / "missing.json")], lambda: 1) == 1
+    assert load_or_build(str(cache_path), [str(tmp_path / "missing.json")], lambda: 2) == 1
@@ -0,0 +1,22 @@
+from src.budget import Budget
+
+
+def test_unlimited_budget():
+    budget = Budget()
+    budget.add_tokens(10**9)
+    budget.add_sql_call()
+    assert budget.exhausted(need_sql=True) is None
+    assert budget.remaining_seconds() is None
+
+
+def test_exhausted_reasons():
+    assert Budget(max_seconds=0).exhausted() == "time"
+    budget = Budget(max_tokens=100, max_sql_calls=1)
+    budget.add_tokens(99)
+    assert budget.exhausted() is None
+    budget.add_sql_call()
+    assert budget.exhausted() is None
+    assert budget.exhausted(need_sql=True) == "sql_calls"
+    budget.add_tokens(1)
+    assert budget.exhausted() == "tokens"
+    assert budget.summary()["tokens"] == 100 and budget.summary()["sql_calls"] == 1
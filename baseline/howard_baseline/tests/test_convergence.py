@@ -0,0 +1,49 @@
+from src.convergence import ConvergenceMonitor, error_signature, sql_fingerprint
+from src.sql_result import SqlResult
+
+
+EMPTY = SqlResult([], [])
+
+
+def test_sql_fingerprint_keeps_literals():
+    assert sql_fingerprint("SELECT  `A` FROM t WHERE n = 'X';") == "select a from t where n = 'X'"
+    assert sql_fingerprint("select a from t where n = 'x'") != sql_fingerprint("select a from t where n = 'X'")
+
+
+def test_error_signature_keeps_names():
+    assert error_signature("1054 (42S22): Unknown column 'A'") == error_signature("1054 (42S22):  Unknown column 'A'")
+    assert error_signature("Unknown column 'A'") != error_signature("Unknown column 'B'")
+
+
+def test_empty_results_from_new_sqls_are_progress():
+    monitor = ConvergenceMonitor(stall_turns=3)
+    for value in ("a", "b", "c"):
+        assert monitor.observe(sql=f"SELECT * FROM t WHERE n = '{value}'", result=EMPTY)
+    assert not monitor.stalled()
+
+
+def test_different_errors_are_progress():
+    monitor = ConvergenceMonitor(stall_turns=2)
+    assert monitor.observe(sql="SELECT a FROM t", error="Unknown column 'a' in 'field list'")
+    assert monitor.observe(sql="SELECT b FROM t", error="Unknown column 'b' in 'field list'")
+    assert not monitor.stalled()
+
+
+def test_stalls_on_repeats():
+    monitor = ConvergenceMonitor(stall_turns=3)
+    rows = SqlResult(["n"], [(1,)])
+    assert monitor.observe(sql="SELECT n FROM t", result=rows)
+    assert not monitor.observe(sql="SELECT n FROM t", result=rows)
+    assert not monitor.observe(sql="SELECT n AS n FROM t", result=rows)
+    assert not monitor.observe()
+    assert monitor.stalled()
+    assert monitor.history == ["new_result", "repeated_sql", "repeated_result", "no_sql"]
+
+
+def test_repeated_error_and_facts():
+    monitor = ConvergenceMonitor(stall_turns=2)
+    assert monitor.observe(sql="SELECT x FROM t", error="Unknown column 'x'")
+    assert not monitor.observe(sql="SELECT x, y FROM t", error="Unknown column 'x'")
+    assert monitor.observe(sql="SELECT 1", result=SqlResult(["a"], [(1,)]), facts="平安银行2021年营业收入是100亿")
+    assert not monitor.observe(sql="SELECT 2", result=SqlResult(["a"], [(2,)]), facts="平安银行2021年营业收入是100亿")
+    assert monitor.stall_count == 1
@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+from src.dag import StageGraph, get_executor
+
+
+def test_runs_stages_in_dependency_order():
+    results = (
+        StageGraph()
+        .add("c", lambda r: r["a"] + r["b"], deps=("a", "b"))
+        .add("a", lambda r: r["x"] * 2)
+        .add("b", lambda r: 1)
+        .run({"x": 5})
+    )
+    assert results == {"x": 5, "a": 10, "b": 1, "c": 11}
+
+
+def test_independent_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=2)
+    graph = StageGraph().add("a", lambda r: barrier.wait()).add("b", lambda r: barrier.wait())
+    assert set(graph.run()) == {"a", "b"}
+
+
+def test_rejects_cycles_missing_deps_and_duplicates():
+    with pytest.raises(ValueError, match="循环依赖"):
+        StageGraph().add("a", lambda r: 1, deps=("b",)).add("b", lambda r: 2, deps=("a",)).run()
+    with pytest.raises(ValueError, match="不存在"):
+        StageGraph().add("a", lambda r: 1, deps=("missing",)).run()
+    with pytest.raises(ValueError, match="重复"):
+        StageGraph().add("a", lambda r: 1).add("a", lambda r: 2)
+
+
+def test_error_stops_dependent_stages():
+    started = []
+
+    def fail(_results):
+        raise KeyError("boom")
+
+    graph = StageGraph().add("a", fail).add("b", lambda r: started.append("b"), deps=("a",))
+    with pytest.raises(KeyError):
+        graph.run()
+    assert started == []
+
+
+def test_shared_executors_by_name():
+    assert get_executor("stage") is get_executor("stage")
+    assert get_executor("stage") is not get_executor("samples")
@@ -0,0 +1,59 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+
+
+pytest.importorskip("mysql.connector")
+
+from src import database  # noqa: E402
+
+
+class FakePool:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+@pytest.fixture
+def fake_aiomysql(monkeypatch):
+    created = []
+
+    async def create_pool(**kwargs):
+        await asyncio.sleep(0)
+        created.append(FakePool())
+        return created[-1]
+
+    monkeypatch.setattr(database, "aiomysql", SimpleNamespace(create_pool=create_pool, Error=Exception))
+    return created
+
+
+def test_pool_name_is_valid_and_unique():
+    long_db = "d" * 80
+    name_a = database._pool_name("user", "db-host.example.com", 3306, long_db + "a")
+    name_b = database._pool_name("user", "db-host.example.com", 3306, long_db + "b")
+    assert re.fullmatch(r"[a-zA-Z0-9._:\-*$#]{1,64}", name_a)
+    assert name_a != name_b
+    assert database._pool_name("us er", "h", 1, "库").startswith("us_er_h:1_")
+
+
+def test_async_pool_per_event_loop(fake_aiomysql):
+    connector = database.AsyncMySQLConnector(host="h", user="u", password="p", database="d")
+
+    async def use_pool():
+        pools = await asyncio.gather(connector._get_pool(), connector._get_pool())
+        assert pools[0] is pools[1]
+        await connector.close()
+        return pools[0]
+
+    first = asyncio.run(use_pool())
+    second = asyncio.run(use_pool())
+    assert first is not second
+    assert first.closed and second.closed
+    assert len(fake_aiomysql) == 2
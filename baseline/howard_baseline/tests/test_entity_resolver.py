@@ -0,0 +1,44 @@
+from src.entity_resolver import MATCH_EXACT, MATCH_PINYIN, MATCH_SUBSTRING, EntityResolver
+
+
+ROWS = [
+    {
+        "SecuCode": "600000",
+        "ChiName": "上海浦东发展银行股份有限公司",
+        "SecuAbbr": "浦发银行",
+        "ChiSpelling": "PFYH",
+        "TableName": "a",
+    },
+    {
+        "SecuCode": "000001",
+        "ChiName": "平安银行股份有限公司",
+        "SecuAbbr": "平安银行",
+        "ChiSpelling": "PAYH",
+        "TableName": "a",
+    },
+    {
+        "SecuCode": "00005",
+        "ChiName": "汇丰控股有限公司",
+        "FormerName": "汇丰银行",
+        "ChiSpelling": "HFKG",
+        "TableName": "hk",
+    },
+]
+
+
+def test_resolve_by_code_name_and_pinyin():
+    resolver = EntityResolver(ROWS)
+    assert [row["SecuCode"] for row in resolver.resolve("600000")] == ["600000"]
+    assert [row["SecuCode"] for row in resolver.resolve("平安银行")] == ["000001"]
+    assert [row["SecuCode"] for row in resolver.resolve("pfyh")] == ["600000"]
+    assert resolver.match("pfyh")[0][1] == MATCH_PINYIN
+
+
+def test_resolve_keeps_only_best_match_type():
+    resolver = EntityResolver(ROWS, result_fields=("SecuCode",))
+    assert resolver.resolve("汇丰银行") == [{"SecuCode": "00005"}]
+    assert {match_type for _, match_type, _ in resolver.match("汇丰银行")} == {MATCH_EXACT}
+    substring = resolver.resolve("银行股份")
+    assert {row["SecuCode"] for row in substring} == {"600000", "000001"}
+    assert {match_type for _, match_type, _ in resolver.match("银行股份")} == {MATCH_SUBSTRING}
+    assert resolver.resolve("不存在的公司") == []
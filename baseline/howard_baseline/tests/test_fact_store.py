@@ -0,0 +1,30 @@
+from src.fact_store import FactStore, extract_ids
+
+
+def test_extract_ids():
+    assert extract_ids("InnerCode是1120, 代码000001, 金额12.5, 年份21") == {"1120", "000001"}
+
+
+def test_add_dedupes_and_refreshes_order():
+    store = FactStore()
+    assert store.add("平安银行2021年营业收入为1693.83亿元")
+    assert store.add("万科A的董事长是郁亮")
+    assert not store.add("  平安银行2021年营业收入为1693.83亿元 ")
+    assert not store.add("平安银行2021年营业收入为1693.83亿元。")
+    assert not store.add("")
+    assert len(store) == 2
+    assert store.facts[0].seq > store.facts[1].seq
+
+
+def test_select_relevant_facts_within_budget():
+    store = FactStore(max_tokens=None, top_k=2)
+    store.load(["平安银行2021年营业收入为1693.83亿元", "万科A的董事长是郁亮", "InnerCode为1120的公司在深圳"])
+    assert store.select("平安银行2021年营业收入是多少") == ["平安银行2021年营业收入为1693.83亿元"]
+    assert store.select("这家公司注册在哪里", hints="InnerCode是1120") == ["InnerCode为1120的公司在深圳"]
+    assert store.select("今天天气怎么样") == []
+
+
+def test_select_respects_token_budget():
+    store = FactStore(max_tokens=10, top_k=None, min_score=0.0)
+    store.load(["营业收入" * 20, "营业收入为100"])
+    assert store.select("营业收入") == ["营业收入为100"]
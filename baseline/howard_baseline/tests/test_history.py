@@ -0,0 +1,22 @@
+from src.history import extractive_summary, messages_tokens, split_for_compression
+
+
+def message(content: str) -> dict:
+    return {"role": "user", "content": content}
+
+
+def test_split_for_compression():
+    messages = [message("a" * 40) for _ in range(5)]
+    assert messages_tokens(messages) == 50
+    assert split_for_compression(messages, keep_tokens=100) == 0
+    assert split_for_compression(messages, keep_tokens=25) == 3
+    assert split_for_compression(messages, keep_tokens=0, min_keep=2) == 3
+
+
+def test_extractive_summary_keeps_fact_sentences():
+    messages = [
+        message("我来查询一下。查询结果表明营收为100亿。\n```sql\nSELECT 1;\n```"),
+        message("好的。营收为100亿。结论是增长了5%。"),
+    ]
+    assert extractive_summary(messages, max_tokens=100) == "查询结果表明营收为100亿。\n营收为100亿。\n结论是增长了5%。"
+    assert extractive_summary(messages, max_tokens=10) == "结论是增长了5%。"
@@ -0,0 +1,55 @@
+import sqlite3
+
+import pytest
+from src.local_mirror import LocalMirror, register_mysql_functions, translate_mysql_sql
+
+
+def run(sql: str) -> list:
+    conn = sqlite3.connect(":memory:")
+    register_mysql_functions(conn)
+    return conn.execute(translate_mysql_sql(sql)).fetchall()
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("SELECT 7/2", 3.5),
+        ("SELECT (1200-1000)/1000*100", 20.0),
+        ("SELECT ROUND(2/3, 4)", 0.6667),
+        ("SELECT 1/0", None),
+        ("SELECT 10 DIV 3", 3),
+        ("SELECT -7 DIV 2", -3),
+        ("SELECT 7.5 DIV 2", 3),
+        ("SELECT 2*3 DIV 4 + 1", 2),
+        ("SELECT ABS(-9) DIV (1+1)", 4),
+        ("SELECT QUARTER('2020-05-01')", 2),
+    ],
+)
+def test_translate_division(sql, expected):
+    assert run(sql) == [(expected,)]
+
+
+def test_translate_keeps_literals():
+    assert run("SELECT 'a/b div c', 6/4") == [("a/b div c", 1.5)]
+
+
+def test_translate_date_functions():
+    assert run("SELECT YEAR('2021-03-04') = '2021', IF(1 > 2, 'a', 'b')") == [(1, "b")]
+    assert run("SELECT DATE(DATE_ADD('2021-01-15', INTERVAL 1 QUARTER))") == [("2021-04-15",)]
+
+
+def test_translate_rejects_show():
+    with pytest.raises(SyntaxError):
+        translate_mysql_sql("SHOW TABLES")
+
+
+def test_mirror_caps_rows(tmp_path):
+    path = str(tmp_path / "mirror.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE db__t (v NUMERIC)")
+    conn.executemany("INSERT INTO db__t VALUES (?)", [(i,) for i in range(10)])
+    conn.commit()
+    conn.close()
+    mirror = LocalMirror(path, max_rows=3)
+    assert len(mirror.query("SELECT v FROM db.t")) == 3
+    assert mirror.query("SELECT SUM(v) / COUNT(*) FROM db.t").rows == [(4.5,)]
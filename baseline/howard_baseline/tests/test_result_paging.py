@@ -0,0 +1,62 @@
+import pytest
+from src.result_paging import ResultPager, count_sql, iter_pages, outer_limit, page_sql
+from src.sql_result import SqlResult
+
+
+def test_outer_limit():
+    assert outer_limit("SELECT * FROM t LIMIT 10;") == 10
+    assert outer_limit("SELECT * FROM t LIMIT 5, 20") == 20
+    assert outer_limit("SELECT * FROM t LIMIT 7 OFFSET 3") == 7
+    assert outer_limit("SELECT * FROM (SELECT * FROM t LIMIT 3) x") is None
+    assert outer_limit("SELECT 'LIMIT 3' FROM t") is None
+
+
+def test_count_and_page_sql():
+    assert count_sql("SELECT a FROM t;") == "SELECT COUNT(*) AS total FROM (\nSELECT a FROM t\n) AS _count_probe;"
+    assert page_sql("SELECT a FROM t ORDER BY a;", 10, 20) == "SELECT a FROM t ORDER BY a LIMIT 10 OFFSET 20;"
+
+
+def fake_table(total: int, limit: int):
+    executed = []
+
+    def execute(sql: str) -> SqlResult:
+        executed.append(sql)
+        if sql.startswith("SELECT COUNT(*)"):
+            return SqlResult(["total"], [(total,)])
+        rows = [(i,) for i in range(total)]
+        if " OFFSET " in sql:
+            size, offset = [int(x) for x in sql.rstrip(";").split("LIMIT ")[1].split(" OFFSET ")]
+            rows = rows[offset : offset + size]
+        return SqlResult(["v"], rows[:limit])
+
+    return execute, executed
+
+
+def test_pager_probes_only_possibly_truncated_results():
+    execute, executed = fake_table(total=250, limit=100)
+    pager = ResultPager(limit=100)
+    result = pager.run("SELECT v FROM t", execute)
+    assert len(result) == 100 and result.total == 250 and result.truncated
+    assert len(pager.run("SELECT v FROM t LIMIT 100", execute)) == 100
+    assert pager.stats() == {"probes": 1, "truncated": 1, "probe_errors": 0}
+    assert len(executed) == 3
+
+
+def test_pager_keeps_result_when_probe_fails():
+    def execute(sql: str) -> SqlResult:
+        if sql.startswith("SELECT COUNT(*)"):
+            raise RuntimeError("Duplicate column name")
+        return SqlResult(["v"], [(1,), (2,)])
+
+    pager = ResultPager(limit=2)
+    assert pager.run("SELECT a.v, b.v FROM a JOIN b", execute).total is None
+    assert pager.stats()["probe_errors"] == 1
+
+
+def test_iter_pages():
+    execute, _ = fake_table(total=25, limit=10)
+    pages = list(iter_pages(execute, "SELECT v FROM t ORDER BY v", page_size=10))
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [len(page) for page in iter_pages(execute, "SELECT v FROM t ORDER BY v", 10, max_rows=15)] == [10, 5]
+    with pytest.raises(ValueError):
+        list(iter_pages(execute, "SELECT v FROM t LIMIT 5", page_size=10))
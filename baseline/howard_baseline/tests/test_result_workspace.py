@@ -0,0 +1,57 @@
+import pytest
+from src.result_workspace import ResultWorkspace
+from src.sql_result import SqlResult
+
+
+@pytest.fixture
+def workspace():
+    workspace = ResultWorkspace(max_rows=2)
+    yield workspace
+    workspace.close()
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("SELECT 7/2", 3.5),
+        ("SELECT (1200-1000)/1000*100", 20.0),
+        ("SELECT ROUND(2/3, 4)", 0.6667),
+        ("SELECT 10 DIV 3", 3),
+    ],
+)
+def test_arithmetic_uses_mysql_division(workspace, sql, expected):
+    assert workspace.query(sql).rows == [(expected,)]
+
+
+def test_query_over_results(workspace):
+    assert workspace.add(SqlResult(["v"], [(1,), (2,)])) == "result_1"
+    assert workspace.add(SqlResult(["v", "v"], [(3, 4)])) == "result_2"
+    assert workspace.tables["result_2"].columns == ["v", "v"]
+    assert workspace.query("SELECT SUM(v) / COUNT(*) AS avg_v FROM @result_1").rows == [(1.5,)]
+    assert workspace.query("SELECT v_2 FROM @result_2").rows == [(4,)]
+
+
+def test_max_rows_records_total(workspace):
+    workspace.add(SqlResult(["v"], [(1,), (2,), (3,)]))
+    data = workspace.query("SELECT v FROM @result_1 ORDER BY v")
+    assert data.rows == [(1,), (2,)]
+    assert data.total == 3 and data.truncated
+
+
+def test_is_local(workspace):
+    assert workspace.is_local("SELECT 1+1")
+    assert workspace.is_local("SELECT * FROM @result_1")
+    assert not workspace.is_local("SELECT * FROM db.t")
+    assert not workspace.is_local("SELECT '@result_1' FROM db.t")
+
+
+def test_missing_reference(workspace):
+    with pytest.raises(ValueError):
+        workspace.query("SELECT * FROM @result_9")
+
+
+def test_execute_falls_back_only_without_references(workspace):
+    fallback = SqlResult(["x"], [(1,)])
+    assert workspace.execute("SELECT NO_SUCH_FN(1)", fallback=lambda sql: fallback) is fallback
+    with pytest.raises(ValueError):
+        workspace.execute("SELECT * FROM @result_9", fallback=lambda sql: fallback)
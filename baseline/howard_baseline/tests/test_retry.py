@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import pytest
+from src.retry import (
+    FAILURE_RATE_LIMIT,
+    FAILURE_SEMANTIC,
+    FAILURE_TRANSPORT,
+    RetryPolicy,
+    RetryStats,
+    classify_exception,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, message: str, status_code=None, response_status=None):
+        super().__init__(message)
+        if status_code is not None:
+            self.status_code = status_code
+        if response_status is not None:
+            self.response = SimpleNamespace(status_code=response_status)
+
+
+@pytest.mark.parametrize(
+    "exc, expected",
+    [
+        (StatusError("x", status_code=429), FAILURE_RATE_LIMIT),
+        (StatusError("x", response_status=503), FAILURE_TRANSPORT),
+        (StatusError("x", status_code=400), FAILURE_SEMANTIC),
+        (RuntimeError("当前API请求过于频繁"), FAILURE_RATE_LIMIT),
+        (ConnectionError("reset"), FAILURE_TRANSPORT),
+        (TimeoutError(), FAILURE_TRANSPORT),
+        (RuntimeError("Remote end closed connection without response"), FAILURE_TRANSPORT),
+        (ValueError("工具参数不是合法的JSON"), FAILURE_SEMANTIC),
+    ],
+)
+def test_classify_exception(exc, expected):
+    assert classify_exception(exc) == expected
+
+
+def test_delay_by_failure():
+    policy = RetryPolicy(base_delay=1.0, rate_limit_base_delay=5.0, max_delay=8.0)
+    assert policy.delay(FAILURE_SEMANTIC, 3) == 0.0
+    assert 0 <= policy.delay(FAILURE_TRANSPORT, 1) <= 2.0
+    assert 0 <= policy.delay(FAILURE_RATE_LIMIT, 5) <= 8.0
+
+
+def test_correction_messages():
+    messages = RetryPolicy().correction_messages("", "没有sql代码块")
+    assert messages[0] == {"role": "assistant", "content": "（无输出）"}
+    assert "没有sql代码块" in messages[1]["content"]
+
+
+def test_retry_stats():
+    stats = RetryStats()
+    stats.record("a", FAILURE_TRANSPORT)
+    stats.record("a", FAILURE_TRANSPORT)
+    stats.record("b", FAILURE_SEMANTIC)
+    assert stats.snapshot() == {
+        "by_failure": {FAILURE_TRANSPORT: 2, FAILURE_SEMANTIC: 1},
+        "by_agent": {"a": {FAILURE_TRANSPORT: 2}, "b": {FAILURE_SEMANTIC: 1}},
+    }
@@ -0,0 +1,82 @@
+from src.llm import LLM
+from src.schema_cache import SchemaSelection, SchemaSelectionCache
+from src.workflow import CheckDbStructure
+from utils import schema_selection_key
+
+
+FACTS_A = "平安银行的关联信息有:[MatchedName是平安银行;所在数据表是constantdb.secumain;InnerCode是3;SecuCode是000001;ChiNameAbbr是平安银行;]"
+FACTS_B = "万科的关联信息有:[MatchedName是万科;所在数据表是constantdb.secumain;InnerCode是6;SecuCode是000002;ChiNameAbbr是万科A;]"
+FACTS_HK = "腾讯的关联信息有:[MatchedName是腾讯;所在数据表是constantdb.hk_secumain;InnerCode是7;SecuCode是00700;ChiNameAbbr是腾讯控股;]"
+
+
+class ScriptedLLM(LLM):
+    """总是返回同一个回答的LLM，记录调用次数"""
+
+    def __init__(self, answer: str):
+        self.answer = answer
+        self.calls = 0
+
+    def generate_response(self, system, messages, **kwargs):  # pylint: disable=arguments-differ
+        self.calls += 1
+        return self.answer, 1, True
+
+
+def test_exact_and_similar_hits():
+    cache = SchemaSelectionCache(threshold=0.8)
+    selection = SchemaSelection(tables=["db.t"], column_filter={})
+    cache.put("<实体>#年的营业收入是多少", selection, context="constantdb.secumain")
+    assert cache.get("<实体>#年的营业收入是多少？", context="constantdb.secumain") is selection
+    assert cache.get("<实体>#年的营业收入是多少", context="constantdb.hk_secumain") is None
+    assert cache.get("<实体>#年的营业收入是多少") is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 2, "hit_rate": 0.3333}
+
+
+def test_evicts_least_recently_used():
+    cache = SchemaSelectionCache(max_size=2)
+    for question in ("甲公司的董事长是谁", "乙基金的经理是谁", "丙股票的收盘价"):
+        cache.put(question, SchemaSelection(tables=[question], column_filter={}))
+    assert len(cache) == 2
+    assert cache.get("甲公司的董事长是谁") is None
+
+
+def test_selection_key_masks_entities_and_numbers():
+    question_a, context_a = schema_selection_key("平安银行2021年的营业收入是多少", {"已知事实": FACTS_A})
+    question_b, context_b = schema_selection_key("万科A2020年的营业收入是多少", {"已知事实": FACTS_B})
+    assert question_a == question_b == "<实体>#年的营业收入是多少"
+    assert context_a == context_b == "constantdb.secumain"
+    assert schema_selection_key("腾讯控股的营业收入", {"已知事实": FACTS_HK}) == (
+        "<实体>的营业收入",
+        "constantdb.hk_secumain",
+    )
+    assert schema_selection_key("2021年的营业收入", {}) == ("#年的营业收入", "")
+
+
+def test_check_db_structure_reuses_selection_across_companies():
+    db_table = {"db": {"表": [{"表英文": "t", "cols_summary": "营业收入"}]}}
+    table_column = {"t": [{"column": "Revenue", "desc": "营业收入"}]}
+    llms = [ScriptedLLM('```json\n["db"]\n```'), ScriptedLLM('```json\n["db.t"]\n```')]
+    llms.append(ScriptedLLM('```json\n{"db.t": ["Revenue"]}\n```'))
+    workflow = CheckDbStructure(
+        dbs_info="",
+        db_table=db_table,
+        table_column=table_column,
+        db_selector_llm=llms[0],
+        table_selector_llm=llms[1],
+        column_selector_llm=llms[2],
+        selection_cache=SchemaSelectionCache(),
+        selection_key=schema_selection_key,
+    )
+
+    def ask(question: str, facts: str, history: str) -> str:
+        workflow.add_system_prompt_kv({"已知事实": facts, "历史对话": history})
+        workflow.clear_history()
+        return workflow.run({"messages": [{"role": "user", "content": question}]})["content"]
+
+    first = ask("平安银行2021年的营业收入是多少", FACTS_A, "")
+    assert [llm.calls for llm in llms] == [1, 1, 1]
+    second = ask("万科A2020年的营业收入是多少", FACTS_B, "Question: 平安银行2021年的营业收入是多少")
+    assert second == first and "Revenue" in second
+    assert [llm.calls for llm in llms] == [1, 1, 1]
+    ask("腾讯控股2021年的营业收入是多少", FACTS_HK, "")
+    assert [llm.calls for llm in llms] == [2, 2, 2]
+    assert workflow.selection_cache.stats()["hits"] == 1
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+from src.schema_catalog import SchemaCatalog
+from src.utils import COLUMN_LIST_MARK
+
+
+DB_TABLE = {
+    "db": {"表": [{"表英文": "t1", "cols_summary": "公司信息"}, {"表英文": "t2", "cols_summary": "行情"}]},
+    "empty": {"表": []},
+}
+TABLE_COLUMN = {
+    "t1": [{"column": "InnerCode", "desc": "内部编码"}, {"column": "ChiName", "desc": "中文名称"}],
+    "t2": [{"column": "InnerCode", "desc": "内部编码"}, {"column": "ClosePrice", "desc": "收盘价"}],
+}
+
+
+def test_render_matches_json_dumps():
+    catalog = SchemaCatalog(DB_TABLE, TABLE_COLUMN)
+    tables = [{"表名": "db.t1", "说明": "公司信息"}, {"表名": "db.t2", "说明": "行情"}]
+    assert (
+        catalog.render_table_list(["db", "empty"])
+        == "数据库表信息如下:\n" + json.dumps(tables, ensure_ascii=False) + "\n"
+    )
+    columns = [{"表名": "db.t2", "表字段": TABLE_COLUMN["t2"]}]
+    assert catalog.render_column_list(["db.t2"]) == (
+        f"已取得可用的{COLUMN_LIST_MARK}:\n" + json.dumps(columns, ensure_ascii=False) + "\n"
+    )
+
+
+def test_render_filtered_column_list():
+    catalog = SchemaCatalog(DB_TABLE, TABLE_COLUMN)
+    text = catalog.render_filtered_column_list(
+        ["db.t2"], {"db.t2": ["ClosePrice"]}, foreign_key_hub={"db.t1": ["ChiName"]}
+    )
+    expected = [
+        {"表名": "db.t2", "表字段": [TABLE_COLUMN["t2"][1]]},
+        {"表名": "db.t1", "表字段": [TABLE_COLUMN["t1"][1]]},
+    ]
+    assert text == f"已取得可用的{COLUMN_LIST_MARK}:\n" + json.dumps(expected, ensure_ascii=False) + "\n"
+
+
+def test_errors_and_shared_instance():
+    catalog = SchemaCatalog(DB_TABLE, TABLE_COLUMN)
+    with pytest.raises(KeyError):
+        catalog.render_table_list(["missing"])
+    with pytest.raises(ValueError):
+        catalog.render_column_list(["t1"])
+    assert catalog.has_table("db.t1") and not catalog.has_table("db.t3")
+    db_table, table_column = dict(DB_TABLE), dict(TABLE_COLUMN)
+    registered = SchemaCatalog.register(SchemaCatalog(db_table, table_column))
+    assert SchemaCatalog.shared(db_table, table_column) is registered
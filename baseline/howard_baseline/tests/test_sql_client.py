@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+
+httpx = pytest.importorskip("httpx")
+requests = pytest.importorskip("requests")
+
+from src.sql_client import HttpSqlClient  # noqa: E402
+
+
+class FlakyAsyncClient:
+    """前几次请求抛出指定的异常，之后返回成功的查询结果"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def post(self, url, json):  # pylint: disable=redefined-outer-name
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return httpx.Response(200, json={"success": True, "data": [{"a": 1}]})
+
+
+@pytest.mark.parametrize(
+    "error",
+    [httpx.ConnectError("refused"), httpx.ReadError("reset by peer"), httpx.RemoteProtocolError("disconnected")],
+)
+def test_async_retries_connection_errors(monkeypatch, error):
+    client = HttpSqlClient(url="http://sql", backoff_factor=0)
+    flaky = FlakyAsyncClient([error])
+    monkeypatch.setattr(client, "_get_async_client", lambda: (flaky, asyncio.Semaphore(1)))
+    assert asyncio.run(client.aexecute_sql_query("SELECT 1")).rows == [(1,)]
+    assert flaky.calls == 2 and client.retry_count == 1
+
+
+def test_async_gives_up_after_max_retries(monkeypatch):
+    client = HttpSqlClient(url="http://sql", backoff_factor=0, max_retries=1)
+    flaky = FlakyAsyncClient([httpx.ReadError("reset"), httpx.ReadError("reset")])
+    monkeypatch.setattr(client, "_get_async_client", lambda: (flaky, asyncio.Semaphore(1)))
+    with pytest.raises(RuntimeError):
+        asyncio.run(client.aexecute_sql_query("SELECT 1"))
+
+
+def test_sync_retries_connection_errors(monkeypatch):
+    client = HttpSqlClient(url="http://sql", backoff_factor=0)
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'{"success": true, "data": [{"a": 1}]}'
+    outcomes = [requests.exceptions.ConnectionError("reset"), response]
+
+    def post(*args, **kwargs):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(client.session, "post", post)
+    assert client.execute_sql_query("SELECT 1").rows == [(1,)]
+    assert client.retry_count == 1
+
+
+def test_async_client_per_event_loop():
+    client = HttpSqlClient(url="http://sql")
+
+    async def get_client():
+        async_client, _ = client._get_async_client()
+        await client.aclose()
+        return async_client
+
+    first = asyncio.run(get_client())
+    assert asyncio.run(get_client()) is not first
+    assert first.is_closed
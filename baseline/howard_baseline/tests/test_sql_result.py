@@ -0,0 +1,39 @@
+import datetime
+import json
+
+from src.sql_result import SqlResult, as_sql_result
+
+
+def test_from_records_and_json():
+    records = [{"a": 1, "b": "甲"}, {"a": 2, "b": None}]
+    result = SqlResult.from_records(records)
+    assert result.columns == ["a", "b"] and result.rows == [(1, "甲"), (2, None)]
+    assert str(result) == json.dumps(records, ensure_ascii=False)
+    assert result[1] == records[1] and result.to_dicts() == records
+    assert SqlResult.from_records([{"a": 1}, {"b": 2}]).rows == [(1,), (None,)]
+
+
+def test_from_json_keeps_text():
+    text = '[{"a":1}]'
+    result = as_sql_result(text)
+    assert len(result) == 1 and str(result) == text
+    assert as_sql_result(result) is result
+
+
+def test_from_cursor_formats_dates():
+    description = [("d",), ("n",)]
+    result = SqlResult.from_cursor(description, [(datetime.date(2021, 1, 4), 1), (None, 2)])
+    assert result.rows == [("2021-01-04", 1), (None, 2)]
+
+
+def test_drop_notes_and_total_do_not_modify_original():
+    result = SqlResult(["a", "b"], [(1, 2)])
+    assert result.drop("b").rows == [(1,)] and result.columns == ["a", "b"]
+    noted = result.with_notes("提示").with_total(5)
+    assert noted.notes == ("提示",) and noted.total == 5 and noted.truncated
+    assert result.notes == () and result.total is None and not result.truncated
+
+
+def test_digest_ignores_row_order_and_column_names():
+    assert SqlResult(["a"], [(1,), (2,)]).digest() == SqlResult(["b"], [(2,), (1,)]).digest()
+    assert SqlResult(["a"], [(1,)]).digest() != SqlResult(["a"], [("1",)]).digest()
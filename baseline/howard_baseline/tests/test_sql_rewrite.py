@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from src.llm import LLM
+from src.sql_result import SqlResult
+from src.sql_rewrite import SqlRewriter, SqlRuleError
+from src.workflow import SqlQuery
+
+
+class SilentLLM(LLM):
+    def generate_response(self, system, messages, **kwargs):  # pylint: disable=arguments-differ
+        return "", 0, True
+
+
+def rewrite(sql: str) -> str:
+    return SqlRewriter().prepare(sql)[0]
+
+
+def test_rank_alias_is_quoted():
+    assert rewrite("SELECT a, RANK() OVER (ORDER BY a) AS Rank FROM t ORDER BY Rank") == (
+        "SELECT a, RANK() OVER (ORDER BY a) AS `Rank` FROM t ORDER BY `Rank`"
+    )
+
+
+def test_quoted_concept_code_is_unquoted():
+    assert rewrite("SELECT * FROM t WHERE ConceptCode = '123' OR ConceptCode IN ('4', 'x')") == (
+        "SELECT * FROM t WHERE ConceptCode = 123 OR ConceptCode IN (4, 'x')"
+    )
+
+
+def test_date_equality_is_formatted_and_ranges_are_kept():
+    assert rewrite("SELECT * FROM t WHERE t.EndDate = '2021-12-31' AND TradingDay = '2021'") == (
+        "SELECT * FROM t WHERE DATE(t.EndDate) = '2021-12-31' AND YEAR(TradingDay) = '2021'"
+    )
+    sql = "SELECT * FROM t WHERE EndDate > '2020' AND DATE(TradingDay) = '2021-01-04'"
+    assert rewrite(sql) == sql
+
+
+def test_code_mismatch_is_rejected():
+    with pytest.raises(SqlRuleError):
+        rewrite("SELECT * FROM a JOIN b ON a.CompanyCode = b.InnerCode")
+    sql = "SELECT * FROM a JOIN b ON a.InnerCode = b.InnerCode AND a.SecuInnerCode = b.CompanyCode"
+    assert rewrite(sql) == sql
+
+
+def test_literals_are_not_rewritten():
+    sql = "SELECT 'AS Rank', 'EndDate = ''2021''' FROM t"
+    assert rewrite(sql) == sql
+
+
+def test_duplicate_rows_get_a_note():
+    rewriter = SqlRewriter()
+    result = rewriter.run("SELECT a FROM t", lambda sql: SqlResult(["a"], [(1,), (1,)]))
+    assert len(result.notes) == 1 and "DISTINCT" in result.notes[0]
+    assert rewriter.stats()["fired"] == {"distinct_hint.noted": 1}
+
+
+def test_rewriter_only_applies_in_sql_query():
+    executed = []
+
+    def execute_sql_query(sql: str) -> SqlResult:
+        executed.append(sql)
+        return SqlResult(["a"], [(1,)])
+
+    async def aexecute_sql_query(sql: str) -> SqlResult:
+        return execute_sql_query(sql)
+
+    sql = "SELECT * FROM t WHERE EndDate = '2021-12-31'"
+    plain = SqlQuery(execute_sql_query=execute_sql_query, llm=SilentLLM())
+    plain._execute(sql)
+    workflow = SqlQuery(
+        execute_sql_query=execute_sql_query,
+        execute_sql_query_async=aexecute_sql_query,
+        llm=SilentLLM(),
+        sql_rewriter=SqlRewriter(),
+    )
+    result = workflow._execute(sql)
+    asyncio.run(workflow._aexecute(sql))
+    assert executed[0] == sql
+    assert executed[1] == executed[2] == "SELECT * FROM t WHERE DATE(EndDate) = '2021-12-31'"
+    assert result.notes
@@ -0,0 +1,28 @@
+from src.utils import (
+    count_total_sql,
+    extract_last_json,
+    extract_last_sql,
+    parse_fenced_blocks,
+    split_sql_statements,
+)
+
+
+def test_parse_fenced_blocks():
+    text = '思考\n```exec_sql\nSELECT 1;\n```\n说明\n```json\n{"a": 1}\n```'
+    assert parse_fenced_blocks(text) == [("exec_sql", "SELECT 1;"), ("json", '{"a": 1}')]
+    assert extract_last_json(text) == '{"a": 1}'
+    assert extract_last_json("没有代码块") is None
+
+
+def test_split_sql_statements_respects_literals_and_comments():
+    sql = "SELECT ';' AS a -- 注释;\nFROM t; /* ; */ SELECT `x;y` FROM \"t;2\";;"
+    assert split_sql_statements(sql) == ["SELECT ';' AS a \nFROM t", 'SELECT `x;y` FROM "t;2"']
+    assert split_sql_statements("SELECT 'it''s -- no comment'") == ["SELECT 'it''s -- no comment'"]
+    assert split_sql_statements("SELECT 10/2 - 1") == ["SELECT 10/2 - 1"]
+
+
+def test_extract_last_sql_and_count():
+    text = "```exec_sql\nSELECT 1;\nSELECT 2; -- 结束\n```\n```sql\nSELECT 3;\n```"
+    assert extract_last_sql(text, "exec_sql") == "SELECT 2;"
+    assert extract_last_sql(text, "mysql") is None
+    assert count_total_sql(text, "exec_sql") == 2
@@ -0,0 +1,50 @@
+from src.sql_result import SqlResult
+from src.value_index import ValueIndex
+
+
+def test_match_prefers_longer_terms():
+    index = ValueIndex(
+        {
+            "db.t.industry": {"values": ["银行", "商业银行"], "complete": True, "distinct_count": 2},
+            "db.t.flag": {"values": ["是"], "complete": True, "distinct_count": 1},
+        }
+    )
+    assert index.match("有哪些商业银行？") == [("商业银行", "db.t.industry", "商业银行")]
+    assert index.match("没有匹配") == []
+
+
+def test_format_hints_with_extras():
+    index = ValueIndex(
+        {
+            "db.c.MS": {
+                "values": ["深交所"],
+                "complete": True,
+                "distinct_count": 1,
+                "extras": {"深交所": {"LB": 201, "DM": 90}},
+            }
+        }
+    )
+    assert index.format_hints("深交所上市") == "- 深交所 → db.c.MS = '深交所' (LB=201, DM=90)"
+
+
+def test_build_pages_values_and_save_load(tmp_path):
+    values = [f"值{i:03d}" for i in range(25)]
+    executed = []
+
+    def execute(sql: str) -> SqlResult:
+        executed.append(sql)
+        if "COUNT(DISTINCT" in sql:
+            return SqlResult(["cnt"], [(len(values),)])
+        limit, offset = [int(x) for x in sql.rstrip(";").split("LIMIT ")[1].split(" OFFSET ")]
+        return SqlResult(["v"], [(v,) for v in values[offset : offset + limit]])
+
+    index = ValueIndex.build(execute, [{"column": "db.t.v"}], page_size=10)
+    assert index.columns["db.t.v"]["values"] == values and index.columns["db.t.v"]["complete"]
+    assert len(executed) == 4
+
+    sampled = ValueIndex.build(execute, [{"column": "db.t.v", "max_distinct": 5}], sample_size=3, page_size=10)
+    assert sampled.columns["db.t.v"]["values"] == values[:3] and not sampled.columns["db.t.v"]["complete"]
+
+    path = tmp_path / "value_index.json"
+    index.save(str(path))
+    assert ValueIndex.load(str(path)).match("值007") == [("值007", "db.t.v", "值007")]
@@ -0,0 +1,28 @@
+from src.voting import Vote, answer_fingerprint
+
+
+def test_answer_fingerprint():
+    assert answer_fingerprint('```json\n{"b": 1, "a": 2}\n```') == answer_fingerprint(
+        '说明\n```json\n{"a":2,"b":1}\n```'
+    )
+    assert answer_fingerprint("```exec_sql\nSELECT  a FROM t;\n```") == answer_fingerprint(
+        "先查询\n```exec_sql\nselect a from t\n```"
+    )
+    assert answer_fingerprint("答案是 42。") == answer_fingerprint("答案是42")
+    assert answer_fingerprint("答案是42") != answer_fingerprint("答案是41")
+
+
+def test_vote_agree_and_winner():
+    vote = Vote(agree=2)
+    assert not vote.add("a", 1)
+    assert not vote.add("b", 2)
+    assert vote.add("b", 3)
+    assert vote.winner() == ("b", 2, 2 / 3)
+
+
+def test_vote_tie_goes_to_first_key():
+    vote = Vote()
+    vote.add("x", "first")
+    vote.add("y", "second")
+    assert vote.winner() == ("x", "first", 0.5)
+    assert Vote().winner() is None
@@ -4,60 +4,120 @@ This module provides specific functions for Game Finglm
 
 import os
 import re
-import jieba
 import json
-import requests
+import threading
+from functools import partial
+from typing import TYPE_CHECKING, Optional
 from src.log import get_logger
-from src.agent import Agent
-from src.utils import extract_last_sql, extract_last_json
-from src.workflow import COLUMN_LIST_MARK
+from src.sql_result import SqlResult
+from src.utils import COLUMN_LIST_MARK, extract_last_json, extract_last_sql
+from src.value_index import ValueIndex
 import config
 
+# SQL客户端、本地镜像、规则引擎和agent在用到时才导入，导入本模块不会加载requests、httpx等依赖
+if TYPE_CHECKING:
+    from src.agent import Agent
+    from src.local_mirror import LocalMirror
+    from src.result_paging import ResultPager
+    from src.sql_client import HttpSqlClient
+    from src.sql_rewrite import SqlRewriter
 
-def execute_sql_query(sql: str) -> str:
+
+_sql_client: Optional["HttpSqlClient"] = None
+_local_mirror: Optional["LocalMirror"] = None
+_sql_rewriter: Optional["SqlRewriter"] = None
+_result_pager: Optional["ResultPager"] = None
+_sql_client_lock = threading.Lock()
+
+
+def get_sql_client() -> "HttpSqlClient":
+    """
+    获取进程内共享的SQL查询客户端，首次调用时创建（此时.env已经加载）。
     """
-    Executes an SQL query using the specified API endpoint and returns the result as a string.
+    global _sql_client  # pylint: disable=global-statement
+    if _sql_client is None:
+        with _sql_client_lock:
+            if _sql_client is None:
+                from src.sql_client import HttpSqlClient  # pylint: disable=import-outside-toplevel
+
+                _sql_client = HttpSqlClient(
+                    url="https://comm.chatglm.cn/finglm2/api/query",
+                    access_token=os.getenv("ZHIPU_ACCESS_TOKEN", ""),
+                    limit=config.MAX_SQL_RESULT_ROWS,
+                    timeout=config.SQL_TIMEOUT,
+                    max_retries=config.SQL_MAX_RETRIES,
+                    max_concurrency=config.SQL_MAX_CONCURRENCY,
+                )
+    return _sql_client
+
+
+def get_local_mirror() -> "LocalMirror":
+    """获取进程内共享的本地镜像，和查询接口一样最多返回MAX_SQL_RESULT_ROWS行"""
+    global _local_mirror  # pylint: disable=global-statement
+    if _local_mirror is None:
+        with _sql_client_lock:
+            if _local_mirror is None:
+                from src.local_mirror import LocalMirror  # pylint: disable=import-outside-toplevel
+
+                _local_mirror = LocalMirror(config.LOCAL_MIRROR_PATH, max_rows=config.MAX_SQL_RESULT_ROWS)
+    return _local_mirror
+
+
+def get_sql_rewriter() -> "SqlRewriter":
+    """获取进程内共享的SQL规则引擎，SQL Query工作流执行agent给出的SQL前用它修正或拦截常见的错误写法"""
+    global _sql_rewriter  # pylint: disable=global-statement
+    if _sql_rewriter is None:
+        with _sql_client_lock:
+            if _sql_rewriter is None:
+                from src.sql_rewrite import SqlRewriter  # pylint: disable=import-outside-toplevel
+
+                _sql_rewriter = SqlRewriter()
+    return _sql_rewriter
+
+
+def get_result_pager() -> "ResultPager":
+    """获取进程内共享的截断探测器，结果可能被截断时探测真实总行数"""
+    global _result_pager  # pylint: disable=global-statement
+    if _result_pager is None:
+        with _sql_client_lock:
+            if _result_pager is None:
+                from src.result_paging import ResultPager  # pylint: disable=import-outside-toplevel
+
+                _result_pager = ResultPager(limit=config.MAX_SQL_RESULT_ROWS)
+    return _result_pager
+
+
+def execute_sql_query(sql: str) -> SqlResult:
+    """
+    Executes an SQL query using the configured backend and returns the result.
 
     Args:
         sql (str): The SQL query to be executed.
 
     Returns:
-        str: The result of the SQL query execution.
+        SqlResult: The result of the SQL query execution, rendered as JSON by str().
     """
-    debug_mode = os.getenv("DEBUG", "0") == "1"
-    sql = sql.replace("\\n", " ")
-    url = "https://comm.chatglm.cn/finglm2/api/query"
-    access_token = os.getenv("ZHIPU_ACCESS_TOKEN", "")
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {access_token}"}
-    logger = get_logger()
-    logger.info("\n>>>>> 查询sql:\n%s\n", sql)
-    if debug_mode:
-        print(f"\n>>>>> 查询ql:\n{sql}")
-    try:
-        response = requests.post(
-            url, headers=headers, json={"sql": sql, "limit": config.MAX_SQL_RESULT_ROWS}, timeout=30
-        )
-    except requests.exceptions.Timeout as exc:
-        logger.info("请求超时，无法执行SQL查询，请优化SQL")
-        if debug_mode:
-            print("请求超时，无法执行SQL查询，请优化SQL")
-        raise RuntimeError("执行SQL查询超时，请优化SQL后重试。") from exc
-    result = response.json()
-    if "success" in result and result["success"] is True:
-        data = json.dumps(result["data"], ensure_ascii=False)
-        logger.info("查询结果:\n%s\n", data)
-        if debug_mode:
-            print(f"查询结果:\n{data}")
-        return data
-    logger.info("查询失败: %s\n", result["detail"])
-    if debug_mode:
-        print("查询失败:" + result["detail"])
-    if "Commands out of sync" in result["detail"]:
-        raise SyntaxError("不能同时执行多组SQL: " + result["detail"])
-    raise RuntimeError(result["detail"])
-
-
-def keep_db_column_info(agent: Agent, messages: dict) -> None:
+    if config.SQL_BACKEND == "local":
+        execute = get_local_mirror().execute_sql_query
+    else:
+        execute = get_sql_client().execute_sql_query
+    if config.SQL_COUNT_PROBE:
+        execute = partial(get_result_pager().run, execute=execute)
+    return execute(sql)
+
+
+async def aexecute_sql_query(sql: str) -> SqlResult:
+    """execute_sql_query的异步版本"""
+    if config.SQL_BACKEND == "local":
+        aexecute = get_local_mirror().aexecute_sql_query
+    else:
+        aexecute = get_sql_client().aexecute_sql_query
+    if config.SQL_COUNT_PROBE:
+        aexecute = partial(get_result_pager().arun, aexecute=aexecute)
+    return await aexecute(sql)
+
+
+def keep_db_column_info(agent: "Agent", messages: dict) -> None:
     """Stores knowledge from messages into the agent."""
     for msg in messages:
         if COLUMN_LIST_MARK in msg["content"]:
@@ -169,11 +229,15 @@ def ajust_org_question(question: str) -> str:
     return question
 
 
-def query_company(name: str) -> str:
-    # name = name.replace("公司", "")
-    if name == "":
-        return "[]"
-    sql = f"""SELECT 'constantdb.secumain' AS TableName, InnerCode, CompanyCode,
+def company_query_sql(name: str, limit: Optional[int] = None) -> str:
+    """
+    生成在A股、港股、美股证券主表里模糊查找实体的SQL（不含结尾分号）。
+    每行都带上MatchedName字段标明匹配的实体名；limit不为None时，限制每个表返回的行数。
+    """
+    name = name.replace("'", "''")
+    limit_sql = "" if limit is None else f"\nLIMIT {limit}"
+    parts = [
+        f"""SELECT '{name}' AS MatchedName, 'constantdb.secumain' AS TableName, InnerCode, CompanyCode,
     ChiName, EngName, SecuCode, ChiNameAbbr, EngNameAbbr, SecuAbbr, ChiSpelling
 FROM constantdb.secumain 
 WHERE SecuCode = '{name}'
@@ -182,9 +246,8 @@ WHERE SecuCode = '{name}'
    OR EngName LIKE '%{name}%'
    OR EngNameAbbr LIKE '%{name}%'
    OR SecuAbbr LIKE '%{name}%'
-   OR ChiSpelling LIKE '%{name}%'
-UNION ALL
-SELECT 'constantdb.hk_secumain' AS TableName, InnerCode, CompanyCode,
+   OR ChiSpelling LIKE '%{name}%'{limit_sql}""",
+        f"""SELECT '{name}' AS MatchedName, 'constantdb.hk_secumain' AS TableName, InnerCode, CompanyCode,
 ChiName, EngName, SecuCode, ChiNameAbbr, EngNameAbbr, SecuAbbr, ChiSpelling
 FROM constantdb.hk_secumain 
 WHERE SecuCode = '{name}'
@@ -194,20 +257,130 @@ WHERE SecuCode = '{name}'
    OR EngNameAbbr LIKE '%{name}%'
    OR SecuAbbr LIKE '%{name}%'
    OR FormerName LIKE '%{name}%'
-   OR ChiSpelling LIKE '%{name}%'
-UNION ALL
-SELECT 'constantdb.us_secumain' AS TableName, InnerCode, CompanyCode,
+   OR ChiSpelling LIKE '%{name}%'{limit_sql}""",
+        f"""SELECT '{name}' AS MatchedName, 'constantdb.us_secumain' AS TableName, InnerCode, CompanyCode,
 ChiName, EngName, SecuCode, null as ChiNameAbbr, null as EngNameAbbr, SecuAbbr, ChiSpelling
 FROM constantdb.us_secumain 
 WHERE SecuCode = '{name}'
    OR ChiName LIKE '%{name}%'
    OR EngName LIKE '%{name}%'
    OR SecuAbbr LIKE '%{name}%'
-   OR ChiSpelling LIKE '%{name}%';"""
-    return execute_sql_query(sql)
+   OR ChiSpelling LIKE '%{name}%'{limit_sql}""",
+    ]
+    if limit is not None:
+        parts = [f"({part})" for part in parts]
+    return "\nUNION ALL\n".join(parts)
+
+
+def query_company(name: str) -> str:
+    # name = name.replace("公司", "")
+    if name == "":
+        return "[]"
+    return str(execute_sql_query(company_query_sql(name) + ";").drop("MatchedName"))
+
+
+def query_companies(names: list[str]) -> dict[str, list[dict]]:
+    """
+    用一条SQL批量查找多个实体，按MatchedName把结果拆分回各个实体。
+    查询接口对总行数有限制，所以按实体数平分行数，避免某个宽泛的实体占满结果。
+
+    Returns:
+        dict: {实体名: [行]}
+    """
+    names = list(dict.fromkeys(name for name in names if name != ""))
+    results = {name: [] for name in names}
+    if len(names) == 0:
+        return results
+    if len(names) == 1:
+        limit = None
+    else:
+        limit = max(1, config.MAX_SQL_RESULT_ROWS // (3 * len(names)))
+    sql = "\nUNION ALL\n".join(company_query_sql(name, limit=limit) for name in names) + ";"
+    # 生成SQL时名称里的单引号被转义过，结果里的MatchedName是原始名称
+    for row in execute_sql_query(sql):
+        matched_name = row.pop("MatchedName", None)
+        if matched_name in results:
+            results[matched_name].append(row)
+    return results
+
+
+COMPANY_SNAPSHOT_TABLES = {
+    "constantdb.secumain": (
+        "InnerCode, CompanyCode, ChiName, EngName, SecuCode, ChiNameAbbr, EngNameAbbr, SecuAbbr, ChiSpelling"
+    ),
+    "constantdb.hk_secumain": (
+        "InnerCode, CompanyCode, ChiName, EngName, SecuCode, ChiNameAbbr, EngNameAbbr, SecuAbbr, ChiSpelling, FormerName"
+    ),
+    "constantdb.us_secumain": (
+        "InnerCode, CompanyCode, ChiName, EngName, SecuCode, null as ChiNameAbbr, null as EngNameAbbr, SecuAbbr, ChiSpelling"
+    ),
+}
+
+
+def dump_company_snapshot() -> list[dict]:
+    """
+    分页导出A股、港股、美股证券主表的名称、代码等字段，保存为本地快照config.COMPANY_SNAPSHOT_PATH，
+    供EntityResolver在进程内解析实体。
+    """
+    from src.result_paging import iter_pages  # pylint: disable=import-outside-toplevel
+
+    rows = []
+    for table, columns in COMPANY_SNAPSHOT_TABLES.items():
+        for page in iter_pages(
+            execute_sql_query,
+            f"SELECT '{table}' AS TableName, {columns} FROM {table} ORDER BY InnerCode",
+            page_size=config.MAX_SQL_RESULT_ROWS,
+        ):
+            rows.extend(page)
+    os.makedirs(os.path.dirname(config.COMPANY_SNAPSHOT_PATH), exist_ok=True)
+    with open(config.COMPANY_SNAPSHOT_PATH, "w", encoding="utf-8") as file:
+        json.dump(rows, file, ensure_ascii=False)
+    return rows
+
+
+def resolve_companies(names: list[str]) -> dict[str, list[dict]]:
+    """
+    批量解析实体，优先使用本地的EntityResolver，本地没有匹配的实体再合并成一条SQL查询。
+
+    Returns:
+        dict: {实体名: [行]}
+    """
+    results = {}
+    unresolved = []
+    for name in map(str, names):
+        if name == "" or name in results:
+            continue
+        rows = config.entity_resolver.resolve(name) if config.entity_resolver is not None else []
+        results[name] = rows
+        if len(rows) == 0:
+            unresolved.append(name)
+    if len(unresolved) > 0:
+        results.update(query_companies(unresolved))
+    return results
+
+
+def format_company_rows(name: str, rows: list[dict]) -> str:
+    """把实体的关联信息格式化成一段文字，字段名附带config.column_mapping里的中文说明"""
+    info = f"{name}的关联信息有:[" if len(rows) == 1 else f"{name}关联信息有多组:["
+    for idx, row in enumerate(rows):
+        col_chi = {}
+        if "TableName" in row:
+            col_chi = config.column_mapping[row["TableName"]]
+        for k, v in dict(row).items():
+            if k == "TableName":
+                info += f"所在数据表是{v};"
+                continue
+            if k in col_chi:
+                info += f"{k}({col_chi[k]})是{v};"
+            else:
+                info += f"{k}是{v};"
+        info += "]" if idx == len(rows) - 1 else "],"
+    return info
 
 
 def seg_entities(entity: str) -> list[str]:
+    import jieba  # pylint: disable=import-outside-toplevel  # 加载词典较慢，用到时才导入
+
     stopwords = ["公司", "基金", "管理", "有限", "有限公司"]
     seg_list = list(jieba.cut(entity, cut_all=False))
     filtered_seg_list = [word for word in seg_list if word not in stopwords]
@@ -232,24 +405,9 @@ def extract_company_code(llm_answer: str) -> str:
             names = json.loads(names_json)
             if not isinstance(names, list):
                 raise ValueError("names should be a list")
-            for name in names:
-                rows = json.loads(query_company(name))
+            for name, rows in resolve_companies(names).items():
                 if len(rows) > 0:
-                    info = f"{name}的关联信息有:[" if len(rows) == 1 else f"{name}关联信息有多组:["
-                    for idx, row in enumerate(rows):
-                        col_chi = {}
-                        if "TableName" in row:
-                            col_chi = config.column_mapping[row["TableName"]]
-                        for k, v in dict(row).items():
-                            if k == "TableName":
-                                info += f"所在数据表是{v};"
-                                continue
-                            if k in col_chi:
-                                info += f"{k}({col_chi[k]})是{v};"
-                            else:
-                                info += f"{k}是{v};"
-                        info += "]" if idx == len(rows) - 1 else "],"
-                    results.append(info)
+                    results.append(format_company_rows(name, rows))
 
     except Exception as e:
         if debug_mode:
@@ -258,6 +416,30 @@ def extract_company_code(llm_answer: str) -> str:
     return "\n".join(results)
 
 
+_FACT_ENTITY_PATTERN = re.compile(r"^(.+?)(?:的关联信息有|关联信息有多组):\[", re.MULTILINE)
+_FACT_FIELD_PATTERN = re.compile(r"(\w+)(?:\([^()]*\))?是([^;\[\]]+);")
+_ENTITY_NAME_FIELDS = {"MatchedName", "ChiName", "EngName", "SecuCode", "ChiNameAbbr", "EngNameAbbr", "SecuAbbr"}
+
+
+def schema_selection_key(question: str, system_prompt_kv: dict) -> tuple[str, str]:
+    """
+    选表缓存的key，只保留影响选表的信息，同一模板的问题换了公司、年份也能命中。
+    - 问题: 已知事实里的实体名、简称、代码替换成<实体>，数字替换成#
+    - 上下文: 已知事实里实体所在的证券主表（A股、港股、美股的实体要查不同的表）
+    """
+    facts = system_prompt_kv.get("已知事实", "")
+    names = set(_FACT_ENTITY_PATTERN.findall(facts))
+    tables = set()
+    for field, value in _FACT_FIELD_PATTERN.findall(facts):
+        if field == "所在数据表":
+            tables.add(value.strip())
+        elif field in _ENTITY_NAME_FIELDS:
+            names.add(value.strip())
+    for name in sorted((name for name in names if len(name) > 1), key=len, reverse=True):
+        question = question.replace(name, "<实体>")
+    return re.sub(r"\d+(?:\.\d+)?", "#", question), ",".join(sorted(tables))
+
+
 def foreign_key_hub() -> dict:
     return {
         "constantdb.secumain": {"InnerCode", "CompanyCode", "SecuCode", "SecuAbbr", "ChiNameAbbr"},
@@ -266,6 +448,35 @@ def foreign_key_hub() -> dict:
     }
 
 
+def value_index_columns() -> list[dict]:
+    """需要建立取值索引的字段：概念、股东性质、地区、行业等枚举类字段"""
+    return [
+        {"column": "astockindustrydb.lc_conceptlist.ClassName"},
+        {"column": "astockindustrydb.lc_conceptlist.SubclassName"},
+        {"column": "astockindustrydb.lc_conceptlist.ConceptName", "extras": ["ConceptCode"], "max_distinct": 2000},
+        {"column": "astockshareholderdb.lc_mainshlistnew.SHKind"},
+        {"column": "constantdb.lc_areacode.AreaChiName", "extras": ["AreaInnerCode"], "max_distinct": 5000},
+        {"column": "astockindustrydb.lc_exgindustry.FirstIndustryName"},
+        {"column": "astockindustrydb.lc_exgindustry.SecondIndustryName"},
+        {"column": "astockindustrydb.lc_indfinindicators.IndustryName"},
+        {"column": "constantdb.ct_systemconst.LBMC", "extras": ["LB"]},
+        {"column": "constantdb.ct_systemconst.MS", "extras": ["LB", "DM"], "max_distinct": 5000},
+    ]
+
+
+def build_value_index() -> ValueIndex:
+    """
+    通过比赛数据库接口构建字段取值索引，并保存到config.VALUE_INDEX_PATH。
+    """
+    value_index = ValueIndex.build(
+        execute_sql_query=execute_sql_query,
+        columns=value_index_columns(),
+        page_size=config.MAX_SQL_RESULT_ROWS,
+    )
+    value_index.save(config.VALUE_INDEX_PATH)
+    return value_index
+
+
 def db_select_post_process(dbs: list[str]) -> list[str]:
     debug_mode = os.getenv("DEBUG", "0") == "1"
     logger = get_logger()
@@ -2,7 +2,17 @@
 
 import config
 from src.workflow import SqlQuery, CheckDbStructure
-from utils import execute_sql_query, db_select_post_process, table_select_post_process, foreign_key_hub
+from src.schema_cache import SchemaSelectionCache
+from src.fact_store import FactStore
+from utils import (
+    execute_sql_query,
+    aexecute_sql_query,
+    db_select_post_process,
+    table_select_post_process,
+    foreign_key_hub,
+    get_sql_rewriter,
+    schema_selection_key,
+)
 
 sql_query = SqlQuery(
     execute_sql_query=execute_sql_query,
@@ -11,6 +21,13 @@ sql_query = SqlQuery(
     cache_history_facts=True,
     specific_column_desc=config.enum_columns,
     default_sql_limit=config.MAX_SQL_RESULT_ROWS,
+    execute_sql_query_async=aexecute_sql_query,
+    stall_turns=config.SQL_STALL_TURNS,
+    fact_store=FactStore(max_tokens=config.HISTORY_FACTS_MAX_TOKENS, top_k=config.HISTORY_FACTS_TOP_K),
+    max_history_tokens=config.SQL_MAX_HISTORY_TOKENS,
+    sql_candidates=config.SQL_CANDIDATES,
+    result_workspace=config.SQL_RESULT_WORKSPACE,
+    sql_rewriter=get_sql_rewriter() if config.SQL_REWRITE else None,
 )
 sql_query.agent_master.add_system_prompt_kv(
     {
@@ -80,6 +97,9 @@ check_db_structure = CheckDbStructure(
     db_select_post_process=db_select_post_process,
     table_select_post_process=table_select_post_process,
     foreign_key_hub=foreign_key_hub(),
+    selection_cache=SchemaSelectionCache(threshold=config.SCHEMA_CACHE_THRESHOLD),
+    schema_catalog=config.schema_catalog,
+    selection_key=schema_selection_key,
 )
 check_db_structure.agent_db_selector.add_system_prompt_kv(
     {